@@ -1,13 +1,8 @@
 #!/usr/bin/env python
 
 # gis environment
-import csv
-import os
 import sys
 
-from datetime import datetime
-from pathlib import Path
-
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -19,65 +14,59 @@ from scipy.stats import linregress
 from shapely import Polygon, MultiPolygon
 
 from eo_utils import geojson_to_shapely, load_ssm, get_zonal_means
-
-ndvi_dir = "/data/tapas/pearse/ee_downloads"
-root_path = Path("/data/tapas/pearse/malawi/")
-aoi_dir = root_path/"sentinel1/aoi"
-national_parks = aoi_dir/"protected_areas.json"
+from interferogram_pairs import join_acquisitions, pair_index
+from ndvi_store import ndvi_series
+from regions import get_region
+from zonal_weights import ssm_date_columns
 
 if len(sys.argv) == 1:
     park_name = "liwonde"
 else:
     park_name = sys.argv[1]
 
-if park_name == "kasungu":
-    park_aoi = aoi_dir/"kasungu_small.geojson"
-    npark = geojson_to_shapely(national_parks, 25)
-
-    ssm_path = root_path/"SSM/kasungu_1km_20230101_20240531"
-    shp_file = ssm_path/"sm_inversions_kasungu_1km_20230101_20240531_500.shp"
-    polygon_geojson = ssm_path/"kasungu_1km_20230101_20240531/INSAR4SM_processing/SM/SM_polygons.geojson"
-
-elif park_name == "liwonde":
-    park_aoi = aoi_dir/"southern_malawi_aoi.geojson"
-    npark = geojson_to_shapely(national_parks, 6)
-
-    ssm_path = root_path/"SSM/malawi_InSAR_SSM_1km_southern_20230101_20240531"
-    shp_file = ssm_path/"sm_inversions_malawi_InSAR_SSM_1km_southern_20230101_20230531_500.shp"
-    polygon_geojson = ssm_path/"malawi_InSAR_SSM_1km_southern_20230101_20240531/INSAR4SM_processing/SM/SM_polygons.geojson"
-
-else:
-    print(f"Park name {park_name} not recognised. Must be either 'liwonde' or 'kasungu'")
+try:
+    region = get_region(park_name)
+except KeyError as e:
+    print(e)
     print("Exiting script")
-    sys.exit()
+    sys.exit(1)
+park_aoi = region.aoi
+npark = region.park()
+ssm_path = region.ssm_path
+shp_file = region.shp_file
+polygon_geojson = region.polygon_geojson
 
 bbox = geojson_to_shapely(park_aoi)
-merged_dir = root_path/f"sentinel1/{park_name}_stack/merged/interferograms"
+merged_dir = region.merged_dir
+ndvi_dir = region.ndvi_dir
 
-coherences = merged_dir.glob("*/geo_filt_fine.cor")
+pairs = pair_index(merged_dir)
 zone_means = {}
 # this could/should be optimised. Run in parallel or something more clever.
-for coh in sorted(coherences):
-    time_range = coh.parts[-2].split('_')[0]
-    zone_means[time_range] = get_zonal_means(coh, bbox, npark)
+for pair, coh in pairs["path"].items():
+    zone_means[pair] = get_zonal_means(coh, bbox, npark)
 
 # Load soil moisture results
 gdf = load_ssm(shp_file, polygon_geojson)
-ssm_datetime_array = pd.to_datetime(gdf.columns[1:], format="D%Y%m%d")
+date_cols = ssm_date_columns(gdf)
+ssm_datetime_array = pd.to_datetime(date_cols, format="D%Y%m%d")
+# SSM acquisition matching the reference date of each interferogram
+ssm_ind = join_acquisitions(pairs, ssm_datetime_array, on="reference")
+matched = ssm_ind >= 0
 gdf['intersects_park'] = gdf['geometry'].map(lambda x: x.intersects(npark))
 gdfi = gdf.where(gdf['intersects_park']).dropna()
 gdfo = gdf.where(~gdf['intersects_park']).dropna()
 
 # plot it all
-coh_datetime_array = [datetime.strptime(zm, "%Y%m%d") for zm in zone_means]
+coh_datetime_array = pairs["reference"]
 fig, ax1 = plt.subplots(2, 1, figsize=(9, 7), sharex=True, sharey=True, layout="constrained")
 fig_cor, ax1_cor = plt.subplots(2, 1, figsize=(9, 7), sharex=True, sharey=True, layout="constrained")
 outside_zone = [zone_means[zm]["outside"] for zm in zone_means]
 i = 0
 for gdf, zone in zip([gdfi, gdfo], ["inside", "outside"]):
 
-    SSM_mean = gdf.mean(numeric_only=True)
-    coh_mean = [zone_means[zm][zone] for zm in zone_means]
+    SSM_mean = gdf[date_cols].mean()
+    coh_mean = np.array([zone_means[zm][zone] for zm in zone_means], dtype=float)
 
     coh_plot = ax1[i].plot(
         coh_datetime_array,
@@ -88,14 +77,9 @@ for gdf, zone in zip([gdfi, gdfo], ["inside", "outside"]):
         f"{zone.capitalize()} {park_name.capitalize()} National Park")
     ax1[i].set_ylabel("Coherence and NDVI", fontdict={"size": 14})
 
-    ndvi_stats = os.path.join(ndvi_dir, f"{zone}_{park_name}_mean_ndvi.csv")
-    with open(ndvi_stats) as stats:
-        csv_read = csv.reader(stats)
-        date_row = next(csv_read)
-        data_row = next(csv_read)
-    ndvi_datetime_array = np.array(
-        [datetime.strptime(dr, "%Y_%m_%d_NDVI") for dr in date_row[:-1]])
-    ndvi_mean = np.array(data_row[:-1], dtype=float)
+    ndvi = ndvi_series(zone, park_name, ndvi_dir=ndvi_dir)
+    ndvi_datetime_array = ndvi.index
+    ndvi_mean = ndvi.to_numpy()
     ndvi_plot = ax1[i].plot(
         ndvi_datetime_array,
         ndvi_mean,
@@ -112,11 +96,9 @@ for gdf, zone in zip([gdfi, gdfo], ["inside", "outside"]):
     ax2.set_ylabel("Soil moisture content (%)",fontdict={"size": 14})
     ax1[i].set_ylim(0, 1)
     ax2.set_ylim(0, 50)
-    # hack for now to account for different number of coherence measurements
-    if park_name == "kasungu":
-        SSM_mean = SSM_mean[1:-1]
-    elif park_name == "liwonde":
-        SSM_mean = SSM_mean[:-1]
+    # only interferograms with an SSM acquisition on their reference date
+    SSM_mean = SSM_mean.values[ssm_ind[matched]]
+    coh_mean = coh_mean[matched]
     ax1_cor[i].plot(SSM_mean, coh_mean, 'o')
     best_fit_params = linregress(SSM_mean, coh_mean)
     x = np.linspace(np.min(SSM_mean), np.max(SSM_mean), 100)
@@ -138,8 +120,6 @@ ax1[1].legend(handles, labels,)  # loc=(0.25, 0.8))
 ax1[1].set_xlabel("Date", fontdict={"size": 14})
 ax1_cor[1].set_xlabel("Soil Moisture Content (%)", fontdict={"size": 14})
 
-fig.savefig(
-    f"/data/tapas/pearse/malawi/Coherence_NDVI_and_SSM_{park_name}.eps")
-fig_cor.savefig(
-    f"/data/tapas/pearse/malawi/SSM_coherence_cor_{park_name}.eps")
+fig.savefig(region.root_path/f"Coherence_NDVI_and_SSM_{park_name}.eps")
+fig_cor.savefig(region.root_path/f"SSM_coherence_cor_{park_name}.eps")
 plt.show()
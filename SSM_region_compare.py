@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
-import csv
+import argparse
 
-from datetime import datetime
 from pathlib import Path
+from typing import Union
 
 import geojson
 import geopandas as gpd
@@ -15,10 +15,13 @@ import pandas as pd
 
 from cycler import cycler
 from matplotlib.lines import Line2D
-from scipy.signal import correlate, correlation_lags
 from shapely.geometry import MultiPolygon, Polygon
 
+from alignment import align_interp, overlap_calendar
+from correlation import batch_xcorr, peak_lag, sampling_interval
 from eo_utils import geojson_to_shapely, load_ssm
+from ndvi_store import NDVI_DIR, ndvi_series
+from regions import get_region
 
 cbtab_cycler = cycler(
     color=[
@@ -79,7 +82,8 @@ def get_gdf_split(
 def plot_region_ssm(
         gdf: gpd.GeoDataFrame,
         nparks_geojson: str,
-        park_name: str
+        park_name: str,
+        out_dir: Union[str, Path]
         ) -> None:
 
     gdf_inside, gdf_outside = get_gdf_split(gdf, nparks_geojson, park_name)
@@ -150,16 +154,21 @@ def plot_region_ssm(
 
     SSM_mean_outside = gdf_outside.mean(numeric_only=True)
     SSM_mean_inside = gdf_inside.mean(numeric_only=True)
-    ssm_cor = correlate(
-        SSM_mean_outside/np.max(SSM_mean_outside),
-        SSM_mean_inside/np.max(SSM_mean_inside)
+    # acquisitions are irregular, so resample onto a regular calendar at
+    # the typical spacing for the lags to be in days
+    step = max(1, round(sampling_interval(df_datetimes)))
+    calendar = overlap_calendar(step, df_datetimes)
+    ssm_cor, cor_lags = batch_xcorr(
+        align_interp(SSM_mean_outside.values, df_datetimes, calendar),
+        align_interp(SSM_mean_inside.values, df_datetimes, calendar),
+        step
         )
-    cor_lags = correlation_lags(len(SSM_mean_outside), len(SSM_mean_inside))
     ax_cor.plot(
         cor_lags,
         ssm_cor
     )
-    print(f"Max SSM correlation {park_name}: {np.max(ssm_cor)}")
+    max_cor, max_lag = peak_lag(ssm_cor, cor_lags)
+    print(f"Max SSM correlation {park_name}: {max_cor} at {max_lag} days")
     ax_cor.set_xlabel("lag (days)")
     ax_cor.set_ylabel("correlation coefficient")
     ax[0].legend()
@@ -168,15 +177,17 @@ def plot_region_ssm(
         Line2D([0], [0], marker='v', label='Decreasing Moisture')
     ]
     ax[1].legend(handles=ax1_legend_elements)
-    fig.savefig(f"/data/tapas/pearse/malawi/SSM_{park_name}.eps")
-    fig_cor.savefig(f"/data/tapas/pearse/malawi/SSM_correlation_{park_name}.eps")
+    fig.savefig(Path(out_dir)/f"SSM_{park_name}.eps")
+    fig_cor.savefig(Path(out_dir)/f"SSM_correlation_{park_name}.eps")
     return
 
 
 def plot_ssm_ndvi(
         gdf: gpd.GeoDataFrame,
         nparks_geojson: str,
-        park_name: str
+        park_name: str,
+        out_dir: Union[str, Path],
+        ndvi_dir: Union[str, Path] = NDVI_DIR
         ) -> None:
     gdf_inside, gdf_outside = get_gdf_split(gdf, nparks_geojson, park_name)
 
@@ -201,14 +212,9 @@ def plot_ssm_ndvi(
             + " Park"
             )
 
-        stat_file = f"/data/tapas/pearse/ee_downloads/{sub_label.lower()}_{park_name.lower()}_mean_ndvi.csv"
-        with open(stat_file) as stats:
-            csv_read = csv.reader(stats)
-            date_row = next(csv_read)
-            data_row = next(csv_read)
-        dt_arr = np.array(
-            [datetime.strptime(dr, "%Y_%m_%d_NDVI") for dr in date_row[:-1]])
-        ndvi_mean = np.array(data_row[:-1], dtype=float)
+        ndvi = ndvi_series(sub_label, park_name, ndvi_dir=ndvi_dir)
+        dt_arr = ndvi.index
+        ndvi_mean = ndvi.to_numpy()
         ax[1].plot(
             dt_arr,
             ndvi_mean,
@@ -217,19 +223,12 @@ def plot_ssm_ndvi(
             + " "
             + park_name.capitalize()
             + " Park")
-        day0 = datetime(2023, 1, 1)
-        total_days = (datetime(2024, 5, 31) - day0).days
-        day_array = np.arange(0, total_days, 4)
-        ssm_days = (df_datetimes - df_datetimes[0]).days
-        ndvi_days = np.array([(day - dt_arr[0]).days for day in dt_arr])
-
-        ssm_interp = np.interp(day_array, ssm_days, SSM_mean)
-        ndvi_interp = np.interp(day_array, ndvi_days, ndvi_mean)
-        ssm_ndvi_cor = correlate(
-            ssm_interp/np.max(ssm_interp),
-            ndvi_interp/np.max(ndvi_interp))
-        cor_lags = correlation_lags(len(ssm_interp), len(ndvi_interp))
-        print(f"Max correlation between SSM and NDVI {sub_label} {park_name}: {np.max(ssm_ndvi_cor)}")
+        calendar = overlap_calendar(4, df_datetimes, dt_arr)
+        ssm_interp = align_interp(SSM_mean.values, df_datetimes, calendar)
+        ndvi_interp = align_interp(ndvi_mean, dt_arr, calendar)
+        ssm_ndvi_cor, cor_lags = batch_xcorr(ssm_interp, ndvi_interp, 4)
+        max_cor, max_lag = peak_lag(ssm_ndvi_cor, cor_lags)
+        print(f"Max correlation between SSM and NDVI {sub_label} {park_name}: {max_cor} at {max_lag} days")
         ax_cor.plot(
             cor_lags,
             ssm_ndvi_cor,
@@ -247,15 +246,16 @@ def plot_ssm_ndvi(
     ax[1].legend()
     ax[1].set_xlabel("Date")
 
-    fig.savefig(f"/data/tapas/pearse/malawi/SSM_NDVI_{park_name}.png")
-    fig_cor.savefig(
-        f"/data/tapas/pearse/malawi/SSM_NDVI_correlation_{park_name}.png")
+    fig.savefig(Path(out_dir)/f"SSM_NDVI_{park_name}.png")
+    fig_cor.savefig(Path(out_dir)/f"SSM_NDVI_correlation_{park_name}.png")
     return
 
 
 def plot_region_ndvi(
         nparks_geojson: str,
-        park_name: str
+        park_name: str,
+        out_dir: Union[str, Path],
+        ndvi_dir: Union[str, Path] = NDVI_DIR
         ) -> None:
 
     fig, ax = plt.subplots(
@@ -263,16 +263,10 @@ def plot_region_ndvi(
     fig_cor, ax_cor = plt.subplots(1, 1, figsize=(9, 7))
     ndvi_means = []
     for sub_label in ["Inside", "Outside"]:
-        stat_file = f"/data/tapas/pearse/ee_downloads/{sub_label.lower()}_{park_name.lower()}_mean_ndvi.csv"
-        with open(stat_file) as stats:
-            csv_read = csv.reader(stats)
-            date_row = next(csv_read)
-            data_row = next(csv_read)
-        dt_arr = np.array(
-            [datetime.strptime(dr, "%Y_%m_%d_NDVI") for dr in date_row[:-1]])
-        ndvi_mean = np.array(data_row[:-1], dtype=float)
-        days_arr = np.array(
-            [(dt_arr - dt_arr[0])[i].days for i in range(len(dt_arr))])
+        ndvi = ndvi_series(sub_label, park_name, ndvi_dir=ndvi_dir)
+        dt_arr = ndvi.index
+        ndvi_mean = ndvi.to_numpy()
+        days_arr = (dt_arr - dt_arr[0]).days.to_numpy()
         ndvi_rate = np.gradient(ndvi_mean, days_arr)
         ax[0].plot(
             dt_arr,
@@ -293,12 +287,13 @@ def plot_region_ndvi(
         )
         ndvi_means.append(ndvi_mean)
     ndvi_mean_inside, ndvi_mean_outside = ndvi_means
-    ndvi_cor = correlate(
-        ndvi_mean_outside/np.max(ndvi_mean_outside),
-        ndvi_mean_inside/np.max(ndvi_mean_inside)
+    ndvi_cor, cor_lags = batch_xcorr(
+        ndvi_mean_outside,
+        ndvi_mean_inside,
+        sampling_interval(dt_arr)
         )
-    cor_lags = correlation_lags(len(ndvi_mean_outside), len(ndvi_mean_inside))
-    print(f"Max NDVI correlation {park_name}: {np.max(ndvi_cor)}")
+    max_cor, max_lag = peak_lag(ndvi_cor, cor_lags)
+    print(f"Max NDVI correlation {park_name}: {max_cor} at {max_lag} days")
     ax_cor.plot(
         cor_lags,
         ndvi_cor
@@ -310,33 +305,31 @@ def plot_region_ndvi(
     # ax[0].legend()
     ax[1].legend()
     ax[1].set_xlabel("Date")
-    fig.savefig(f"/data/tapas/pearse/malawi/NDVI_{park_name}.png")
-    fig_cor.savefig(f"/data/tapas/pearse/malawi/NDVI_correlation_{park_name}.png")
+    fig.savefig(Path(out_dir)/f"NDVI_{park_name}.png")
+    fig_cor.savefig(Path(out_dir)/f"NDVI_correlation_{park_name}.png")
     return
 
 
 if __name__ == "__main__":
-    root_path = Path("/data/tapas/pearse/malawi/SSM")
-    nparks_geojson = root_path.parent/"sentinel1/aoi/protected_areas.json"
-    for ssm_results, park_name in zip(
-        [
-            "malawi_InSAR_SSM_1km_southern_20230101_20240531",
-            "kasungu_1km_20230101_20240531"
-        ],
-        [
-            "LIWONDE",
-            "KASUNGU"
-        ]
-    ):
-        ssm_path = root_path/ssm_results
-        shp_file = list(ssm_path.glob("*shp"))[0]
-        polygon_geojson = ssm_path/ssm_results/"INSAR4SM_processing/SM/SM_polygons.geojson"
-        gdf = load_ssm(
-            shp_file,
-            polygon_geojson
-            )
-        plot_region_ssm(gdf, nparks_geojson, park_name)
-        plot_region_ndvi(nparks_geojson, park_name)
-        plot_ssm_ndvi(gdf, nparks_geojson, park_name)
+    parser = argparse.ArgumentParser(
+        description='Inside/outside park SSM and NDVI time series figures')
+    parser.add_argument(
+        'regions',
+        nargs='*',
+        default=["liwonde", "kasungu"],
+        help='regions in regions.toml. Default is liwonde and kasungu')
+    args = parser.parse_args()
+
+    for region in map(get_region, args.regions):
+        park_name = region.name.upper()
+        gdf = load_ssm(region.shp_file, region.polygon_geojson)
+        plot_region_ssm(
+            gdf, region.national_parks, park_name, region.root_path)
+        plot_region_ndvi(
+            region.national_parks, park_name, region.root_path,
+            region.ndvi_dir)
+        plot_ssm_ndvi(
+            gdf, region.national_parks, park_name, region.root_path,
+            region.ndvi_dir)
 
     # plt.show()
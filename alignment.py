@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Resample irregular time series onto a common calendar.
+12 day SSM, 16 day MODIS NDVI, interferogram pairs and hourly ERA5 all
+arrive on their own dates. Every function here takes values with time on
+the last axis, so a single series and a (polygons x time) array are
+handled the same way.
+"""
+
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from ssm_cube import datetime_ns, nearest_index
+
+
+def common_calendar(
+        start: Union[str, pd.Timestamp],
+        end: Union[str, pd.Timestamp],
+        step_days: int
+        ) -> pd.DatetimeIndex:
+    """
+    Regular calendar from start to end every step_days
+    """
+    return pd.date_range(start, end, freq=f"{step_days}D")
+
+
+def overlap_calendar(
+        step_days: int,
+        *date_arrays: Union[pd.DatetimeIndex, np.ndarray]
+        ) -> pd.DatetimeIndex:
+    """
+    Regular calendar covering only the period all the series have data for
+    """
+    start = max(pd.DatetimeIndex(dates).min() for dates in date_arrays)
+    end = min(pd.DatetimeIndex(dates).max() for dates in date_arrays)
+    return common_calendar(start, end, step_days)
+
+
+def align_interp(
+        values: np.ndarray,
+        dates: Union[pd.DatetimeIndex, np.ndarray],
+        target: pd.DatetimeIndex
+        ) -> np.ndarray:
+    """
+    Linear interpolation in time onto target.
+    Targets outside the range of dates are NaN. Where dates repeat, a
+    target on the repeated date takes the last sample on it.
+    """
+    src = datetime_ns(dates)
+    tgt = datetime_ns(target)
+    values = np.asarray(values, dtype=float)
+    if len(src) < 2:
+        # nothing to interpolate between, only an exact match has a value
+        aligned = np.full(values.shape[:-1] + (len(tgt),), np.nan)
+        if len(src):
+            aligned[..., tgt == src[0]] = values[..., :1]
+        return aligned
+    right = np.clip(np.searchsorted(src, tgt, side="right"), 1, len(src) - 1)
+    left = right - 1
+    span = src[right] - src[left]
+    weight = np.divide(
+        tgt - src[left], span, out=np.ones(len(tgt)), where=span > 0)
+    aligned = values[..., left]*(1 - weight) + values[..., right]*weight
+    outside = (tgt < src[0]) | (tgt > src[-1])
+    aligned[..., outside] = np.nan
+    return aligned
+
+
+def align_window(
+        values: np.ndarray,
+        dates: Union[pd.DatetimeIndex, np.ndarray],
+        target: pd.DatetimeIndex,
+        how: str = "sum",
+        window: Union[pd.Timedelta, None] = None
+        ) -> np.ndarray:
+    """
+    Sum or mean of the samples in the window ending at each target date.
+    Windows are open at the start and closed at the end: by default
+    (previous target, target], so hourly precipitation becomes the
+    accumulation over each revisit and the first target is NaN. A sample
+    on a target date counts towards the window ending there, which suits
+    ERA5, where each hour holds the accumulation over the hour before it.
+    With window, every target uses (target - window, target].
+    """
+    src = datetime_ns(dates)
+    tgt = datetime_ns(target)
+    values = np.asarray(values, dtype=float)
+    finite = np.isfinite(values)
+    zero = np.zeros(values.shape[:-1] + (1,))
+    cumulative = np.concatenate(
+        [zero, np.cumsum(np.where(finite, values, 0), axis=-1)], axis=-1)
+    counts = np.concatenate(
+        [zero, np.cumsum(finite, axis=-1)], axis=-1)
+
+    right = np.searchsorted(src, tgt, side="right")
+    if window is None:
+        left = np.empty_like(right)
+        left[1:] = right[:-1]
+        left[0] = right[0]
+    else:
+        left = np.searchsorted(
+            src, tgt - pd.Timedelta(window).value, side="right")
+    total = cumulative[..., right] - cumulative[..., left]
+    count = counts[..., right] - counts[..., left]
+    if how == "sum":
+        aligned = np.where(count > 0, total, np.nan)
+    elif how == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            aligned = total/count
+    else:
+        raise ValueError(f"how must be 'sum' or 'mean', not {how}")
+    if window is None:
+        aligned[..., 0] = np.nan
+    return aligned
+
+
+def align_nearest(
+        values: np.ndarray,
+        dates: Union[pd.DatetimeIndex, np.ndarray],
+        target: pd.DatetimeIndex,
+        tolerance: Union[pd.Timedelta, None] = None
+        ) -> np.ndarray:
+    """
+    Value of the nearest sample to each target date,
+    NaN where the nearest one is further away than tolerance.
+    """
+    ind = nearest_index(pd.DatetimeIndex(dates), target, tolerance)
+    aligned = np.asarray(values, dtype=float)[..., ind]
+    aligned[..., ind < 0] = np.nan
+    return aligned
+
+
+def align_all(
+        series: dict,
+        target: pd.DatetimeIndex
+        ) -> dict:
+    """
+    Align several series at once.
+    series maps a name to (values, dates, method) or
+    (values, dates, method, kwargs) where method is one of
+    "interp", "sum", "mean" or "nearest".
+    """
+    aligned = {}
+    for name, (values, dates, method, *kwargs) in series.items():
+        kwargs = kwargs[0] if kwargs else {}
+        if method == "interp":
+            aligned[name] = align_interp(values, dates, target)
+        elif method in ["sum", "mean"]:
+            aligned[name] = align_window(
+                values, dates, target, how=method, **kwargs)
+        elif method == "nearest":
+            aligned[name] = align_nearest(values, dates, target, **kwargs)
+        else:
+            raise ValueError(f"Unknown alignment method {method} for {name}")
+    return aligned
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Split a large footprint into overlapping AOI tiles for separate INSAR4SM
+runs, and mosaic the tiles' results back into one SSM result.
+Tiles are laid out on multiples of the SSM grid spacing in one UTM
+zone, so every tile's cells line up. Each tile owns the cells whose
+centroid falls in its core (the tile without the overlap) in that zone,
+which is how the overlapping results are de-duplicated in the mosaic.
+"""
+
+import argparse
+
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from shapely.geometry import box
+
+from eo_utils import load_ssm
+
+
+def tile_aoi(
+        footprint: gpd.GeoSeries,
+        tile_size: float = 50e3,
+        overlap: float = 5e3,
+        grid_size: float = 1e3
+        ) -> gpd.GeoDataFrame:
+    """
+    Tiles of about tile_size metres covering footprint, each processing
+    AOI extending overlap metres past its core. Sizes are rounded to
+    multiples of grid_size and processing AOIs are clipped to the
+    footprint's extent snapped out to the grid, so every edge is on the
+    grid. Returns a GeoDataFrame in the footprint's CRS indexed by
+    tile_id with the processing AOI as geometry, and the core's UTM bounds
+    (west, south, east, north) and utm_crs for `mosaic_results`.
+    """
+    crs = footprint.crs
+    utm = footprint.estimate_utm_crs()
+    area = footprint.to_crs(utm).union_all()
+    tile_size = max(1, round(tile_size/grid_size))*grid_size
+    overlap = np.ceil(overlap/grid_size)*grid_size
+
+    west, south, east, north = area.bounds
+    west, south = np.floor(np.array([west, south])/grid_size)*grid_size
+    east, north = np.ceil(np.array([east, north])/grid_size)*grid_size
+    x0 = np.arange(west, east, tile_size)
+    y0 = np.arange(south, north, tile_size)
+    x0, y0 = np.meshgrid(x0, y0)
+    rows, cols = np.indices(x0.shape)
+    bounds = np.column_stack([
+        x0.ravel(), y0.ravel(),
+        x0.ravel() + tile_size, y0.ravel() + tile_size])
+    keep = gpd.GeoSeries(
+        [box(*b) for b in bounds], crs=utm).intersects(area).to_numpy()
+    bounds = bounds[keep]
+
+    # processing AOIs stay on the grid: buffered cores clipped to the
+    # snapped footprint extent
+    aois = gpd.GeoSeries(
+        [
+            box(
+                max(w - overlap, west), max(s - overlap, south),
+                min(e + overlap, east), min(n + overlap, north))
+            for w, s, e, n in bounds],
+        crs=utm)
+    tiles = gpd.GeoDataFrame(
+        {
+            "row": rows.ravel()[keep],
+            "col": cols.ravel()[keep],
+            "west": bounds[:, 0],
+            "south": bounds[:, 1],
+            "east": bounds[:, 2],
+            "north": bounds[:, 3],
+            "utm_crs": utm.to_string()},
+        geometry=aois.to_crs(crs).to_numpy(),
+        crs=crs)
+    tiles.index = pd.Index(
+        [f"tile_{r:02d}_{c:02d}" for r, c in zip(tiles["row"], tiles["col"])],
+        name="tile_id")
+    return tiles
+
+
+def write_tile_aois(
+        tiles: gpd.GeoDataFrame,
+        out_dir: Union[str, Path]
+        ) -> list:
+    """
+    One AOI geojson per tile, as make_aoi.py writes them, plus
+    tiles.geojson with the cores and their UTM bounds for `mosaic_results`.
+    Returns the AOI files.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    aoi_files = []
+    for tile_id, tile in tiles.iterrows():
+        aoi_file = out_dir/f"{tile_id}.geojson"
+        gpd.GeoSeries([tile.geometry], crs=tiles.crs).to_file(
+            aoi_file, driver="GeoJSON")
+        aoi_files.append(aoi_file)
+    cores = gpd.GeoSeries(
+        [
+            box(t.west, t.south, t.east, t.north)
+            for t in tiles.itertuples()],
+        crs=tiles["utm_crs"].iloc[0]).to_crs(tiles.crs)
+    gpd.GeoDataFrame(
+        tiles.drop(columns="geometry"), geometry=cores.to_numpy(),
+        crs=tiles.crs).to_file(out_dir/"tiles.geojson", driver="GeoJSON")
+    return aoi_files
+
+
+def owned_by_core(
+        gdf: gpd.GeoDataFrame,
+        tile: pd.Series
+        ) -> np.ndarray:
+    """
+    Mask of the polygons whose centroid is in tile's core, in the UTM CRS
+    the tiles were laid out in, so neighbouring tiles split the overlap
+    exactly. The core's north and east edges are left out so a centroid
+    on a shared edge belongs to exactly one tile.
+    """
+    centroids = gdf.geometry.to_crs(tile["utm_crs"]).centroid
+    return (
+        (centroids.x >= tile["west"]) & (centroids.x < tile["east"])
+        & (centroids.y >= tile["south"]) & (centroids.y < tile["north"])
+        ).to_numpy()
+
+
+def mosaic_results(
+        tiles: gpd.GeoDataFrame,
+        results_dir: Union[str, Path]
+        ) -> gpd.GeoDataFrame:
+    """
+    Mosaic of the `load_ssm` results of every tile, where tile_id's
+    results are in results_dir/tile_id laid out like any other SSM run.
+    Cells in the overlap are taken from the tile whose core they are in.
+    Tiles without results are skipped with a message.
+    """
+    results_dir = Path(results_dir)
+    parts = []
+    for tile_id, tile in tiles.iterrows():
+        ssm_path = results_dir/tile_id
+        shp_files = list(ssm_path.glob("sm_inversions_*.shp"))
+        if not shp_files:
+            print(f"No results for {tile_id}, skipping")
+            continue
+        polygon_geojson = ssm_path/ssm_path.name/"INSAR4SM_processing/SM/SM_polygons.geojson"
+        gdf = load_ssm(shp_files[0], polygon_geojson)
+        parts.append(gdf[owned_by_core(gdf, tile)])
+    if not parts:
+        raise FileNotFoundError(
+            f"No tile results in {results_dir} for any of {len(tiles)} tiles")
+    mosaic = pd.concat(parts, ignore_index=True)
+    date_cols = sorted(c for c in mosaic.columns if c != "geometry")
+    return gpd.GeoDataFrame(
+        mosaic[["geometry"] + date_cols], geometry="geometry", crs=parts[0].crs)
+
+
+def write_mosaic(
+        mosaic: gpd.GeoDataFrame,
+        out_dir: Union[str, Path],
+        name: str
+        ) -> tuple[Path, Path]:
+    """
+    Write the mosaic so `load_ssm` reads it like a single run:
+    out_dir/sm_inversions_<name>.shp and
+    out_dir/<name>/INSAR4SM_processing/SM/SM_polygons.geojson
+    """
+    out_dir = Path(out_dir)
+    polygon_geojson = out_dir/name/"INSAR4SM_processing/SM/SM_polygons.geojson"
+    polygon_geojson.parent.mkdir(parents=True, exist_ok=True)
+    shp_file = out_dir/f"sm_inversions_{name}.shp"
+    mosaic.to_file(shp_file)
+    mosaic[["geometry"]].to_file(polygon_geojson, driver="GeoJSON")
+    return shp_file, polygon_geojson
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Tile an AOI for INSAR4SM, or mosaic the tile results')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    tile_parser = subparsers.add_parser('tile', help='write tile AOIs')
+    tile_parser.add_argument('footprint', help='AOI/footprint geojson')
+    tile_parser.add_argument('out_dir', help='where to write the tile AOIs')
+    tile_parser.add_argument(
+        '-t',
+        '--tile_size',
+        type=float,
+        default=50e3,
+        help='tile size in metres')
+    tile_parser.add_argument(
+        '-o',
+        '--overlap',
+        type=float,
+        default=5e3,
+        help='overlap between tiles in metres')
+    tile_parser.add_argument(
+        '-g',
+        '--grid_size',
+        type=float,
+        default=1e3,
+        help='SSM grid spacing in metres')
+    mosaic_parser = subparsers.add_parser('mosaic', help='mosaic tile results')
+    mosaic_parser.add_argument('tiles', help='tiles.geojson from the tile step')
+    mosaic_parser.add_argument(
+        'results_dir', help='directory with one SSM result directory per tile')
+    mosaic_parser.add_argument('name', help='name of the mosaicked result')
+    args = parser.parse_args()
+
+    if args.command == 'tile':
+        tiles = tile_aoi(
+            gpd.read_file(args.footprint).geometry,
+            args.tile_size,
+            args.overlap,
+            args.grid_size)
+        aoi_files = write_tile_aois(tiles, args.out_dir)
+        print(f"Wrote {len(aoi_files)} tile AOIs to {args.out_dir}")
+    else:
+        tiles = gpd.read_file(args.tiles).set_index("tile_id")
+        mosaic = mosaic_results(tiles, args.results_dir)
+        shp_file, polygon_geojson = write_mosaic(
+            mosaic, args.results_dir, args.name)
+        print(f"Wrote {len(mosaic)} polygons to {shp_file}")
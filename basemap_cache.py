@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Basemap tiles fetched and warped once per (extent, zoom, provider, CRS).
+Warped images are kept in memory and on disk, so a figure run with many
+panels of the same extent only hits the tile server once, and a run with
+a pre-seeded cache directory needs no network at all (set
+BASEMAP_OFFLINE=1 on the air-gapped nodes).
+"""
+
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from typing import Union
+
+import contextily as cx
+import numpy as np
+
+from matplotlib.axes import Axes
+from rasterio.warp import transform_bounds
+from xyzservices import TileProvider
+
+from file_utils import atomic_write
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get(
+        "BASEMAP_CACHE",
+        Path.home()/".cache/eo_scripts/basemaps"))
+_basemaps = {}
+
+
+def _offline() -> bool:
+    return os.environ.get("BASEMAP_OFFLINE", "0") not in ["", "0"]
+
+
+def basemap_key(
+        extent: tuple,
+        crs: str,
+        source: TileProvider,
+        zoom: Union[int, str]
+        ) -> str:
+    """
+    Hash identifying a warped basemap
+    """
+    key = json.dumps([
+        [round(float(e), 6) for e in extent],
+        str(crs),
+        getattr(source, "name", str(source)),
+        zoom])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_basemap(
+        extent: tuple,
+        crs: str,
+        source: TileProvider = cx.providers.CartoDB.Voyager,
+        zoom: Union[int, str] = "auto",
+        cache_dir: Union[str, Path, None] = None,
+        offline: Union[bool, None] = None
+        ) -> tuple[np.ndarray, tuple]:
+    """
+    Basemap image covering extent (xmin, xmax, ymin, ymax in crs), warped
+    to crs. Returns the image and its extent, ready for imshow.
+    Looks in memory, then cache_dir, then fetches the tiles unless
+    offline, in which case a missing basemap is an error.
+    """
+    cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else Path(cache_dir)
+    offline = _offline() if offline is None else offline
+    key = basemap_key(extent, crs, source, zoom)
+    if key in _basemaps:
+        return _basemaps[key]
+
+    cache_file = cache_dir/f"{key}.npz"
+    if cache_file.exists():
+        cached = np.load(cache_file)
+        basemap = (cached["img"], tuple(cached["ext"]))
+    elif offline:
+        raise FileNotFoundError(
+            f"No cached basemap for extent {extent} in {crs} in {cache_dir}")
+    else:
+        xmin, xmax, ymin, ymax = extent
+        west, south, east, north = transform_bounds(
+            crs, "EPSG:4326", xmin, ymin, xmax, ymax)
+        img, ext = cx.bounds2img(
+            west, south, east, north, zoom=zoom, source=source, ll=True)
+        img, ext = cx.warp_tiles(img, ext, t_crs=crs)
+        basemap = (img, tuple(ext))
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with atomic_write(cache_file) as f:
+            np.savez_compressed(f, img=img, ext=np.array(ext))
+
+    _basemaps[key] = basemap
+    return basemap
+
+
+def add_cached_basemap(
+        ax: Axes,
+        crs: str,
+        source: TileProvider = cx.providers.CartoDB.Voyager,
+        zoom: Union[int, str] = "auto",
+        extent: Union[tuple, None] = None,
+        cache_dir: Union[str, Path, None] = None,
+        offline: Union[bool, None] = None
+        ) -> Axes:
+    """
+    Drop-in for `cx.add_basemap` using the cache.
+    extent defaults to the current axis limits.
+    """
+    if extent is None:
+        extent = ax.axis()
+    img, ext = get_basemap(extent, crs, source, zoom, cache_dir, offline)
+    ax.imshow(img, extent=ext, interpolation="bilinear", zorder=0)
+    ax.axis(extent)
+    return ax
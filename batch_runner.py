@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Run the per-region analysis scripts for every region in regions.toml
+in one parallel job.
+Each (region, script) run is its own process, so regions are processed
+concurrently. They share the on-disk basemap and NDVI caches, which are
+written atomically, and the NDVI store is built once up front so the runs
+don't all parse the CSVs at the same time. Writes a timing report with
+one row per run.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from basemap_cache import DEFAULT_CACHE_DIR
+from ndvi_store import load_ndvi
+from regions import DEFAULT_CONFIG, Region, load_regions
+
+SCRIPTS = ["SSM_analysis.py", "SSM_coherence_compare.py"]
+
+
+def run_script(
+        region: Region,
+        script: str,
+        config_file: Union[str, Path],
+        workers: int = 1
+        ) -> dict:
+    """
+    Run script for region with pools of workers processes,
+    logging to ssm_path/logs/<script>.log
+    """
+    log_dir = region.ssm_path/"logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log_file = log_dir/f"{Path(script).stem}.log"
+    env = {
+        **os.environ,
+        "EO_REGIONS": str(config_file),
+        "BASEMAP_CACHE": str(DEFAULT_CACHE_DIR),
+        "EO_WORKERS": str(workers),
+        "MPLBACKEND": "Agg"}
+    t0 = time.perf_counter()
+    with open(log_file, "w") as log:
+        completed = subprocess.run(
+            [sys.executable, Path(__file__).with_name(script), region.name],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env)
+    return {
+        "region": region.name,
+        "script": script,
+        "seconds": round(time.perf_counter() - t0, 1),
+        "returncode": completed.returncode,
+        "log": str(log_file)}
+
+
+def run_batch(
+        regions: list,
+        scripts: list = SCRIPTS,
+        config_file: Union[str, Path] = DEFAULT_CONFIG,
+        processes: Union[int, None] = None,
+        workers: Union[int, None] = None
+        ) -> pd.DataFrame:
+    """
+    Run every script for every region, processes at a time.
+    Each run's own pools get workers processes, by default an equal share
+    of the CPUs so concurrent runs don't oversubscribe the node.
+    Returns the timing report.
+    """
+    for ndvi_dir in {region.ndvi_dir for region in regions}:
+        if ndvi_dir.exists():
+            load_ndvi(ndvi_dir)
+    jobs = [(region, script) for region in regions for script in scripts]
+    processes = min(processes or os.cpu_count(), len(jobs)) or 1
+    workers = workers or max(1, os.cpu_count()//processes)
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(run_script, region, script, config_file, workers)
+            for region, script in jobs]
+        report = [future.result() for future in futures]
+    return pd.DataFrame(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Run the analysis scripts for many regions in parallel')
+    parser.add_argument(
+        'regions',
+        nargs='*',
+        help='regions to run. Default is every region in the config')
+    parser.add_argument(
+        '-c',
+        '--config',
+        default=DEFAULT_CONFIG,
+        help='region config file (TOML or YAML)')
+    parser.add_argument(
+        '-s',
+        '--scripts',
+        nargs='+',
+        default=SCRIPTS,
+        help='scripts to run for each region')
+    parser.add_argument(
+        '-p',
+        '--processes',
+        type=int,
+        help='runs at once. Default is the number of CPUs')
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        help='pool processes for each run. Default is CPUs/runs at once')
+    parser.add_argument(
+        '-r',
+        '--report',
+        default="batch_timing.csv",
+        help='where to write the timing report')
+    args = parser.parse_args()
+
+    all_regions = load_regions(args.config)
+    names = args.regions or list(all_regions)
+    report = run_batch(
+        [all_regions[name] for name in names],
+        args.scripts,
+        Path(args.config).resolve(),
+        args.processes,
+        args.workers)
+    report.to_csv(args.report, index=False)
+    print(report.to_string(index=False))
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""
+Per-polygon SSM climatology and standardised anomalies.
+Acquisitions are binned by day of year (or season), with a tolerance so
+every bin also takes acquisitions just outside it. Each polygon's count,
+mean and sum of squared deviations per bin are merged with every new
+batch of acquisitions (Chan/Welford), and a fixed-edge histogram per bin
+gives the percentiles, so adding an acquisition costs a merge, not a
+recompute of the whole history. Each update writes the statistics to a
+new directory and only then points the manifest at it, so a run that
+dies part way leaves the previous climatology as it was and can simply
+be rerun.
+"""
+
+import argparse
+import json
+import shutil
+
+from datetime import datetime
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from numpy.lib.format import open_memmap
+
+from file_utils import write_json
+from regions import get_region
+from ssm_cube import SSMCube
+
+MANIFEST_FILE = "manifest.json"
+YEAR_DAYS = 366
+# Malawi's rainy, cool dry and hot dry seasons as (first month, last month)
+MALAWI_SEASONS = {"rainy": (11, 4), "cool": (5, 8), "hot": (9, 10)}
+# SSM histogram edges in percent, values outside go in the end bins
+HIST_EDGES = np.arange(0, 61, 1.0)
+STATISTICS = ["count", "mean", "m2", "hist"]
+
+
+def doy_bins(bin_days: int = 12) -> pd.DataFrame:
+    """
+    Day-of-year bins of bin_days, as first and last day of year.
+    The last bin takes the days left over at the end of the year.
+    """
+    starts = np.arange(1, YEAR_DAYS + 1 - bin_days//2, bin_days)
+    ends = np.append(starts[1:] - 1, YEAR_DAYS)
+    return pd.DataFrame(
+        {"start": starts, "end": ends},
+        index=pd.Index([f"doy{s:03d}" for s in starts], name="bin"))
+
+
+def season_bins(seasons: dict = MALAWI_SEASONS) -> pd.DataFrame:
+    """
+    Bins for seasons given as name: (first month, last month).
+    Seasons can wrap round the end of the year.
+    """
+    starts, ends = [], []
+    for first, last in seasons.values():
+        starts.append(pd.Timestamp(2024, first, 1).dayofyear)
+        ends.append((pd.Timestamp(2024, last, 1) + pd.offsets.MonthEnd()).dayofyear)
+    return pd.DataFrame(
+        {"start": starts, "end": ends},
+        index=pd.Index(list(seasons), name="bin"))
+
+
+def bin_distance(
+        dates: Union[pd.DatetimeIndex, np.ndarray, list],
+        bins: pd.DataFrame
+        ) -> np.ndarray:
+    """
+    (dates x bins) days from each date to each bin, 0 inside the bin
+    """
+    doy = pd.DatetimeIndex(dates).dayofyear.to_numpy()[:, None]
+    start = bins["start"].to_numpy()[None, :]
+    length = (bins["end"].to_numpy()[None, :] - start) % YEAR_DAYS
+    offset = (doy - start) % YEAR_DAYS
+    return np.where(
+        offset <= length, 0, np.minimum(offset - length, YEAR_DAYS - offset))
+
+
+class Climatology:
+    """
+    Climatology of an SSM grid stored in a directory:
+        manifest.json: bins, tolerance, edges, the dates included and the
+            subdirectory holding the statistics of those dates
+        count, mean, m2: (polygon x bin) running statistics
+        hist: (polygon x bin x histogram bin) counts for percentiles
+    Create with `create`, open an existing one with the constructor.
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str = "r") -> None:
+        self.path = Path(path)
+        self.mode = mode
+        with open(self.path/MANIFEST_FILE) as f:
+            self.manifest = json.load(f)
+        config = self.manifest["config"]
+        self.bins = pd.DataFrame(
+            config["bins"]).set_index("bin")[["start", "end"]]
+        self.tolerance = config["tolerance"]
+        self.edges = np.asarray(config["edges"])
+        self._load()
+
+    def _load(self) -> None:
+        # climatologies from before generations keep their arrays in path
+        array_dir = self.path/self.manifest.get("arrays", "")
+        self.count, self.mean, self.m2, self.hist = (
+            np.load(array_dir/f"{name}.npy", mmap_mode=self.mode)
+            for name in STATISTICS)
+
+    def _commit(self, arrays: list, dates: pd.DatetimeIndex) -> None:
+        """
+        Write the statistics including dates to a new directory, then
+        switch the manifest to it in one atomic write. A directory left by
+        a run that died before the switch is never read and is overwritten
+        or removed by the next update.
+        """
+        generation = self.manifest.get("generation", -1) + 1
+        array_dir = f"arrays{generation}"
+        (self.path/array_dir).mkdir(exist_ok=True)
+        for name, array in zip(STATISTICS, arrays):
+            np.save(self.path/array_dir/f"{name}.npy", array)
+
+        manifest = dict(self.manifest)
+        manifest["generation"] = generation
+        manifest["arrays"] = array_dir
+        manifest["dates"] = sorted(
+            manifest["dates"] + list(dates.strftime("%Y-%m-%d")))
+        manifest["updated"] = datetime.now().isoformat()
+        write_json(self.path/MANIFEST_FILE, manifest)
+        self.manifest = manifest
+        self._load()
+
+        for old in self.path.glob("arrays*"):
+            if old.is_dir() and old.name != array_dir:
+                shutil.rmtree(old)
+        for name in STATISTICS:
+            (self.path/f"{name}.npy").unlink(missing_ok=True)
+
+    @classmethod
+    def create(
+            cls,
+            path: Union[str, Path],
+            n_polygons: int,
+            bins: Union[pd.DataFrame, None] = None,
+            tolerance: int = 6,
+            edges: np.ndarray = HIST_EDGES
+            ) -> "Climatology":
+        """
+        Empty climatology of n_polygons with bins (default 12 day
+        day-of-year bins) taking acquisitions up to tolerance days outside
+        """
+        path = Path(path)
+        bins = doy_bins() if bins is None else bins
+        shape = (n_polygons, len(bins))
+        (path/"arrays0").mkdir(parents=True, exist_ok=True)
+        for name, dtype in [
+                ("count", np.int32), ("mean", np.float64), ("m2", np.float64)]:
+            open_memmap(
+                path/"arrays0"/f"{name}.npy", mode="w+", dtype=dtype,
+                shape=shape)
+        open_memmap(
+            path/"arrays0"/"hist.npy",
+            mode="w+",
+            dtype=np.uint16,
+            shape=shape + (len(edges) - 1,))
+        manifest = {
+            "config": {
+                "bins": bins.reset_index().to_dict(orient="records"),
+                "tolerance": tolerance,
+                "edges": list(map(float, edges)),
+                "n_polygons": n_polygons},
+            "created": datetime.now().isoformat(),
+            "dates": [],
+            "generation": 0,
+            "arrays": "arrays0"}
+        write_json(path/MANIFEST_FILE, manifest)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return self.count.shape[0]
+
+    def __repr__(self) -> str:
+        return (
+            f"Climatology({len(self)} polygons, {len(self.bins)} bins, "
+            f"{len(self.dates)} dates)")
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.manifest["dates"])
+
+    def update(self, cube: SSMCube) -> pd.DatetimeIndex:
+        """
+        Add the acquisitions of cube not already in the climatology.
+        Returns the dates added. The stored statistics are not touched
+        until the new ones are complete, so each date is counted once
+        even if an earlier update was interrupted.
+        """
+        if len(cube) != len(self):
+            raise ValueError(
+                f"cube has {len(cube)} polygons, climatology has {len(self)}")
+        new = ~cube.dates.isin(self.dates)
+        if not new.any():
+            return cube.dates[:0]
+        dates = cube.dates[new]
+        values = cube.values[:, new].astype(np.float64)
+        finite = np.isfinite(values)
+        member = (bin_distance(dates, self.bins) <= self.tolerance).astype(
+            np.float64)
+
+        # batch statistics per bin, shifted by each polygon's batch mean
+        # to keep the sum of squares well conditioned
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shift = np.nan_to_num(np.nanmean(values, axis=1, keepdims=True))
+            shifted = np.where(finite, values - shift, 0)
+            n_b = finite.astype(np.float64) @ member
+            sum_b = shifted @ member
+            mean_b = sum_b/n_b
+            m2_b = (shifted**2) @ member - sum_b*mean_b
+            mean_b += shift
+
+            # merge with copies of the stored statistics
+            n_a = self.count.astype(np.float64)
+            n = n_a + n_b
+            delta = mean_b - self.mean
+            has_b = n_b > 0
+            mean = np.array(self.mean)
+            m2 = np.array(self.m2)
+            mean[has_b] += (delta*n_b/n)[has_b]
+            m2[has_b] += (m2_b + delta**2*n_a*n_b/n)[has_b]
+            count = n.astype(self.count.dtype)
+
+        hist = np.array(self.hist)
+        h = np.clip(
+            np.searchsorted(self.edges, values, side="right") - 1,
+            0, len(self.edges) - 2)
+        for d in range(len(dates)):
+            polygons = np.flatnonzero(finite[:, d])
+            for b in np.flatnonzero(member[d]):
+                np.add.at(hist[:, b], (polygons, h[polygons, d]), 1)
+
+        self._commit([count, mean, m2, hist], dates)
+        return dates
+
+    def std(self) -> np.ndarray:
+        """
+        (polygon x bin) sample standard deviation, NaN with fewer than two
+        acquisitions
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(
+                self.count > 1,
+                np.sqrt(np.maximum(self.m2, 0)/(self.count - 1)),
+                np.nan)
+
+    def percentiles(self, q: Union[float, list]) -> np.ndarray:
+        """
+        (polygon x bin x q) percentiles, interpolated within histogram bins
+        """
+        q = np.atleast_1d(q)/100
+        cdf = np.cumsum(self.hist, axis=-1, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cdf /= cdf[..., -1:]
+            out = np.empty(self.count.shape + (len(q),))
+            for i, qi in enumerate(q):
+                h = (cdf < qi).sum(axis=-1).clip(max=len(self.edges) - 2)
+                below = np.where(
+                    h > 0,
+                    np.take_along_axis(cdf, (h - 1)[..., None], -1)[..., 0],
+                    0)
+                above = np.take_along_axis(cdf, h[..., None], -1)[..., 0]
+                frac = np.clip((qi - below)/(above - below), 0, 1)
+                out[..., i] = self.edges[h] + frac*np.diff(self.edges)[h]
+        out[self.count == 0] = np.nan
+        return out
+
+    def date_bins(
+            self,
+            dates: Union[pd.DatetimeIndex, np.ndarray, list]
+            ) -> np.ndarray:
+        """
+        Bin each date falls in, -1 if it is in none of them
+        """
+        inside = bin_distance(dates, self.bins) == 0
+        return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
+
+    def anomalies(self, cube: SSMCube) -> SSMCube:
+        """
+        Standardised anomalies (value - mean)/std of every acquisition of
+        cube against the climatology of its bin
+        """
+        ind = self.date_bins(cube.dates)
+        mean = np.asarray(self.mean)[:, ind]
+        std = self.std()[:, ind]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            anomalies = (cube.values - mean)/std
+        anomalies[:, ind < 0] = np.nan
+        return SSMCube(anomalies, cube.dates, cube.geometry)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Update a region\'s SSM climatology and write anomalies')
+    parser.add_argument('region', help='region in regions.toml')
+    parser.add_argument(
+        '-b',
+        '--bin_days',
+        type=int,
+        default=12,
+        help='day-of-year bin width for a new climatology')
+    parser.add_argument(
+        '-s',
+        '--seasons',
+        action='store_true',
+        help='bin a new climatology by Malawi season instead of day of year')
+    parser.add_argument(
+        '-t',
+        '--tolerance',
+        type=int,
+        default=6,
+        help='days outside a bin an acquisition still counts towards it')
+    args = parser.parse_args()
+
+    region = get_region(args.region)
+    cube = SSMCube.from_files(region.shp_file, region.polygon_geojson)
+    clim_dir = region.ssm_path/"climatology"
+    if (clim_dir/MANIFEST_FILE).exists():
+        clim = Climatology(clim_dir)
+    else:
+        bins = season_bins() if args.seasons else doy_bins(args.bin_days)
+        clim = Climatology.create(clim_dir, len(cube), bins, args.tolerance)
+    added = clim.update(cube)
+    print(f"Added {len(added)} dates to {clim}")
+    anomalies = clim.anomalies(cube).to_gdf()
+    anomalies.to_file(region.ssm_path/"SSM_anomalies.gpkg")
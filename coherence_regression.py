@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Regression of coherence against SSM for every location in a stack.
+Coherence is sampled onto the SSM polygons (or SSM onto the coherence
+grid) with a polygon index raster built once, then slope, intercept and r
+of every location come from one batched closed-form least squares fit
+along the time axis. The gridded fit runs over row windows of the stack.
+"""
+
+import sys
+
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio as rio
+
+from rasterio.windows import Window
+
+from eo_utils import index_means, polygon_index_raster
+from interferogram_pairs import join_acquisitions, pair_index
+from regions import get_region
+from regression import ols_from_sums
+from ssm_cube import SSMCube
+from ssm_render import gather_polygons
+
+
+def batch_linregress(
+        x: np.ndarray,
+        y: np.ndarray
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Least squares fit of y against x along the last axis for every
+    location at once. Points where either is NaN are left out.
+    Returns slope, intercept, r and the number of points used.
+    """
+    x, y = np.broadcast_arrays(
+        np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+    n = valid.sum(axis=-1)
+    slope, intercept, r2 = ols_from_sums(
+        n,
+        x.sum(axis=-1),
+        y.sum(axis=-1),
+        (x*x).sum(axis=-1),
+        (x*y).sum(axis=-1),
+        (y*y).sum(axis=-1))
+    r = np.sign(slope)*np.sqrt(r2)
+    return slope, intercept, r, n
+
+
+def sample_coherence(
+        paths: list,
+        geometry: gpd.GeoSeries,
+        nodata: float = 0
+        ) -> np.ndarray:
+    """
+    Mean coherence of every polygon for every raster in paths.
+    All rasters must share the grid of the first one (geocoded ISCE
+    outputs of one stack do).
+    Returns a (polygons x rasters) array.
+    """
+    with rio.open(paths[0]) as src:
+        index_raster = polygon_index_raster(
+            geometry.to_crs(src.crs), src.transform, src.shape)
+    sampled = np.full((len(geometry), len(paths)), np.nan)
+    for i, path in enumerate(paths):
+        with rio.open(path) as src:
+            sampled[:, i] = index_means(
+                index_raster, src.read(1), len(geometry), nodata)
+    return sampled
+
+
+def polygon_grid(
+        cube: SSMCube,
+        grid_file: Union[str, Path]
+        ) -> tuple[np.ndarray, dict]:
+    """
+    Index of the SSM polygon every pixel of grid_file falls in (-1
+    outside) and the raster profile
+    """
+    with rio.open(grid_file) as src:
+        index_raster = polygon_index_raster(
+            cube.geometry.to_crs(src.crs), src.transform, src.shape)
+        profile = src.profile
+    return index_raster, profile
+
+
+def coherence_regression_map(
+        cube: SSMCube,
+        pairs: pd.DataFrame,
+        on: str = "reference"
+        ) -> gpd.GeoDataFrame:
+    """
+    Slope, intercept and r of coherence against SSM for every polygon
+    """
+    ssm_ind = join_acquisitions(pairs, cube.dates, on)
+    pairs = pairs[ssm_ind >= 0]
+    coherence = sample_coherence(list(pairs["path"]), cube.geometry)
+    slope, intercept, r, n = batch_linregress(
+        cube.values[:, ssm_ind[ssm_ind >= 0]], coherence)
+    return gpd.GeoDataFrame(
+        {"slope": slope, "intercept": intercept, "r": r, "n": n},
+        geometry=cube.geometry,
+        crs=cube.crs)
+
+
+def coherence_regression_grid(
+        cube: SSMCube,
+        pairs: pd.DataFrame,
+        out_file: Union[str, Path],
+        on: str = "reference",
+        nodata: float = 0,
+        window_rows: int = 256
+        ) -> None:
+    """
+    Slope, intercept and r of coherence against SSM for every coherence
+    pixel, written as a three band GeoTIFF on the coherence grid.
+    The stack is read and fitted window_rows rows at a time, so memory
+    depends on the width of the grid and the number of pairs, not the
+    size of the whole stack. Only one pair raster is open at a time, so
+    long stacks don't run into the open file limit.
+    """
+    ssm_ind = join_acquisitions(pairs, cube.dates, on)
+    pairs = pairs[ssm_ind >= 0]
+    ssm_values = cube.values[:, ssm_ind[ssm_ind >= 0]]
+    index_raster, profile = polygon_grid(cube, pairs["path"].iloc[0])
+    height, width = index_raster.shape
+
+    profile.update(
+        driver="GTiff", count=3, dtype="float32", nodata=np.nan,
+        compress="deflate", tiled=True, blockxsize=256, blockysize=256)
+    with rio.open(out_file, "w", **profile) as dst:
+        for band, name in enumerate(["slope", "intercept", "r"], 1):
+            dst.set_band_description(band, name)
+        for row in range(0, height, window_rows):
+            window = Window(0, row, width, min(window_rows, height - row))
+            ssm_grid = gather_polygons(
+                index_raster[row:row + window.height], ssm_values)
+            coherence = np.empty(
+                (window.height, width, len(pairs)), dtype=np.float32)
+            for i, path in enumerate(pairs["path"]):
+                with rio.open(path) as src:
+                    coherence[..., i] = src.read(1, window=window)
+            coherence[coherence == nodata] = np.nan
+            slope, intercept, r, _ = batch_linregress(ssm_grid, coherence)
+            for band, layer in enumerate([slope, intercept, r], 1):
+                dst.write(layer.astype(np.float32), band, window=window)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        park_name = "kasungu"
+    else:
+        park_name = sys.argv[1]
+    region = get_region(park_name)
+    ssm_path = region.ssm_path
+    shp_file = region.shp_file
+    polygon_geojson = region.polygon_geojson
+    merged_dir = region.merged_dir
+
+    cube = SSMCube.from_files(shp_file, polygon_geojson)
+    pairs = pair_index(merged_dir)
+    regression_map = coherence_regression_map(cube, pairs)
+    regression_map.to_file(
+        ssm_path/"SSM_coherence_regression.geojson", driver="GeoJSON")
+    coherence_regression_grid(
+        cube, pairs, ssm_path/"SSM_coherence_regression.tif")
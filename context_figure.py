@@ -8,10 +8,15 @@ import numpy as np
 import rasterio as rio
 import rioxarray as rxr
 
-from rasterio.enums import ColorInterp
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
 from rasterio.plot import show
+from rasterio.windows import Window, from_bounds
 from shapely.geometry import MultiPolygon, Polygon
 
+from basemap_cache import get_basemap
+
 
 def geojson_to_shapely(gj_file):
     with open(gj_file) as gj:
@@ -31,6 +36,41 @@ def geojson_to_shapely(gj_file):
         return poly
 
 
+def read_context(
+        context_tif,
+        region,
+        max_pixels,
+        lookup_table):
+    """
+    RGBA image of the RGB raster over the bounds of region, decimated so
+    neither side is more than max_pixels (GDAL uses overviews if there
+    are any). lookup_table is applied to the RGB bands in place and the
+    alpha band is opaque inside region only.
+    Returns the (4, rows, cols) uint8 image and its transform.
+    """
+    with rio.open(context_tif) as src:
+        window = from_bounds(*region.bounds, src.transform)
+        window = window.round_offsets().round_lengths().intersection(
+            Window(0, 0, src.width, src.height))
+        factor = max(1, max(window.height, window.width)/max_pixels)
+        out_shape = (
+            int(np.ceil(window.height/factor)),
+            int(np.ceil(window.width/factor)))
+        rgba = np.empty((4,) + out_shape, dtype=np.uint8)
+        src.read(
+            [1, 2, 3],
+            window=window,
+            out=rgba[:3],
+            resampling=Resampling.average)
+        transform = src.window_transform(window)*Affine.scale(
+            window.width/out_shape[1], window.height/out_shape[0])
+    np.take(lookup_table, rgba[:3], out=rgba[:3])
+    inside = geometry_mask(
+        [region], out_shape, transform, invert=True)
+    np.multiply(inside, 255, out=rgba[3], casting="unsafe")
+    return rgba, transform
+
+
 aoi_dir = "/data/tapas/pearse/malawi/sentinel1/aoi"
 malawi = \
     aoi_dir + "/geoBoundaries-MWI-ADM0.geojson"
@@ -50,19 +90,6 @@ southern_poly = geojson_to_shapely(southern_aoi)
 kasungu_poly = geojson_to_shapely(kasungu_aoi)
 rois = MultiPolygon([southern_poly, kasungu_poly])
 context_tif = "/data/tapas/pearse/malawi/MODIS/MODIS_context.tif"
-with rio.open(context_tif, "r+") as modis_rgb:
-    modis_rgb.colorinterp = [
-        ColorInterp.red,
-        ColorInterp.green,
-        ColorInterp.blue]
-    modis_masked, modis_transform = rio.mask.mask(
-        modis_rgb,
-        [malawi_poly],
-        nodata=-999)
-    modis_crs = modis_rgb.crs
-# hacky way to get a white background
-modis_masked[modis_masked == -999] = 255
-modis_masked = np.ma.masked_equal(modis_masked, 255)
 """
 gamma correction, basically just skimage.exposure.adjust_gamma
 but I don't want to install skimage just for that.
@@ -71,34 +98,32 @@ gain = 1
 gamma = 0.75
 gamma_lookup_table = 255 * gain * (np.linspace(0, 1, 256) ** gamma)
 gamma_lookup_table = np.minimum(np.rint(gamma_lookup_table), 255).astype('uint8')
-# concatenate mask to make (M,N,4) array for proper mask of RGB plot
-modis_masked = np.concatenate([gamma_lookup_table[modis_masked.data], 255*~modis_masked.mask[np.newaxis, 0]], axis=0)
+f, ax = plt.subplots(1, figsize=(4, 7))
+# no point reading more pixels than the figure can show
+dpi = plt.rcParams["savefig.dpi"]
+dpi = f.dpi if dpi == "figure" else dpi
+max_pixels = int(np.ceil(max(f.get_size_inches())*dpi))
+modis_rgba, modis_transform = read_context(
+    context_tif, malawi_poly, max_pixels, gamma_lookup_table)
 west, south, east, north = malawi_poly.bounds
 provider = cx.providers.CartoDB.Voyager
-malawi_img, malawi_ext = cx.bounds2img(
-    west,
-    south,
-    east,
-    north,
-    ll=True,
+# fetched and warped once, then read from the basemap cache
+warped_img, warped_ext = get_basemap(
+    (west, east, south, north),
+    "EPSG:4326",
     source=provider,
     zoom=8
 )
-# # print(cx.tile._calculate_zoom(west, south, east, north))
-# print(malawi_ext)
-warped_img, warped_ext = cx.warp_tiles(malawi_img, malawi_ext, "EPSG:4326")
 # f, ax = plt.subplots(1, figsize=(9, 9))
 # ax.imshow(malawi_img, extent=malawi_ext)
 
-f, ax = plt.subplots(1, figsize=(4, 7))
-
 im = ax.imshow(warped_img, extent=warped_ext)
 # cx.add_basemap(
 #             ax,
 #             crs=modis_crs.to_string(),
 #             # alpha=0.1,
 #             source=cx.providers.CartoDB.Voyager)
-show(modis_masked, ax=ax, transform=modis_transform)
+show(modis_rgba, ax=ax, transform=modis_transform)
 for i, footprint in enumerate(footprint_poly.geoms):
     if i == 1:
         label = "S1A footprint"
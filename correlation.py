@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Normalised cross-correlation of whole batches of time series with FFTs.
+Series are mean-removed and scaled by their standard deviation, and each
+lag is averaged over the samples valid in both series at that lag, so
+the zero-lag value is the Pearson correlation coefficient even with gaps.
+Lags are given in days from the actual sampling interval.
+"""
+
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from scipy import fft
+
+from ssm_cube import SSMCube
+
+
+def sampling_interval(dates: Union[pd.DatetimeIndex, np.ndarray]) -> float:
+    """
+    Median spacing of dates in days. Series should be on a regular
+    calendar (see alignment.py) for the lags to mean anything.
+    """
+    return float(np.median(np.diff(pd.DatetimeIndex(dates)) / pd.Timedelta(days=1)))
+
+
+def _lagged_sums(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    (..., 2T - 1) sums of a[t + lag]*b[t] for every lag, with FFTs
+    """
+    n = a.shape[-1]
+    nfft = fft.next_fast_len(2*n - 1, real=True)
+    spectrum = fft.rfft(a, nfft, axis=-1)*np.conj(fft.rfft(b, nfft, axis=-1))
+    circular = fft.irfft(spectrum, nfft, axis=-1)
+    return np.concatenate(
+        [circular[..., nfft - (n - 1):], circular[..., :n]], axis=-1)
+
+
+def batch_xcorr(
+        a: np.ndarray,
+        b: np.ndarray,
+        dt: float = 1.0,
+        min_overlap: int = 3
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Normalised cross-correlation of a with b along the last axis,
+    same lag convention as scipy.signal.correlate(a, b) with
+    correlation_lags(len(a), len(b)).
+    a and b broadcast against each other, e.g. (polygons x time) against
+    one (time,) series. NaNs are ignored in the mean and variance, and
+    each lag is divided by the number of samples valid in both series at
+    that lag. Lags with fewer than min_overlap of them are NaN.
+    Returns the (..., 2T - 1) correlation and the lags in days.
+    """
+    n = a.shape[-1]
+    if b.shape[-1] != n:
+        raise ValueError(
+            f"series lengths differ ({n} and {b.shape[-1]}), align them first")
+    a = a - np.nanmean(a, axis=-1, keepdims=True)
+    b = b - np.nanmean(b, axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm = np.nanstd(a, axis=-1)*np.nanstd(b, axis=-1)
+    overlap = np.rint(_lagged_sums(
+        np.isfinite(a).astype(float), np.isfinite(b).astype(float)))
+
+    xcorr = _lagged_sums(np.nan_to_num(a), np.nan_to_num(b))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xcorr = xcorr/(overlap*norm[..., np.newaxis])
+    xcorr = np.where(overlap >= max(min_overlap, 1), xcorr, np.nan)
+    lags = np.arange(-(n - 1), n)*dt
+    return xcorr, lags
+
+
+def peak_lag(
+        xcorr: np.ndarray,
+        lags: np.ndarray,
+        max_lag: Union[float, None] = None
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Peak correlation and the lag it occurs at for every series,
+    optionally only looking within +/- max_lag days.
+    """
+    if max_lag is not None:
+        keep = np.abs(lags) <= max_lag
+        xcorr, lags = xcorr[..., keep], lags[keep]
+    peak_ind = np.argmax(np.nan_to_num(xcorr, nan=-np.inf), axis=-1)
+    peak = np.take_along_axis(
+        xcorr, peak_ind[..., np.newaxis], axis=-1)[..., 0]
+    return peak, lags[peak_ind]
+
+
+def xcorr_maps(
+        cube: SSMCube,
+        other: np.ndarray,
+        max_lag: Union[float, None] = None
+        ) -> gpd.GeoDataFrame:
+    """
+    Peak correlation and lag of every SSM polygon against other,
+    either one series or one per polygon on the cube's dates
+    (e.g. ERA5 or NDVI resampled with alignment.py).
+    """
+    xcorr, lags = batch_xcorr(
+        cube.values.astype(float), other, sampling_interval(cube.dates))
+    peak, lag = peak_lag(xcorr, lags, max_lag)
+    return gpd.GeoDataFrame(
+        {"peak": np.broadcast_to(peak, len(cube)),
+         "lag": np.broadcast_to(lag, len(cube))},
+        geometry=cube.geometry,
+        crs=cube.crs)
@@ -115,6 +115,8 @@ def Get_ERA5_data(
 
 
 def retrieve_ERA5_parallel(
+        ERA5_variables,
+        bbox_cdsapi,
         year_request,
         month_request,
         days_request,
@@ -132,21 +134,17 @@ def retrieve_ERA5_parallel(
     return monthly_dataset
 
 
-if __name__ == "__main__":
-    print("It's STARTING")
-    ERA5_variables = ['total_precipitation',
-                      'skin_temperature',
-                      'volumetric_soil_water_layer_1']
-    start_date = '20230101'  # format is YYYYMMDD
-    end_date = '20240531'  # format is YYYYMMDD
-    start_datetime = datetime.datetime.strptime(
-        '{}T000000'.format(start_date),
-        '%Y%m%dT%H%M%S')
-    end_datetime = datetime.datetime.strptime(
-        '{}T230000'.format(end_date),
-        '%Y%m%dT%H%M%S')
-    AOI_file = "/data/tapas/pearse/malawi/sentinel1/aoi/southern_malawi_aoi.geojson"
-    ERA5_dir = "/data/tapas/pearse/malawi/ERA5/liwonde/"
+def download_ERA5(
+        ERA5_variables: list,
+        start_datetime: datetime.datetime,
+        end_datetime: datetime.datetime,
+        AOI_file: str,
+        ERA5_dir: str,
+        ERA5_sm_filename: str) -> str:
+    """
+    Download ERA5-Land month by month in parallel and merge into
+    ERA5_sm_filename
+    """
     (bbox_cdsapi,
      year_requests,
      month_requests,
@@ -159,9 +157,12 @@ if __name__ == "__main__":
                                        ERA5_dir)
 
     print("starting pool")
+    n_requests = len(year_requests)
     with Pool() as pool:
         Downloaded_datasets = pool.starmap(retrieve_ERA5_parallel,
-                                           zip(year_requests,
+                                           zip([ERA5_variables]*n_requests,
+                                               [bbox_cdsapi]*n_requests,
+                                               year_requests,
                                                month_requests,
                                                days_requests,
                                                hours_requests,
@@ -171,5 +172,29 @@ if __name__ == "__main__":
         Downloaded_datasets,
         combine='by_coords',
         engine="netcdf4")
-    ERA5_sm_filename = ERA5_dir+"liwond_"+start_date+"_"+end_date+".nc"
     ds.to_netcdf(ERA5_sm_filename)  # Export netcdf file
+    return ERA5_sm_filename
+
+
+if __name__ == "__main__":
+    print("It's STARTING")
+    ERA5_variables = ['total_precipitation',
+                      'skin_temperature',
+                      'volumetric_soil_water_layer_1']
+    start_date = '20230101'  # format is YYYYMMDD
+    end_date = '20240531'  # format is YYYYMMDD
+    start_datetime = datetime.datetime.strptime(
+        '{}T000000'.format(start_date),
+        '%Y%m%dT%H%M%S')
+    end_datetime = datetime.datetime.strptime(
+        '{}T230000'.format(end_date),
+        '%Y%m%dT%H%M%S')
+    AOI_file = "/data/tapas/pearse/malawi/sentinel1/aoi/southern_malawi_aoi.geojson"
+    ERA5_dir = "/data/tapas/pearse/malawi/ERA5/liwonde/"
+    ERA5_sm_filename = ERA5_dir+"liwond_"+start_date+"_"+end_date+".nc"
+    download_ERA5(ERA5_variables,
+                  start_datetime,
+                  end_datetime,
+                  AOI_file,
+                  ERA5_dir,
+                  ERA5_sm_filename)
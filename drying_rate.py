@@ -1,21 +1,28 @@
 #!/usr/bin/env python
 
+import argparse
+
 from datetime import datetime
-from pathlib import Path
+from typing import Union
 
-import geojson
+import geopandas as gpd
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
 from scipy.stats import linregress
 
-from eo_utils import geojson_to_shapely, load_ssm
-from SSM_region_compare import split_inside_outside, find_ind_for_park
+from alignment import align_window
+from eo_utils import load_ssm
+from era5_polygons import extract_polygons
+from regions import get_region
+from regression import ols_from_sums
+from SSM_region_compare import split_inside_outside
+from ssm_cube import SSMCube, nearest_index
 
 
 def date_to_ind(date_array:np.array, date:datetime) -> int:
-    date_ind = np.argmin(np.abs(date_array-date))
+    date_ind = nearest_index(pd.DatetimeIndex(date_array), date)[0]
     return date_ind
 
 def drying_rate(
@@ -41,44 +48,158 @@ def drying_rate(
     return result.slope, result.intercept
 
 
+def interval_precipitation(
+        tp: np.ndarray,
+        tp_times: pd.DatetimeIndex,
+        dates: pd.DatetimeIndex
+        ) -> np.ndarray:
+    """
+    Precipitation accumulated between consecutive acquisitions, in the
+    units of tp (metres for ERA5, so scale by 1e3 for mm).
+    tp has time on the last axis (e.g. hourly ERA5 `tp`), so it can be a
+    single AOI series or one series per polygon.
+    Returns an array with len(dates) - 1 intervals on the last axis.
+    """
+    return align_window(tp, tp_times, dates, how="sum")[..., 1:]
+
+
+def dry_down_labels(
+        values: np.ndarray,
+        precip: Union[np.ndarray, None] = None,
+        precip_threshold: float = 1.0
+        ) -> np.ndarray:
+    """
+    Label every (polygon, date) point with the dry-down window it belongs
+    to, -1 if none. A window is a run of consecutive decreases in SSM,
+    optionally with less than precip_threshold mm of precipitation in
+    every interval.
+    values is (polygons x dates), precip is (dates - 1) or
+    (polygons x dates - 1) in mm from `interval_precipitation`.
+    """
+    n_poly, n_dates = values.shape
+    # pad each row with a non-drying interval so runs never span polygons
+    drying = np.zeros((n_poly, n_dates), dtype=bool)
+    drying[:, :-1] = np.diff(values, axis=1) < 0
+    if precip is not None:
+        drying[:, :-1] &= precip < precip_threshold
+    starts = drying.copy()
+    starts[:, 1:] &= ~drying[:, :-1]
+    run_id = np.cumsum(starts.ravel()).reshape(n_poly, n_dates) - 1
+    interval_label = np.where(drying, run_id, -1)
+    # the point after the last interval of a run belongs to the run too
+    previous_label = np.full((n_poly, n_dates), -1)
+    previous_label[:, 1:] = interval_label[:, :-1]
+    return np.where(interval_label >= 0, interval_label, previous_label)
+
+
+def batch_drying_rate(
+        cube: SSMCube,
+        precip: Union[np.ndarray, None] = None,
+        precip_threshold: float = 1.0,
+        min_points: int = 3
+        ) -> pd.DataFrame:
+    """
+    Linear fit of SSM against days for every dry-down window of every
+    polygon, all from a handful of bincount reductions.
+    Returns one row per window with the polygon index, start and end dates,
+    number of points, slope (percent per day), intercept and r^2.
+    """
+    n_dates = len(cube.dates)
+    labels = dry_down_labels(cube.values, precip, precip_threshold).ravel()
+    points = np.flatnonzero(labels >= 0)
+    label = labels[points]
+    n_windows = label.max() + 1 if len(label) else 0
+    # labels increase along the flattened array, so each window is a block
+    first = np.searchsorted(label, np.arange(n_windows), side="left")
+    last = np.searchsorted(label, np.arange(n_windows), side="right") - 1
+
+    days = cube.days[points % n_dates].astype(float)
+    x = days - days[first][label]
+    y = cube.values.ravel()[points].astype(float)
+    n = np.bincount(label, minlength=n_windows)
+    slope, intercept, r2 = ols_from_sums(
+        n,
+        np.bincount(label, x, n_windows),
+        np.bincount(label, y, n_windows),
+        np.bincount(label, x*x, n_windows),
+        np.bincount(label, x*y, n_windows),
+        np.bincount(label, y*y, n_windows))
+    windows = pd.DataFrame({
+        "polygon": points[first] // n_dates,
+        "start": cube.dates[points[first] % n_dates],
+        "end": cube.dates[points[last] % n_dates],
+        "n": n,
+        "slope": slope,
+        "intercept": intercept,
+        "r2": r2,
+    })
+    return windows[windows["n"] >= min_points].reset_index(drop=True)
+
+
+def drying_rate_maps(
+        windows: pd.DataFrame,
+        cube: SSMCube,
+        how: str = "longest"
+        ) -> gpd.GeoDataFrame:
+    """
+    One dry-down window per polygon, either the "longest" or "latest",
+    as a GeoDataFrame of slope, intercept and r^2 on the SSM polygons.
+    Polygons without a window are NaN.
+    """
+    if how == "longest":
+        order = ["n", "end"]
+    elif how == "latest":
+        order = ["end", "n"]
+    else:
+        raise ValueError(f"how must be 'longest' or 'latest', not {how}")
+    chosen = windows.sort_values(order).drop_duplicates(
+        "polygon", keep="last").set_index("polygon")
+    chosen = chosen.reindex(np.arange(len(cube)))
+    return gpd.GeoDataFrame(
+        chosen.reset_index(drop=True),
+        geometry=cube.geometry,
+        crs=cube.crs)
+
+
 if __name__ == "__main__":
-    root_path = Path("/data/tapas/pearse/malawi/SSM")
-    nparks_geojson = root_path.parent/"sentinel1/aoi/protected_areas.json"
-    for ssm_results, park_name in zip(
-        [
-            "malawi_InSAR_SSM_1km_southern_20230101_20240531",
-            "kasungu_1km_20230101_20240531"
-        ],
-        [
-            "LIWONDE",
-            "KASUNGU"
-        ]
-    ):
-        ssm_path = root_path/ssm_results
-        shp_file = list(ssm_path.glob("*shp"))[0]
-        polygon_geojson = ssm_path/ssm_results/"INSAR4SM_processing/SM/SM_polygons.geojson"
-        gdf = load_ssm(
-            shp_file,
-            polygon_geojson
-            )
-    with open(nparks_geojson) as gj:
-        nparks = geojson.load(gj)
-    park_ind = find_ind_for_park(park_name, nparks)
-    park_poly = geojson_to_shapely(
-        nparks_geojson, park_ind)
-    gdf_inside, gdf_outside = split_inside_outside(gdf, park_poly)
-    mean_ssm = gdf_inside.mean(numeric_only=True)
-    df_datetimes = pd.to_datetime(gdf.columns[1:-1], format="D%Y%m%d")
-
-    day_start = datetime(2024, 4, 15)
-    day_end = datetime(2024, 5, 31)
-    
-    dry_start_ind = date_to_ind(df_datetimes, day_start)
-    dry_end_ind =  date_to_ind(df_datetimes, day_end)
-    
-    day_array = np.arange(dry_end_ind - dry_start_ind)
-    slope, intercept = drying_rate(mean_ssm.values, df_datetimes, day_start, day_end)
-    print(slope, intercept)
+    parser = argparse.ArgumentParser(
+        description='Park drying rates and per-polygon drying rate maps')
+    parser.add_argument(
+        'regions',
+        nargs='*',
+        default=["liwonde", "kasungu"],
+        help='regions in regions.toml. Default is liwonde and kasungu')
+    args = parser.parse_args()
+
+    for region in map(get_region, args.regions):
+        ssm_path = region.ssm_path
+        era5_file = region.era5_file
+        gdf = load_ssm(region.shp_file, region.polygon_geojson)
+        gdf_inside, gdf_outside = split_inside_outside(gdf, region.park())
+        mean_ssm = gdf_inside.mean(numeric_only=True)
+        df_datetimes = pd.to_datetime(gdf.columns[1:-1], format="D%Y%m%d")
+
+        day_start = datetime(2024, 4, 15)
+        day_end = datetime(2024, 5, 31)
+
+        dry_start_ind = date_to_ind(df_datetimes, day_start)
+        dry_end_ind = date_to_ind(df_datetimes, day_end)
+
+        day_array = np.arange(dry_end_ind - dry_start_ind)
+        slope, intercept = drying_rate(mean_ssm.values, df_datetimes, day_start, day_end)
+        print(slope, intercept)
+
+        # drying rate of every polygon rather than one number per park,
+        # only over intervals where that polygon's ERA5 cell stayed dry
+        cube = SSMCube.from_gdf(gdf)
+        tp = extract_polygons(era5_file, cube.geometry, ["tp"])
+        precip = interval_precipitation(
+            tp.values[..., 0]*1e3,  # m to mm
+            pd.DatetimeIndex(tp["time"].values),
+            cube.dates)
+        windows = batch_drying_rate(cube, precip, precip_threshold=1.0)
+        rate_map = drying_rate_maps(windows, cube)
+        rate_map.to_file(ssm_path/"drying_rate_map.geojson", driver="GeoJSON")
     # plt.plot(df_datetimes, mean_ssm.values, 'o')
     # plt.plot(df_datetimes[day_array], (slope*day_array)+intercept)
-    plt.show()
\ No newline at end of file
+    plt.show()
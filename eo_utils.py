@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 
+import hashlib
+import json
+import os
+
 from pathlib import Path
 from typing import Union
 
 import geopandas as gpd
 import geojson
+import numpy as np
 import pandas as pd
+import shapely
 
+from affine import Affine
+from rasterio.features import rasterize
 from rasterstats import zonal_stats
 from shapely.geometry import MultiPolygon, Polygon
 
@@ -69,3 +77,89 @@ def get_zonal_means(
         zone_means[zone_name] = mean
 
     return zone_means
+
+
+def polygon_index_raster(
+        geometry: gpd.GeoSeries,
+        transform: Affine,
+        shape: tuple[int, int],
+        all_touched: bool = False
+        ) -> np.ndarray:
+    """
+    Rasterise polygons once to a grid of polygon indices, -1 outside.
+    geometry should already be in the CRS of the grid.
+    """
+    return rasterize(
+        ((geom, i) for i, geom in enumerate(geometry)),
+        out_shape=shape,
+        transform=transform,
+        fill=-1,
+        all_touched=all_touched,
+        dtype="int32")
+
+
+def index_means(
+        index_raster: np.ndarray,
+        data: np.ndarray,
+        n_polygons: int,
+        nodata: Union[float, None] = None
+        ) -> np.ndarray:
+    """
+    Mean of data over each polygon of a `polygon_index_raster`,
+    NaN for polygons with no valid pixels
+    """
+    valid = (index_raster >= 0) & np.isfinite(data)
+    if nodata is not None:
+        valid &= data != nodata
+    sums = np.bincount(index_raster[valid], data[valid], n_polygons)
+    counts = np.bincount(index_raster[valid], minlength=n_polygons)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums/counts
+
+
+def outline_xy(geom: Union[Polygon, MultiPolygon]) -> np.ndarray:
+    """
+    (2 x n) x, y of the exterior of a Polygon or of every part of a
+    MultiPolygon, with NaN between parts so `ax.plot(*outline)` draws
+    them as separate lines
+    """
+    gap = np.full((2, 1), np.nan)
+    xy = []
+    for part in getattr(geom, "geoms", [geom]):
+        xy += [np.array(part.exterior.xy), gap]
+    return np.hstack(xy[:-1])
+
+
+def worker_count() -> int:
+    """
+    Processes a script's pools should use: EO_WORKERS if set (e.g. by
+    batch_runner.py when several scripts share the node), otherwise
+    every CPU
+    """
+    return int(os.environ.get("EO_WORKERS", os.cpu_count()))
+
+
+def geometry_digest(geometry: Union[gpd.GeoSeries, gpd.GeoDataFrame]) -> str:
+    """
+    Hash of the CRS and the WKB of every geometry, in order, for keying
+    caches that depend on exactly which polygons they were built from
+    """
+    sha = hashlib.sha1(str(geometry.crs).encode())
+    for wkb in shapely.to_wkb(np.asarray(geometry.geometry)):
+        sha.update(wkb)
+    return sha.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """
+    Hash of everything a cache was built from. Arrays are hashed by dtype,
+    shape and bytes, anything else by its JSON.
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            sha.update(f"{part.dtype}{part.shape}".encode())
+            sha.update(np.ascontiguousarray(part).tobytes())
+        else:
+            sha.update(json.dumps(part, default=str).encode())
+    return sha.hexdigest()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+ERA5 time series for every SSM polygon rather than one for the AOI
+centroid.
+Each polygon is mapped to ERA5 grid cells once, either the cell its
+centroid falls in or every cell it overlaps weighted by area, and the
+(polygons x cells) matrix is cached per grid. Extraction then reads only
+the cells that are used, in one pointwise gather per variable, and maps
+them to polygons with a sparse matrix product.
+"""
+
+import argparse
+
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import xarray as xr
+
+from numpy.lib.format import open_memmap
+from scipy import sparse
+from shapely.geometry import box
+
+from eo_utils import cache_key, geometry_digest, load_ssm
+from regions import get_region
+from zonal_weights import load_weights, overlap_weights, save_weights, zonal_means
+
+
+def time_dim(ds: Union[xr.Dataset, xr.DataArray]) -> str:
+    """
+    valid_time for new CDS downloads, time for older ones
+    """
+    return "valid_time" if "valid_time" in ds.dims else "time"
+
+
+def grid_step(coords: np.ndarray) -> float:
+    """
+    Spacing of a regular grid axis, 0.1 degrees (ERA5-Land) for one cell
+    """
+    return abs(coords[1] - coords[0]) if len(coords) > 1 else 0.1
+
+
+def grid_cells(lat: np.ndarray, lon: np.ndarray) -> gpd.GeoSeries:
+    """
+    Boxes of every cell of a regular lat/lon grid, in row-major order
+    """
+    half_lat = grid_step(lat)/2
+    half_lon = grid_step(lon)/2
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    return gpd.GeoSeries(
+        [
+            box(x - half_lon, y - half_lat, x + half_lon, y + half_lat)
+            for y, x in zip(lat_grid.ravel(), lon_grid.ravel())],
+        crs="EPSG:4326")
+
+
+def era5_weights(
+        polygons: Union[gpd.GeoSeries, gpd.GeoDataFrame],
+        lat: np.ndarray,
+        lon: np.ndarray,
+        method: str = "centroid",
+        cache_file: Union[str, Path, None] = None
+        ) -> sparse.csr_matrix:
+    """
+    Sparse (polygons x lat*lon) matrix mapping ERA5 cells to polygons.
+    With method "centroid" each polygon gets the cell its centroid is in,
+    with "area" every cell it overlaps, weighted by the overlap area.
+    Polygons off the grid have no weights.
+    If cache_file is given the matrix is loaded from there when it was
+    built from the same polygons, grid and method, otherwise computed and
+    saved there.
+    """
+    shape = (len(polygons), len(lat)*len(lon))
+    key = cache_key(
+        geometry_digest(polygons), np.asarray(lat), np.asarray(lon), method)
+    weights = load_weights(cache_file, key)
+    if weights is not None:
+        return weights
+
+    if method == "area":
+        weights = overlap_weights(grid_cells(lat, lon), polygons)
+    elif method == "centroid":
+        geometry = polygons.geometry
+        centroids = geometry.to_crs(geometry.estimate_utm_crs()).centroid
+        centroids = centroids.to_crs("EPSG:4326")
+        y_dist = np.abs(lat[None, :] - centroids.y.to_numpy()[:, None])
+        x_dist = np.abs(lon[None, :] - centroids.x.to_numpy()[:, None])
+        rows = y_dist.argmin(1)
+        cols = x_dist.argmin(1)
+        on_grid = np.flatnonzero(
+            (y_dist.min(1) <= grid_step(lat)/2)
+            & (x_dist.min(1) <= grid_step(lon)/2))
+        weights = sparse.csr_matrix(
+            (
+                np.ones(len(on_grid)),
+                (on_grid, rows[on_grid]*len(lon) + cols[on_grid])),
+            shape=shape)
+    else:
+        raise ValueError(f"method must be centroid or area, not {method}")
+
+    if cache_file is not None:
+        save_weights(cache_file, weights, key)
+    return weights
+
+
+def extract_polygons(
+        era5_file: Union[str, Path],
+        polygons: Union[gpd.GeoSeries, gpd.GeoDataFrame],
+        variables: Union[list, None] = None,
+        method: str = "centroid",
+        cache_file: Union[str, Path, None] = None,
+        out_file: Union[str, Path, None] = None,
+        time_chunk: int = 24*31
+        ) -> xr.DataArray:
+    """
+    (polygon x time x variable) float32 array of every variable in
+    era5_file (default all of them) for every polygon. NaN cells, e.g.
+    over Lake Malawi in ERA5-Land, are left out of area-weighted means.
+    ERA5 is read time_chunk steps at a time, and the array is written to
+    out_file as a .npy memmap if given, since it can be much larger than
+    the ERA5 file itself.
+    """
+    ds = xr.open_dataset(era5_file, chunks={})
+    t_dim = time_dim(ds)
+    lat = ds["latitude"].to_numpy()
+    lon = ds["longitude"].to_numpy()
+    variables = variables or [
+        name for name, var in ds.data_vars.items()
+        if {t_dim, "latitude", "longitude"}.issubset(var.dims)]
+    weights = era5_weights(polygons, lat, lon, method, cache_file)
+
+    # only the cells some polygon uses
+    used = np.unique(weights.indices)
+    weights = weights[:, used]
+    rows = xr.DataArray(used // len(lon), dims="cell")
+    cols = xr.DataArray(used % len(lon), dims="cell")
+
+    times = ds[t_dim].to_numpy()
+    shape = (len(polygons), len(times), len(variables))
+    if out_file is None:
+        out = np.empty(shape, dtype=np.float32)
+    else:
+        out = open_memmap(out_file, mode="w+", dtype=np.float32, shape=shape)
+    for k, name in enumerate(variables):
+        var = ds[name].transpose(t_dim, "latitude", "longitude")
+        # only time_chunk steps of the used cells are in memory at once
+        for t0 in range(0, len(times), time_chunk):
+            t1 = min(t0 + time_chunk, len(times))
+            cells = var.isel(
+                {t_dim: slice(t0, t1), "latitude": rows, "longitude": cols}
+                ).to_numpy()
+            out[:, t0:t1, k] = zonal_means(weights, cells.T)
+    ds.close()
+    return xr.DataArray(
+        out,
+        dims=("polygon", "time", "variable"),
+        coords={
+            "polygon": np.asarray(polygons.index),
+            "time": times,
+            "variable": variables},
+        name="era5")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Extract ERA5 time series for every SSM polygon')
+    parser.add_argument('region', help='region in regions.toml')
+    parser.add_argument(
+        '-m',
+        '--method',
+        choices=["centroid", "area"],
+        default="centroid",
+        help='cell containing each centroid, or area-weighted overlapping cells')
+    parser.add_argument(
+        '-v',
+        '--variables',
+        nargs='+',
+        help='ERA5 variables to extract. Default is all of them')
+    args = parser.parse_args()
+
+    region = get_region(args.region)
+    gdf = load_ssm(region.shp_file, region.polygon_geojson)
+    era5 = extract_polygons(
+        region.era5_file,
+        gdf,
+        args.variables,
+        args.method,
+        region.ssm_path/f"era5_{args.method}_weights.npz",
+        region.ssm_path/f"era5_{args.method}_polygons.npy")
+    print(era5)
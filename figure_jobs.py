@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Render per-date map series across a process pool.
+Each panel is a small picklable job (layer values, colour scaling,
+title, outline, output file). The render grid and basemap are sent to
+each worker once, workers draw with the Agg backend, and every figure is
+written to a temporary file and renamed into place so an interrupted run
+never leaves half-written figures behind.
+"""
+
+from dataclasses import dataclass
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Union
+
+import matplotlib.cm as cm
+import matplotlib.pyplot as plt
+import numpy as np
+
+from matplotlib.colors import Colormap, Normalize
+
+from eo_utils import worker_count
+from file_utils import atomic_write
+from ssm_render import RenderGrid, draw_layer, layer_images
+
+# set in each worker by _init_worker
+_grid = None
+_basemap = None
+
+
+@dataclass
+class FigureJob:
+    """
+    One single-panel map figure
+    """
+    values: np.ndarray
+    out_file: Path
+    title: str
+    cmap: Union[Colormap, str]
+    vmin: float
+    vmax: float
+    cbar_label: str
+    outline: Union[np.ndarray, None] = None
+
+
+def _init_worker(grid: RenderGrid, basemap: Union[tuple, None]) -> None:
+    global _grid, _basemap
+    plt.switch_backend("Agg")
+    _grid = grid
+    _basemap = basemap
+
+
+def savefig_atomic(fig: plt.Figure, out_file: Union[str, Path]) -> Path:
+    """
+    Save via a temporary file in the same directory, then rename.
+    The format comes from out_file's suffix as it would for savefig.
+    """
+    out_file = Path(out_file)
+    with atomic_write(out_file) as f:
+        fig.savefig(f, format=out_file.suffix[1:] or None)
+    return out_file
+
+
+def render_job(job: FigureJob) -> Path:
+    """
+    Draw and save one figure, same layout as the per-date figures in
+    SSM_analysis.py
+    """
+    normalizer = Normalize(job.vmin, job.vmax)
+    fig, ax = plt.subplots(1, 1, figsize=(9, 9), layout='constrained')
+    draw_layer(
+        ax,
+        layer_images(_grid, job.values),
+        _grid,
+        job.cmap,
+        normalizer)
+    im = cm.ScalarMappable(norm=normalizer, cmap=job.cmap)
+    cb = fig.colorbar(im, ax=ax, shrink=0.7)
+    cb.set_label(label=job.cbar_label, size=14)
+    ax.set_title(job.title, fontdict={"size": 14})
+    ax.set_ylabel("Latitude", fontdict={"size": 14})
+    ax.set_xlabel("Longitude", fontdict={"size": 14})
+    if _basemap is not None:
+        img, ext = _basemap
+        ax.imshow(img, extent=ext, interpolation="bilinear", zorder=0)
+        ax.axis(_grid.extent)
+    if job.outline is not None:
+        ax.plot(*job.outline, color='r')
+    out_file = savefig_atomic(fig, job.out_file)
+    plt.close(fig)
+    return out_file
+
+
+def run_jobs(
+        jobs: list,
+        grid: RenderGrid,
+        basemap: Union[tuple, None] = None,
+        processes: Union[int, None] = None
+        ) -> list:
+    """
+    Render every job across a process pool.
+    basemap is an (image, extent) pair, e.g. from `get_basemap`, fetched
+    once in the parent so workers never touch the network.
+    Returns the written files.
+    """
+    with Pool(
+            processes=processes or worker_count(),
+            initializer=_init_worker,
+            initargs=(grid, basemap)) as pool:
+        return list(pool.imap_unordered(render_job, jobs, chunksize=4))
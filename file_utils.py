@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Writing files that other processes may be reading at the same time.
+"""
+
+import json
+import os
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+
+@contextmanager
+def atomic_write(path: Union[str, Path], mode: str = "wb"):
+    """
+    Open a temporary file next to path and rename it over path when the
+    block finishes, so parallel runs never read half a file. Nothing is
+    left behind if the block raises.
+    """
+    path = Path(path)
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_file, mode) as f:
+            yield f
+        os.replace(tmp_file, path)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def write_json(path: Union[str, Path], obj) -> None:
+    """
+    Atomically write obj as indented JSON, e.g. a build manifest
+    """
+    with atomic_write(path, "w") as f:
+        json.dump(obj, f, indent=2)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Index of the interferogram date pairs in an ISCE stack.
+Every YYYYMMDD_YYYYMMDD directory under merged/interferograms is parsed
+into reference and secondary dates so coherence can be joined to SSM
+acquisitions by date rather than by trimming arrays to the same length.
+"""
+
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from ssm_cube import nearest_index
+
+
+def read_baselines(baselines_dir: Union[str, Path]) -> pd.Series:
+    """
+    Perpendicular baseline of every date relative to the stack reference
+    from ISCE topsStack baselines/<reference>_<date>/<reference>_<date>.txt,
+    averaged over swaths.
+    """
+    bperp = {}
+    for baseline_file in Path(baselines_dir).glob("*_*/*_*.txt"):
+        reference, secondary = baseline_file.stem.split("_")
+        with open(baseline_file) as bf:
+            values = [
+                float(line.split(":")[-1]) for line in bf
+                if line.strip().startswith("Bperp (average)")]
+        if values:
+            bperp[secondary] = np.mean(values)
+            bperp[reference] = 0.0
+    bperp = pd.Series(bperp, dtype=float)
+    bperp.index = pd.to_datetime(bperp.index, format="%Y%m%d")
+    return bperp.sort_index()
+
+
+def pair_index(
+        merged_dir: Union[str, Path],
+        filename: str = "geo_filt_fine.cor",
+        baselines_dir: Union[str, Path, None] = None
+        ) -> pd.DataFrame:
+    """
+    One row per interferogram in merged_dir/*/filename with reference,
+    secondary and midpoint dates, temporal baseline in days, the file path
+    and, if baselines_dir is given, the perpendicular baseline in metres.
+    """
+    paths = sorted(Path(merged_dir).glob(f"*_*/{filename}"))
+    names = pd.Series([path.parent.name for path in paths], dtype=str)
+    dates = names.str.split("_", expand=True)
+    if len(paths) == 0:
+        dates = pd.DataFrame({0: [], 1: []})
+    reference = pd.to_datetime(dates[0], format="%Y%m%d")
+    secondary = pd.to_datetime(dates[1], format="%Y%m%d")
+    pairs = pd.DataFrame({
+        "reference": reference,
+        "secondary": secondary,
+        "midpoint": reference + (secondary - reference)/2,
+        "temporal_baseline": (secondary - reference).dt.days,
+        "path": paths,
+    })
+    pairs.index = pd.Index(names, name="pair")
+    if baselines_dir is not None:
+        bperp = read_baselines(baselines_dir)
+        pairs["perpendicular_baseline"] = (
+            bperp.reindex(pairs["secondary"]).to_numpy()
+            - bperp.reindex(pairs["reference"]).to_numpy())
+    return pairs
+
+
+def short_baseline(
+        pairs: pd.DataFrame,
+        max_days: int = 12,
+        max_bperp: Union[float, None] = None
+        ) -> pd.DataFrame:
+    """
+    Pairs with a temporal baseline of at most max_days
+    and, optionally, a perpendicular baseline of at most max_bperp metres
+    """
+    keep = pairs["temporal_baseline"] <= max_days
+    if max_bperp is not None:
+        keep &= pairs["perpendicular_baseline"].abs() <= max_bperp
+    return pairs[keep]
+
+
+def join_acquisitions(
+        pairs: pd.DataFrame,
+        acquisition_dates: pd.DatetimeIndex,
+        on: str = "reference",
+        tolerance: pd.Timedelta = pd.Timedelta(days=6)
+        ) -> np.ndarray:
+    """
+    Index into acquisition_dates (e.g. SSMCube.dates) of the acquisition
+    nearest each pair's reference, secondary or midpoint date.
+    Pairs with no acquisition within tolerance get -1.
+    """
+    if on not in ["reference", "secondary", "midpoint"]:
+        raise ValueError(
+            f"on must be 'reference', 'secondary' or 'midpoint', not {on}")
+    return nearest_index(
+        pd.DatetimeIndex(acquisition_dates), pairs[on], tolerance)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Differences between SSM acquisitions separated by a fixed time offset.
+Acquisitions are paired by a nearest-date join on the time index, so the
+running difference (12 days) and year-on-year difference (365 days) work
+for any acquisition calendar without hand-picked column offsets.
+"""
+
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from ssm_cube import SSMCube, nearest_index
+
+# Sentinel-1 revisit and year-on-year offsets as (lag, tolerance).
+# Acquisitions with nothing within tolerance of the lag get no layer,
+# unless lag_pairs is told to fall back to the previous acquisition,
+# as the running difference is so gaps in the calendar don't drop dates.
+RUNNING = (pd.Timedelta(days=12), pd.Timedelta(days=6))
+YEAR_ON_YEAR = (pd.Timedelta(days=365), pd.Timedelta(days=6))
+
+
+def lag_pairs(
+        dates: pd.DatetimeIndex,
+        lag: pd.Timedelta,
+        tolerance: pd.Timedelta,
+        name_format: str = "%Y%m%d",
+        fallback_previous: bool = False
+        ) -> pd.DataFrame:
+    """
+    Pair every acquisition with the one nearest to `lag` earlier,
+    if there is one within tolerance. Acquisitions without one are
+    dropped, or with fallback_previous paired with the acquisition just
+    before them.
+    Returns a DataFrame indexed by "later-earlier" layer name with the
+    dates and array indices of both acquisitions.
+    """
+    dates = pd.DatetimeIndex(dates)
+    earlier_ind = nearest_index(dates, dates - lag, tolerance)
+    later_ind = np.arange(len(dates))
+    if fallback_previous:
+        earlier_ind = np.where(earlier_ind >= 0, earlier_ind, later_ind - 1)
+    keep = (earlier_ind >= 0) & (earlier_ind != later_ind)
+    later_ind, earlier_ind = later_ind[keep], earlier_ind[keep]
+    later, earlier = dates[later_ind], dates[earlier_ind]
+    names = later.strftime(name_format) + "-" + earlier.strftime(name_format)
+    return pd.DataFrame(
+        {
+            "later": later,
+            "earlier": earlier,
+            "later_ind": later_ind,
+            "earlier_ind": earlier_ind,
+        },
+        index=pd.Index(names, name="layer"))
+
+
+def lag_difference(
+        values: np.ndarray,
+        later_ind: np.ndarray,
+        earlier_ind: np.ndarray,
+        chunk_size: Union[int, None] = None,
+        out: Union[np.ndarray, None] = None
+        ) -> np.ndarray:
+    """
+    (polygons x pairs) array of values[:, later] - values[:, earlier].
+    values can be anything sliceable by rows (np.memmap, zarr, ...).
+    With chunk_size only that many polygons are read at a time and the
+    result is written into out, e.g. a memory-mapped array.
+    """
+    if chunk_size is None:
+        return values[:, later_ind] - values[:, earlier_ind]
+
+    if out is None:
+        out = np.empty((values.shape[0], len(later_ind)), dtype=np.float32)
+    for i in range(0, values.shape[0], chunk_size):
+        chunk = np.asarray(values[i:i + chunk_size])
+        out[i:i + chunk_size] = chunk[:, later_ind] - chunk[:, earlier_ind]
+    return out
+
+
+def lag_difference_frame(
+        cube: SSMCube,
+        lag: pd.Timedelta,
+        tolerance: pd.Timedelta,
+        name_format: str = "%Y%m%d",
+        previous: Union[pd.DataFrame, None] = None,
+        chunk_size: Union[int, None] = None,
+        fallback_previous: bool = False
+        ) -> pd.DataFrame:
+    """
+    All difference layers of cube as a (polygons x layers) DataFrame,
+    paired as in `lag_pairs`.
+    Layers already in `previous` (e.g. from before new acquisitions were
+    added) are reused and only the new ones are computed. previous must
+    have a row per polygon of cube, in the same order.
+    """
+    if previous is not None and len(previous) != len(cube):
+        raise ValueError(
+            f"previous has {len(previous)} rows, cube has {len(cube)} polygons")
+    pairs = lag_pairs(
+        cube.dates, lag, tolerance, name_format, fallback_previous)
+    if previous is not None:
+        new_pairs = pairs[~pairs.index.isin(previous.columns)]
+    else:
+        new_pairs = pairs
+    diff = lag_difference(
+        cube.values,
+        new_pairs["later_ind"].to_numpy(),
+        new_pairs["earlier_ind"].to_numpy(),
+        chunk_size)
+    diff_df = pd.DataFrame(diff, columns=new_pairs.index)
+    if previous is not None:
+        diff_df = pd.concat(
+            [previous.reset_index(drop=True), diff_df], axis=1)
+    return diff_df[pairs.index]
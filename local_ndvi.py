@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+NDVI zonal time series from MODIS/Sentinel-2 GeoTIFFs on disk.
+A local stand-in for the geemap.zonal_stats exports in
+ndvi_insde_outside.ipynb. The zones are rasterised once to a sparse
+(zone x pixel) membership matrix, cached to disk, and every date is then
+a windowed read, a vectorised scale and QA mask, and one sparse product,
+run across a process pool.
+"""
+
+import argparse
+import re
+
+from multiprocessing import Pool
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio as rio
+
+from rasterio.features import rasterize
+from rasterio.windows import Window, from_bounds
+from scipy import sparse
+
+from eo_utils import (
+    cache_key, geometry_digest, load_ssm, polygon_index_raster, worker_count)
+from file_utils import atomic_write
+from park_summary import load_parks, park_zones
+from regions import get_region
+from zonal_weights import zonal_means
+
+# MOD13A1 NDVI is int16 scaled by 1e4 with -3000 as fill
+MOD13A1 = {
+    "scale": 1e-4,
+    "offset": 0.0,
+    "fill": -3000,
+    "valid_range": (-2000, 10000)}
+
+# set in each worker by _init_worker
+_zones = None
+
+
+class ZoneGrid(NamedTuple):
+    """
+    Zone membership of the pixels in a window of the NDVI grid
+    """
+    weights: sparse.csr_matrix
+    window: Window
+
+
+def ndvi_file_date(path: Union[str, Path]) -> pd.Timestamp:
+    """
+    Acquisition date from a file name, either a MODIS "A%Y%j" tag or
+    %Y_%m_%d / %Y-%m-%d / %Y%m%d
+    """
+    name = Path(path).name
+    modis = re.search(r"A(\d{7})", name)
+    if modis is not None:
+        return pd.to_datetime(modis.group(1), format="%Y%j")
+    ymd = re.search(r"(\d{4})[_-]?(\d{2})[_-]?(\d{2})", name)
+    if ymd is None:
+        raise ValueError(f"No date in file name {name}")
+    return pd.Timestamp(*map(int, ymd.groups()))
+
+
+def ndvi_files(
+        ndvi_dir: Union[str, Path],
+        pattern: str = "*.tif"
+        ) -> pd.Series:
+    """
+    NDVI GeoTIFFs in ndvi_dir as a Series of paths indexed by date
+    """
+    paths = sorted(Path(ndvi_dir).glob(pattern))
+    files = pd.Series(
+        paths, index=pd.DatetimeIndex([ndvi_file_date(p) for p in paths]))
+    return files.sort_index()
+
+
+def scale_ndvi(
+        raw: np.ndarray,
+        qa: Union[np.ndarray, None] = None,
+        max_reliability: int = 1,
+        scale: float = MOD13A1["scale"],
+        offset: float = MOD13A1["offset"],
+        fill: Union[float, None] = MOD13A1["fill"],
+        valid_range: Union[tuple, None] = MOD13A1["valid_range"]
+        ) -> np.ndarray:
+    """
+    Raw NDVI counts to float32 NDVI, NaN where fill, out of range, or
+    where the pixel reliability qa (0 good, 1 marginal, 2 snow/ice,
+    3 cloudy) is above max_reliability or negative (fill).
+    """
+    ndvi = raw.astype(np.float32)*np.float32(scale) + np.float32(offset)
+    invalid = np.zeros(raw.shape, dtype=bool)
+    if fill is not None:
+        invalid |= raw == fill
+    if valid_range is not None:
+        invalid |= (raw < valid_range[0]) | (raw > valid_range[1])
+    if qa is not None:
+        invalid |= (qa < 0) | (qa > max_reliability)
+    ndvi[invalid] = np.nan
+    return ndvi
+
+
+def zone_grid(
+        geometry: gpd.GeoSeries,
+        raster_file: Union[str, Path],
+        cache_file: Union[str, Path, None] = None
+        ) -> ZoneGrid:
+    """
+    Sparse (zone x pixel) membership of the pixels of raster_file inside
+    the bounds of geometry, with the window those pixels come from.
+    Zones that overlap, e.g. the outside rings of neighbouring parks, are
+    rasterised one at a time; otherwise all at once.
+    If cache_file is given the grid is read from it when it was built
+    from the same zones and raster grid, otherwise saved to it.
+    """
+    with rio.open(raster_file) as src:
+        key = cache_key(
+            geometry_digest(geometry),
+            str(src.crs),
+            list(src.transform)[:6],
+            [src.width, src.height])
+        if cache_file is not None and Path(cache_file).exists():
+            cached = np.load(cache_file)
+            if "key" in cached and str(cached["key"]) == key:
+                weights = sparse.csr_matrix(
+                    (cached["data"], cached["indices"], cached["indptr"]),
+                    shape=tuple(cached["shape"]))
+                return ZoneGrid(weights, Window(*cached["window"]))
+        geometry = geometry.to_crs(src.crs)
+        window = from_bounds(*geometry.total_bounds, src.transform)
+        window = window.round_offsets().round_lengths().intersection(
+            Window(0, 0, src.width, src.height))
+        transform = src.window_transform(window)
+    shape = (int(window.height), int(window.width))
+
+    left, right = geometry.sindex.query(geometry, predicate="intersects")
+    pairs = left != right
+    overlapping = ~geometry.iloc[left[pairs]].touches(
+        geometry.iloc[right[pairs]], align=False)
+    if overlapping.any():
+        rows = []
+        for geom in geometry:
+            mask = rasterize(
+                [(geom, 1)], out_shape=shape, transform=transform,
+                fill=0, dtype="uint8")
+            rows.append(sparse.csr_matrix(mask.ravel(), dtype=np.float32))
+        weights = sparse.vstack(rows, format="csr")
+    else:
+        index = polygon_index_raster(geometry, transform, shape).ravel()
+        pixels = np.flatnonzero(index >= 0)
+        weights = sparse.csr_matrix(
+            (np.ones(len(pixels), np.float32), (index[pixels], pixels)),
+            shape=(len(geometry), index.size))
+
+    if cache_file is not None:
+        with atomic_write(cache_file) as f:
+            np.savez(
+                f,
+                data=weights.data,
+                indices=weights.indices,
+                indptr=weights.indptr,
+                shape=np.array(weights.shape),
+                window=np.array(
+                    [window.col_off, window.row_off, window.width,
+                     window.height]),
+                key=key)
+    return ZoneGrid(weights, window)
+
+
+def _init_worker(zones: ZoneGrid) -> None:
+    global _zones
+    _zones = zones
+
+
+def _date_means(args: tuple) -> np.ndarray:
+    path, ndvi_band, qa_band, kwargs = args
+    with rio.open(path) as src:
+        raw = src.read(ndvi_band, window=_zones.window)
+        qa = None if qa_band is None else src.read(
+            qa_band, window=_zones.window)
+    ndvi = scale_ndvi(raw, qa, **kwargs)
+    return zonal_means(_zones.weights, ndvi.reshape(-1, 1))[:, 0]
+
+
+def zonal_ndvi(
+        files: pd.Series,
+        geometry: gpd.GeoSeries,
+        ndvi_band: int = 1,
+        qa_band: Union[int, None] = None,
+        cache_file: Union[str, Path, None] = None,
+        processes: Union[int, None] = None,
+        **kwargs
+        ) -> pd.DataFrame:
+    """
+    Mean NDVI of every zone (park zones or SSM polygons) for every date.
+    files is a Series of GeoTIFF paths indexed by date, e.g. from
+    `ndvi_files`, all on the same grid. kwargs go to `scale_ndvi`.
+    Returns a DataFrame with one row per date and a column per zone.
+    """
+    zones = zone_grid(geometry, files.iloc[0], cache_file)
+    jobs = [(path, ndvi_band, qa_band, kwargs) for path in files]
+    with Pool(
+            processes=processes or worker_count(),
+            initializer=_init_worker,
+            initargs=(zones,)) as pool:
+        means = pool.map(_date_means, jobs)
+    return pd.DataFrame(
+        np.vstack(means), index=files.index, columns=geometry.index)
+
+
+def write_zonal_stats(
+        ndvi: pd.Series,
+        out_file: Union[str, Path]
+        ) -> None:
+    """
+    One zone's series in the geemap zonal statistics CSV layout, so
+    `ndvi_store` reads local and Earth Engine results the same way
+    """
+    row = pd.DataFrame(
+        [ndvi.to_numpy()], columns=ndvi.index.strftime("%Y_%m_%d_NDVI"))
+    row["source"] = "local"
+    row.to_csv(out_file, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Park and SSM polygon NDVI from local GeoTIFFs')
+    parser.add_argument(
+        'ndvi_dir',
+        help='directory of NDVI GeoTIFFs, one per date',
+        metavar='DIR')
+    parser.add_argument('region', help='region in regions.toml')
+    parser.add_argument(
+        '-q',
+        '--qa_band',
+        type=int,
+        help='band holding the pixel reliability')
+    parser.add_argument(
+        '-o',
+        '--out_dir',
+        help='where to write the {zone}_{park}_mean_ndvi.csv files. Default '
+             'is ndvi_dir/zonal_stats, away from the Earth Engine exports',
+        metavar='DIR')
+    args = parser.parse_args()
+
+    region = get_region(args.region)
+    ssm_path = region.ssm_path
+    ndvi_dir = Path(args.ndvi_dir)
+    out_dir = Path(args.out_dir or ndvi_dir/"zonal_stats")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    gdf = load_ssm(region.shp_file, region.polygon_geojson)
+    files = ndvi_files(ndvi_dir)
+    parks = load_parks(region.national_parks)
+    parks = parks[parks.intersects(gdf.to_crs(parks.crs).union_all())]
+    zones = park_zones(parks.reset_index(drop=True))
+
+    zone_ndvi = zonal_ndvi(
+        files, zones.geometry, qa_band=args.qa_band,
+        cache_file=ndvi_dir/f"zone_grid_{ssm_path.name}.npz")
+    for i, zone in zones.iterrows():
+        park = zone["NAME"].lower().replace(" ", "-")
+        write_zonal_stats(
+            zone_ndvi[i], out_dir/f"{zone['zone']}_{park}_mean_ndvi.csv")
+
+    polygon_ndvi = zonal_ndvi(
+        files, gdf.geometry, qa_band=args.qa_band,
+        cache_file=ndvi_dir/f"polygon_grid_{ssm_path.name}.npz")
+    polygon_ndvi.index = polygon_ndvi.index.strftime("D%Y%m%d")
+    polygon_ndvi.T.to_csv(ssm_path/"polygon_ndvi.csv")
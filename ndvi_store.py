@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+NDVI time series from the geemap zonal statistics CSVs.
+Every {zone}_{park}_{stat}_ndvi.csv in the download directory is read
+once into a single table indexed by (zone, park, date) with a column per
+statistic. Headers are parsed in one vectorised call, the table is
+cached in memory and in a cache directory (NDVI_CACHE, the download
+directory may be read-only), and is rebuilt whenever a CSV changes.
+"""
+
+import hashlib
+import os
+import warnings
+
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from file_utils import atomic_write
+
+NDVI_DIR = Path("/data/tapas/pearse/ee_downloads")
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("NDVI_CACHE", Path.home()/".cache/eo_scripts/ndvi"))
+_tables = {}
+
+
+def read_zonal_stats(stat_file: Union[str, Path]) -> pd.Series:
+    """
+    First feature of a geemap zonal statistics CSV as a Series indexed
+    by date. Headers are "%Y_%m_%d_NDVI"; the last column is the feature
+    properties and is dropped.
+    """
+    row = pd.read_csv(stat_file, nrows=1).iloc[0, :-1]
+    return pd.Series(
+        row.to_numpy(dtype=float),
+        index=pd.DatetimeIndex(
+            pd.to_datetime(row.index, format="%Y_%m_%d_NDVI"), name="date"))
+
+
+def parse_stat_file_name(stat_file: Union[str, Path]) -> tuple[str, str, str]:
+    """
+    zone, park and statistic from "{zone}_{park}_{stat}_ndvi.csv"
+    """
+    parts = Path(stat_file).stem.lower().split("_")
+    if len(parts) < 4 or parts[-1] != "ndvi":
+        raise ValueError(
+            f"{Path(stat_file).name} is not {{zone}}_{{park}}_{{stat}}_ndvi.csv")
+    zone, *park, stat, _ = parts
+    return zone, "_".join(park), stat
+
+
+def ingest(ndvi_dir: Union[str, Path] = NDVI_DIR) -> pd.DataFrame:
+    """
+    All zonal statistics CSVs in ndvi_dir as one table indexed by
+    (zone, park, date) with a column per statistic.
+    Files that aren't zonal statistics CSVs are skipped with a warning.
+    """
+    series = {}
+    for stat_file in sorted(Path(ndvi_dir).glob("*_ndvi.csv")):
+        try:
+            series[parse_stat_file_name(stat_file)] = read_zonal_stats(
+                stat_file)
+        except ValueError as e:
+            warnings.warn(f"Skipping {stat_file}: {e}")
+    if not series:
+        raise FileNotFoundError(f"No *_ndvi.csv files in {ndvi_dir}")
+    table = pd.concat(series, names=["zone", "park", "stat", "date"])
+    return table.unstack("stat").sort_index()
+
+
+def _csv_state(ndvi_dir: Path) -> list:
+    return sorted(
+        (f.name, f.stat().st_mtime_ns) for f in ndvi_dir.glob("*_ndvi.csv"))
+
+
+def load_ndvi(
+        ndvi_dir: Union[str, Path] = NDVI_DIR,
+        cache_dir: Union[str, Path, None] = None
+        ) -> pd.DataFrame:
+    """
+    The ingested table, from memory or else the on-disk cache if no CSV
+    has changed since it was built, otherwise rebuilt from the CSVs.
+    The CSVs' modification times are checked on every call.
+    """
+    ndvi_dir = Path(ndvi_dir).resolve()
+    cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else Path(cache_dir)
+    state = _csv_state(ndvi_dir)
+    if ndvi_dir in _tables and _tables[ndvi_dir]["state"] == state:
+        return _tables[ndvi_dir]["table"]
+
+    dir_key = hashlib.sha1(str(ndvi_dir).encode()).hexdigest()[:16]
+    cache_file = cache_dir/f"ndvi_store_{dir_key}.pkl"
+    cached = pd.read_pickle(cache_file) if cache_file.exists() else None
+    if cached is None or cached["state"] != state:
+        cached = {"state": state, "table": ingest(ndvi_dir)}
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with atomic_write(cache_file) as f:
+            pd.to_pickle(cached, f)
+    _tables[ndvi_dir] = cached
+    return cached["table"]
+
+
+def ndvi_series(
+        zone: str,
+        park: str,
+        stat: str = "mean",
+        ndvi_dir: Union[str, Path] = NDVI_DIR
+        ) -> pd.Series:
+    """
+    One NDVI time series, e.g. `ndvi_series("inside", "kasungu")`
+    """
+    table = load_ndvi(Path(ndvi_dir))
+    return table.loc[(zone.lower(), park.lower()), stat].dropna()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Multi-looked quick-looks of the interferograms and coherence of a stack.
+Each raster is multi-looked once (complex mean for interferograms, so
+the phase is that of the averaged signal, plain mean for coherence) into
+a tiled GeoTIFF next to it, with internal overviews for coarser levels.
+Interferograms also get an amplitude quick-look holding the mean and
+percentiles of the amplitude in each block.
+Figure and QA code then asks for the size it will draw at and GDAL
+serves it from the nearest level instead of reading the full raster.
+"""
+
+import argparse
+import warnings
+
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import rasterio as rio
+
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from interferogram_pairs import pair_index
+
+OVERVIEW_LEVELS = [2, 4, 8, 16]
+AMPLITUDE_PERCENTILES = (5, 50, 95)
+
+
+def quicklook_file(path: Union[str, Path]) -> Path:
+    """
+    Where the quick-look of path is written
+    """
+    path = Path(path)
+    return path.with_name(f"{path.name}.ql.tif")
+
+
+def amplitude_file(path: Union[str, Path]) -> Path:
+    """
+    Where the amplitude quick-look of an interferogram is written
+    """
+    path = Path(path)
+    return path.with_name(f"{path.name}.amp.ql.tif")
+
+
+def _blocks(
+        data: np.ndarray,
+        looks: tuple[int, int],
+        fill: Union[float, complex, bool]
+        ) -> np.ndarray:
+    """
+    data padded with fill to whole blocks, as (..., rows, ly, cols, lx)
+    """
+    ly, lx = looks
+    height, width = data.shape[-2:]
+    pad_y, pad_x = -height % ly, -width % lx
+    pad = [(0, 0)]*(data.ndim - 2) + [(0, pad_y), (0, pad_x)]
+    data = np.pad(data, pad, constant_values=fill)
+    return data.reshape(
+        data.shape[:-2] + ((height + pad_y)//ly, ly, (width + pad_x)//lx, lx))
+
+
+def multilook(
+        data: np.ndarray,
+        looks: tuple[int, int],
+        nodata: Union[float, complex, None] = 0
+        ) -> np.ndarray:
+    """
+    Mean of every looks[0] x looks[1] block of the last two axes,
+    leaving out NaN and nodata pixels. Complex data are averaged as
+    complex numbers. Edges that don't fill a block are averaged over the
+    pixels they have. Blocks with no valid pixels are NaN.
+    """
+    valid = np.isfinite(data)
+    if nodata is not None:
+        valid &= data != nodata
+    sums = _blocks(np.where(valid, data, 0), looks, 0).sum(axis=(-3, -1))
+    counts = _blocks(valid, looks, False).sum(axis=(-3, -1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums/counts
+
+
+def block_percentiles(
+        data: np.ndarray,
+        looks: tuple[int, int],
+        percentiles: tuple = AMPLITUDE_PERCENTILES
+        ) -> np.ndarray:
+    """
+    (percentiles x ...) percentiles of every looks[0] x looks[1] block of
+    the last two axes of a real array, leaving out NaN.
+    Blocks with no valid pixels are NaN.
+    """
+    blocks = _blocks(np.asarray(data, dtype=np.float32), looks, np.nan)
+    blocks = np.moveaxis(blocks, -3, -2)
+    blocks = blocks.reshape(blocks.shape[:-2] + (-1,))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(blocks, percentiles, axis=-1)
+
+
+def amplitude_layers(
+        data: np.ndarray,
+        looks: tuple[int, int],
+        nodata: Union[complex, None] = 0,
+        percentiles: tuple = AMPLITUDE_PERCENTILES
+        ) -> np.ndarray:
+    """
+    (1 + percentiles x ...) mean and percentiles of the amplitude of
+    complex data in every looks[0] x looks[1] block
+    """
+    valid = np.isfinite(data)
+    if nodata is not None:
+        valid &= data != nodata
+    amplitude = np.where(valid, np.abs(data), np.nan)
+    return np.concatenate([
+        multilook(amplitude, looks, None)[None],
+        block_percentiles(amplitude, looks, percentiles)])
+
+
+def _write_quicklook(
+        path: Path,
+        out_file: Path,
+        looks: tuple[int, int],
+        layers,
+        descriptions: list,
+        dtype: str,
+        overview_levels: list,
+        strip_blocks: int
+        ) -> Path:
+    """
+    Write layers(strip) -> (bands x rows x cols), for every strip of
+    band 1 of path, to out_file with average overviews.
+    Skipped if out_file is newer than path.
+    """
+    if out_file.exists() and out_file.stat().st_mtime > path.stat().st_mtime:
+        return out_file
+
+    ly, lx = looks
+    with rio.open(path) as src:
+        height = int(np.ceil(src.height/ly))
+        width = int(np.ceil(src.width/lx))
+        profile = dict(
+            driver="GTiff",
+            height=height,
+            width=width,
+            count=len(descriptions),
+            dtype=dtype,
+            crs=src.crs,
+            transform=src.transform*src.transform.scale(lx, ly),
+            # no NaN nodata for complex GeoTIFFs, empty blocks are 0
+            nodata=None if dtype == "complex64" else np.nan,
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate")
+        tmp_file = out_file.with_name(f".{out_file.name}.tmp")
+        try:
+            with rio.open(tmp_file, "w", **profile) as dst:
+                rows = ly*strip_blocks
+                for r0 in range(0, src.height, rows):
+                    strip = src.read(
+                        1,
+                        window=Window(
+                            0, r0, src.width, min(rows, src.height - r0)))
+                    looked = layers(strip)
+                    dst.write(
+                        looked.astype(dtype),
+                        window=Window(0, r0//ly, width, looked.shape[1]))
+                for band, description in enumerate(descriptions, 1):
+                    dst.set_band_description(band, description)
+                dst.build_overviews(overview_levels, Resampling.average)
+                dst.update_tags(ns="rio_overview", resampling="average")
+            tmp_file.replace(out_file)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+    return out_file
+
+
+def build_quicklook(
+        path: Union[str, Path],
+        looks: tuple[int, int] = (4, 4),
+        nodata: Union[float, complex, None] = 0,
+        overview_levels: list = OVERVIEW_LEVELS,
+        strip_blocks: int = 64,
+        percentiles: Union[tuple, None] = AMPLITUDE_PERCENTILES
+        ) -> Path:
+    """
+    Multi-look band 1 of path into `quicklook_file(path)` with average
+    overviews at overview_levels. The input is read strip_blocks rows of
+    blocks at a time. Skipped if the quick-look is newer than path.
+    Complex interferograms also get `amplitude_file(path)` with the block
+    mean of the amplitude in band 1 and its percentiles in the bands after,
+    unless percentiles is None.
+    """
+    path = Path(path)
+    with rio.open(path) as src:
+        complex_data = np.dtype(src.dtypes[0]).kind == "c"
+
+    if complex_data:
+        out_file = _write_quicklook(
+            path,
+            quicklook_file(path),
+            looks,
+            lambda strip: np.nan_to_num(multilook(strip, looks, nodata), nan=0)[None],
+            ["complex mean"],
+            "complex64",
+            overview_levels,
+            strip_blocks)
+        if percentiles is not None:
+            _write_quicklook(
+                path,
+                amplitude_file(path),
+                looks,
+                lambda strip: amplitude_layers(strip, looks, nodata, percentiles),
+                ["amplitude mean"] + [f"amplitude p{p:g}" for p in percentiles],
+                "float32",
+                overview_levels,
+                strip_blocks)
+        return out_file
+    return _write_quicklook(
+        path,
+        quicklook_file(path),
+        looks,
+        lambda strip: multilook(strip, looks, nodata)[None],
+        ["mean"],
+        "float32",
+        overview_levels,
+        strip_blocks)
+
+
+def stack_quicklooks(
+        merged_dir: Union[str, Path],
+        filenames: list = ["geo_filt_fine.cor", "geo_filt_fine.int"],
+        looks: tuple[int, int] = (4, 4),
+        processes: Union[int, None] = None
+        ) -> list:
+    """
+    Quick-looks of every filenames raster of every pair in merged_dir,
+    built across a process pool
+    """
+    paths = []
+    for filename in filenames:
+        paths.extend(pair_index(merged_dir, filename)["path"])
+    with Pool(processes=processes) as pool:
+        return pool.starmap(
+            build_quicklook, [(path, looks) for path in paths])
+
+
+def read_level(
+        path: Union[str, Path],
+        max_size: int = 1000,
+        band: int = 1
+        ) -> tuple[np.ndarray, list]:
+    """
+    band of path decimated so its longest side is at most max_size
+    pixels, read from the quick-look and its overviews if there is one.
+    Pass `amplitude_file(path)` for the amplitude layers.
+    Returns the data and its extent for imshow.
+    """
+    path = Path(path)
+    if quicklook_file(path).exists():
+        path = quicklook_file(path)
+    with rio.open(path) as src:
+        factor = max(1, int(np.ceil(max(src.height, src.width)/max_size)))
+        out_shape = (
+            int(np.ceil(src.height/factor)), int(np.ceil(src.width/factor)))
+        data = src.read(band, out_shape=out_shape)
+        west, south, east, north = src.bounds
+    return data, [west, east, south, north]
+
+
+def percentile_stretch(
+        data: np.ndarray,
+        percentiles: tuple[float, float] = (5, 95)
+        ) -> tuple[float, float]:
+    """
+    vmin, vmax for imshow from the finite, non-zero values of data
+    """
+    data = np.asarray(data)
+    valid = data[np.isfinite(data) & (data != 0)]
+    return tuple(np.percentile(valid, percentiles))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Build multi-looked quick-looks for an ISCE stack')
+    parser.add_argument(
+        'merged_dir',
+        help='ISCE merged/interferograms directory',
+        metavar='DIR')
+    parser.add_argument(
+        '-l',
+        '--looks',
+        nargs=2,
+        type=int,
+        default=[4, 4],
+        help='looks in y and x for the first level')
+    args = parser.parse_args()
+
+    out_files = stack_quicklooks(args.merged_dir, looks=tuple(args.looks))
+    print(f"{len(out_files)} quick-looks in {args.merged_dir}")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Inside/outside SSM time series for every protected area at once.
+SSM polygons are assigned to parks and to buffered "outside" rings with a
+single spatial join instead of one run of SSM_region_compare.py per park.
+"""
+
+import argparse
+
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from eo_utils import load_ssm
+from zonal_weights import overlap_weights, ssm_date_columns, zonal_means
+
+
+def load_parks(
+        nparks_geojson: Union[str, Path],
+        park_types: Union[list, None] = None
+        ) -> gpd.GeoDataFrame:
+    """
+    Read every feature of protected_areas.json.
+    TYPE seems to be 300 for national parks, 100 for forest reserves
+    and 200 for game reserves. Pass park_types to keep only some of them.
+    """
+    parks = gpd.read_file(nparks_geojson)
+    if park_types is not None:
+        parks = parks[parks["TYPE"].isin(park_types)]
+    return parks.reset_index(drop=True)
+
+
+def park_zones(
+        parks: gpd.GeoDataFrame,
+        buffer_distance: float = 10e3
+        ) -> gpd.GeoDataFrame:
+    """
+    Inside and outside zones for every park.
+    The outside zone is a ring of buffer_distance metres around the park.
+    Returns a GeoDataFrame with NAME, TYPE, zone and geometry columns,
+    all inside zones first followed by all outside zones.
+    """
+    crs = parks.crs
+    projected = parks.to_crs(parks.estimate_utm_crs())
+    rings = projected.buffer(buffer_distance).difference(
+        projected.geometry, align=False)
+
+    inside = parks[["NAME", "TYPE", "geometry"]].assign(zone="inside")
+    outside = inside.assign(zone="outside").set_geometry(rings.to_crs(crs))
+    zones = pd.concat([inside, outside], ignore_index=True)
+    return gpd.GeoDataFrame(zones, geometry="geometry", crs=crs)
+
+
+def membership_weights(
+        gdf: gpd.GeoDataFrame,
+        zones: gpd.GeoDataFrame
+        ) -> sparse.csr_matrix:
+    """
+    Sparse (zones x polygons) matrix with a 1 wherever an SSM polygon
+    intersects a zone, from one spatial join of all polygons and zones.
+    """
+    joined = gpd.sjoin(
+        gdf[["geometry"]].reset_index(drop=True),
+        zones[["geometry"]].reset_index(drop=True).to_crs(gdf.crs),
+        predicate="intersects")
+    return sparse.csr_matrix(
+        (
+            np.ones(len(joined)),
+            (joined["index_right"].to_numpy(), joined.index.to_numpy())
+        ),
+        shape=(len(zones), len(gdf)))
+
+
+def park_ssm_summary(
+        gdf: gpd.GeoDataFrame,
+        zones: gpd.GeoDataFrame,
+        area_weighted: bool = False
+        ) -> pd.DataFrame:
+    """
+    Mean SSM of every park zone on every date.
+    Returns a DataFrame indexed by date with (NAME, zone) columns.
+    """
+    date_cols = ssm_date_columns(gdf)
+    if area_weighted:
+        weights = overlap_weights(gdf, zones)
+    else:
+        weights = membership_weights(gdf, zones)
+    means = zonal_means(weights, gdf[date_cols].to_numpy(dtype=float))
+    return pd.DataFrame(
+        means.T,
+        index=pd.to_datetime(date_cols, format="D%Y%m%d"),
+        columns=pd.MultiIndex.from_frame(zones[["NAME", "zone"]]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Inside/outside SSM time series for all protected areas')
+    parser.add_argument(
+        'ssm_path',
+        help='directory of INSAR4SM results',
+        metavar='DIR')
+    parser.add_argument(
+        '-t',
+        '--types',
+        nargs='+',
+        type=int,
+        help='park TYPE values to keep (100, 200, 300). Default is all')
+    parser.add_argument(
+        '-b',
+        '--buffer',
+        type=float,
+        default=10e3,
+        help='width of the outside ring in metres')
+    parser.add_argument(
+        '-w',
+        '--area_weighted',
+        action='store_true',
+        help='weight polygons by their overlap area with each zone')
+    args = parser.parse_args()
+
+    root_path = Path("/data/tapas/pearse/malawi/")
+    nparks_geojson = root_path/"sentinel1/aoi/protected_areas.json"
+    ssm_path = Path(args.ssm_path)
+    shp_file = list(ssm_path.glob("*shp"))[0]
+    polygon_geojson = ssm_path/ssm_path.name/"INSAR4SM_processing/SM/SM_polygons.geojson"
+
+    gdf = load_ssm(shp_file, polygon_geojson)
+    parks = load_parks(nparks_geojson, args.types)
+    # only keep parks that touch the SSM results
+    parks = parks[parks.intersects(gdf.to_crs(parks.crs).union_all())]
+    zones = park_zones(parks.reset_index(drop=True), args.buffer)
+    summary = park_ssm_summary(gdf, zones, args.area_weighted)
+    summary.to_csv(ssm_path/"park_ssm_summary.csv")
+    print(f"Wrote {len(parks)} parks to {ssm_path/'park_ssm_summary.csv'}")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+A small cached pipeline of named stages.
+Each stage is a function of its upstream stages' results and some
+parameters. A stage's key is a hash of its code, its parameters, its
+version, the contents of its input files and the keys of its upstream
+stages, so a result is only recomputed when something it depends on has
+changed. Results are pickled to the cache directory under that key with
+fingerprints of the files they return, and stages whose upstream stages
+are done run concurrently in a thread pool. A stage that reruns, because
+it was stale or forced, reruns everything downstream of it too.
+"""
+
+import hashlib
+import inspect
+import json
+import pickle
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Union
+
+from file_utils import atomic_write, write_json
+
+# bump to invalidate every cached result, e.g. when the cache layout changes
+CACHE_VERSION = 2
+# files bigger than this are fingerprinted by size and mtime, not content
+MAX_HASH_BYTES = 64*2**20
+
+
+def file_fingerprint(path: Union[str, Path]) -> str:
+    """
+    Hash of a file's contents, or of the size and modification time of
+    every file in a directory or of a very large file
+    """
+    path = Path(path)
+    if not path.exists():
+        return "missing"
+    if path.is_dir():
+        stats = [
+            (str(f.relative_to(path)), f.stat().st_size, f.stat().st_mtime_ns)
+            for f in sorted(path.rglob("*")) if f.is_file()]
+        return hashlib.sha1(json.dumps(stats).encode()).hexdigest()
+    stat = path.stat()
+    if stat.st_size > MAX_HASH_BYTES:
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _result_paths(result) -> list:
+    """
+    Every Path in result, e.g. the files a download stage returns
+    """
+    if isinstance(result, Path):
+        return [result]
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        return [path for r in result for path in _result_paths(r)]
+    return []
+
+
+@dataclass
+class Stage:
+    """
+    func is called with the result of every stage in deps as a keyword
+    argument of the same name, plus params. files are input files the
+    result depends on. Change version to rerun a stage whose own code is
+    unchanged, e.g. after a change in a function it calls.
+    """
+    name: str
+    func: Callable
+    deps: list = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    files: list = field(default_factory=list)
+    version: str = ""
+
+
+class Pipeline:
+    """
+    Stages registered with `add` or the `stage` decorator, run with `run`
+    """
+
+    def __init__(self, cache_dir: Union[str, Path]) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.stages = {}
+
+    def add(self, stage: Stage) -> Stage:
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise KeyError(f"{stage.name} depends on unknown stage {dep}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def stage(
+            self,
+            deps: Union[list, None] = None,
+            files: Union[list, None] = None,
+            name: Union[str, None] = None,
+            version: str = "",
+            **params
+            ) -> Callable:
+        """
+        Decorator adding a function as a stage named after it
+        """
+        def register(func: Callable) -> Callable:
+            self.add(Stage(
+                name or func.__name__, func, list(deps or []), params,
+                list(files or []), version))
+            return func
+        return register
+
+    def order(self, targets: Union[list, None] = None) -> list:
+        """
+        targets and every stage they depend on, upstream first
+        """
+        targets = list(self.stages) if targets is None else targets
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} depends on itself")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in targets:
+            visit(name)
+        return ordered
+
+    def keys(self, names: list) -> dict:
+        """
+        Cache key of every stage in names, which must be in `order`
+        """
+        keys = {}
+        for name in names:
+            stage = self.stages[name]
+            try:
+                source = inspect.getsource(stage.func)
+            except (OSError, TypeError):
+                source = stage.func.__qualname__
+            description = json.dumps({
+                "cache_version": CACHE_VERSION,
+                "version": stage.version,
+                "func": f"{stage.func.__module__}.{stage.func.__qualname__}",
+                "source": source,
+                "params": stage.params,
+                "files": [file_fingerprint(f) for f in stage.files],
+                "deps": [keys[dep] for dep in stage.deps]},
+                sort_keys=True,
+                default=str)
+            keys[name] = hashlib.sha1(description.encode()).hexdigest()
+        return keys
+
+    def _cache_file(self, name: str, key: str) -> Path:
+        return self.cache_dir/f"{name}-{key[:16]}.pkl"
+
+    def _load(self, name: str, key: str):
+        with open(self._cache_file(name, key), "rb") as f:
+            return pickle.load(f)
+
+    def _save(self, name: str, key: str, result) -> None:
+        cache_file = self._cache_file(name, key)
+        write_json(
+            cache_file.with_suffix(".paths.json"),
+            {str(p): file_fingerprint(p) for p in _result_paths(result)})
+        # the result is written last, so an interrupted stage never looks done
+        with atomic_write(cache_file) as f:
+            pickle.dump(result, f)
+
+    def is_current(self, name: str, key: str) -> bool:
+        """
+        Whether there is a cached result for key whose output files,
+        if it has any, are unchanged since it was made
+        """
+        cache_file = self._cache_file(name, key)
+        paths_file = cache_file.with_suffix(".paths.json")
+        if not cache_file.exists() or not paths_file.exists():
+            return False
+        with open(paths_file) as f:
+            fingerprints = json.load(f)
+        return all(
+            file_fingerprint(p) == fingerprint
+            for p, fingerprint in fingerprints.items())
+
+    def run(
+            self,
+            targets: Union[list, None] = None,
+            force: Union[list, None] = None,
+            max_workers: Union[int, None] = None
+            ) -> dict:
+        """
+        Bring targets (default all stages) up to date and return their
+        results. Only stages that are stale, named in force, or downstream
+        of one of those are run; the results of current upstream stages are
+        read from the cache only if a stage that runs needs them.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        targets = list(self.stages) if targets is None else targets
+        names = self.order(targets)
+        keys = self.keys(names)
+        force = set(force or [])
+        # names is upstream first, so a stage's deps are decided before it
+        stale = []
+        for name in names:
+            if (
+                    name in force
+                    or any(dep in stale for dep in self.stages[name].deps)
+                    or not self.is_current(name, keys[name])):
+                stale.append(name)
+
+        results = {}
+        needed = set(targets)
+        for name in stale:
+            needed.update(self.stages[name].deps)
+        for name in needed.difference(stale):
+            results[name] = self._load(name, keys[name])
+            print(f"{name}: up to date")
+
+        def run_stage(name):
+            stage = self.stages[name]
+            kwargs = {dep: results[dep] for dep in stage.deps}
+            t0 = time.perf_counter()
+            result = stage.func(**kwargs, **stage.params)
+            self._save(name, keys[name], result)
+            print(f"{name}: ran in {time.perf_counter() - t0:.1f} s")
+            return result
+
+        waiting = list(stale)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while waiting or running:
+                ready = [
+                    name for name in waiting
+                    if all(dep in results for dep in self.stages[name].deps)]
+                for name in ready:
+                    waiting.remove(name)
+                    running[executor.submit(run_stage, name)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return {name: results[name] for name in targets}
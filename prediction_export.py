@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Export every time step of the CNN-LSTM predictions without loading the
+inputs into memory.
+The prediction and input arrays are memory-mapped and gridded a chunk of
+time steps at a time, then streamed into tiled, compressed Cloud
+Optimised GeoTIFFs (one per layer, one band per time step) or a single
+time-chunked NetCDF cube with the CRS attached.
+"""
+
+import argparse
+import os
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Union
+
+import netCDF4
+import numpy as np
+import rasterio as rio
+
+from rasterio.crs import CRS
+from rasterio.shutil import copy as rio_copy
+
+from prediction_gridding import GridIndex, grid_index, gridded_layers, parse_coords
+
+LAYERS = ["predictions", "raw_data", "lst_data", "prec_data"]
+
+
+def open_inputs(
+        predictions_path: Union[str, Path],
+        raw_data_path: Union[str, Path],
+        coords_path: Union[str, Path]
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Memory-map the prediction and input arrays; only the pixel
+    coordinates are read in full
+    """
+    predictions = np.load(predictions_path, mmap_mode='r')
+    raw_data = np.load(raw_data_path, mmap_mode='r')
+    px_coords = np.load(coords_path, allow_pickle=True)
+    return predictions, raw_data, px_coords
+
+
+def _time_chunks(n_time: int, chunk_size: int):
+    for t0 in range(0, n_time, chunk_size):
+        yield t0, min(t0 + chunk_size, n_time)
+
+
+def export_cog(
+        out_dir: Union[str, Path],
+        predictions: np.ndarray,
+        raw_data: np.ndarray,
+        index: GridIndex,
+        chunk_size: int = 16,
+        crs: str = "EPSG:4326"
+        ) -> list:
+    """
+    One COG per layer in out_dir with a band per time step.
+    Each layer is streamed into a tiled GeoTIFF and then copied to COG
+    layout by GDAL. Returns the written files.
+    """
+    out_dir = Path(out_dir)
+    n_time = predictions.shape[1]
+    height, width = index.shape
+    profile = dict(
+        driver="GTiff",
+        height=height,
+        width=width,
+        count=n_time,
+        dtype="float32",
+        crs=CRS.from_user_input(crs),
+        transform=index.transform,
+        nodata=np.nan,
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+        # band interleave so each chunk of bands only writes its own tiles
+        interleave="band",
+        BIGTIFF="IF_SAFER")
+    out_files = []
+    # the intermediate GeoTIFFs are removed with tmp_dir even on errors
+    with TemporaryDirectory(dir=out_dir, prefix=".cog_") as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        datasets = {}
+        try:
+            for name in LAYERS:
+                datasets[name] = rio.open(
+                    tmp_dir/f"{name}.tif", "w", **profile)
+            for t0, t1 in _time_chunks(n_time, chunk_size):
+                layers = gridded_layers(
+                    predictions, raw_data, index, slice(t0, t1))
+                for name, grid in layers.items():
+                    datasets[name].write(
+                        grid, indexes=list(range(t0 + 1, t1 + 1)))
+        finally:
+            for dst in datasets.values():
+                dst.close()
+
+        for name in LAYERS:
+            out_file = out_dir/f"{name}.tif"
+            rio_copy(
+                tmp_dir/f"{name}.tif", tmp_dir/f"{name}.cog.tif",
+                driver="COG", compress="deflate", BIGTIFF="IF_SAFER")
+            os.replace(tmp_dir/f"{name}.cog.tif", out_file)
+            out_files.append(out_file)
+    return out_files
+
+
+def export_netcdf(
+        out_file: Union[str, Path],
+        predictions: np.ndarray,
+        raw_data: np.ndarray,
+        index: GridIndex,
+        chunk_size: int = 16,
+        crs: str = "EPSG:4326"
+        ) -> Path:
+    """
+    All layers in one NetCDF cube chunked one time step at a time,
+    with a CF grid mapping so GIS tools pick up the CRS
+    """
+    n_time = predictions.shape[1]
+    height, width = index.shape
+    transform = index.transform
+    with netCDF4.Dataset(out_file, "w") as nc:
+        nc.createDimension("time", n_time)
+        nc.createDimension("lat", height)
+        nc.createDimension("lon", width)
+        time = nc.createVariable("time", "i4", ("time",))
+        time[:] = np.arange(n_time)
+        time.long_name = "prediction time index"
+        lat = nc.createVariable("lat", "f8", ("lat",))
+        lat[:] = transform.f + transform.e*(np.arange(height) + 0.5)
+        lat.units = "degrees_north"
+        lon = nc.createVariable("lon", "f8", ("lon",))
+        lon[:] = transform.c + transform.a*(np.arange(width) + 0.5)
+        lon.units = "degrees_east"
+        spatial_ref = nc.createVariable("spatial_ref", "i4")
+        spatial_ref.crs_wkt = CRS.from_user_input(crs).to_wkt()
+        spatial_ref.GeoTransform = " ".join(
+            str(t) for t in transform.to_gdal())
+
+        variables = {}
+        for name in LAYERS:
+            variables[name] = nc.createVariable(
+                name,
+                "f4",
+                ("time", "lat", "lon"),
+                zlib=True,
+                chunksizes=(1, height, width),
+                fill_value=np.float32(np.nan))
+            variables[name].grid_mapping = "spatial_ref"
+
+        for t0, t1 in _time_chunks(n_time, chunk_size):
+            layers = gridded_layers(
+                predictions, raw_data, index, slice(t0, t1))
+            for name, grid in layers.items():
+                variables[name][t0:t1] = grid
+    return Path(out_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Export all CNN-LSTM prediction time steps')
+    parser.add_argument(
+        'predictions',
+        help='predictions .npy file (pixels x time x 1)')
+    parser.add_argument(
+        '-r',
+        '--raw_data',
+        default="/data/tapas/cnn_lstm/malawi/cnn_lstm_training/flattened_arrs/3D_nonstatic_v1.npy",
+        help='input array .npy file (time x pixels x features)')
+    parser.add_argument(
+        '-c',
+        '--coords',
+        default="/data/tapas/cnn_lstm/malawi/cnn_lstm_training/flattened_arrs/1D_coords.npy",
+        help='pixel coordinates .npy file')
+    parser.add_argument(
+        '-o',
+        '--out',
+        required=True,
+        help='output directory for COGs, or a .nc file for NetCDF',
+        metavar='PATH')
+    parser.add_argument(
+        '-n',
+        '--chunk_size',
+        type=int,
+        default=16,
+        help='number of time steps gridded at once')
+    args = parser.parse_args()
+
+    predictions, raw_data, px_coords = open_inputs(
+        args.predictions, args.raw_data, args.coords)
+    index = grid_index(
+        parse_coords(px_coords),
+        Path(args.coords).with_name("1D_coords_grid_index.npz"))
+    out = Path(args.out)
+    if out.suffix == ".nc":
+        export_netcdf(out, predictions, raw_data, index, args.chunk_size)
+    else:
+        out.mkdir(parents=True, exist_ok=True)
+        export_cog(out, predictions, raw_data, index, args.chunk_size)
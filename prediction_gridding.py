@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Put the flattened CNN-LSTM pixel arrays back on a lon/lat grid.
+Pixel coordinates are parsed once into row/col indices (cached to disk),
+after which any number of bands and time indices are placed on the grid
+with a single fancy-index assignment instead of a per-pixel search.
+"""
+
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import numpy as np
+import pandas as pd
+
+from rasterio.transform import Affine, from_origin
+
+from eo_utils import cache_key
+from file_utils import atomic_write
+
+
+class GridIndex(NamedTuple):
+    """
+    Where each flattened pixel sits on a north-up lon/lat grid
+    """
+    rows: np.ndarray
+    cols: np.ndarray
+    shape: tuple
+    transform: Affine
+
+
+def parse_coords(px_coords: np.ndarray) -> np.ndarray:
+    """
+    (pixels x 2) float array of lon, lat from the "(lon, lat)" strings in
+    1D_coords.npy, without eval. Numeric arrays are passed straight through.
+    """
+    px_coords = np.asarray(px_coords)
+    if px_coords.dtype.kind in "fiu":
+        return px_coords.astype(float)
+    coords = pd.Series(px_coords.astype(str)).str.strip("()[] ")
+    return coords.str.split(",", expand=True).astype(float).to_numpy()
+
+
+def grid_index(
+        coords: np.ndarray,
+        cache_file: Union[str, Path, None] = None
+        ) -> GridIndex:
+    """
+    Row/col of every pixel on a regular north-up grid covering coords.
+    Cells are placed by rounding to the typical spacing of the unique lons
+    and lats, so gaps in the pixel list don't shift the grid.
+    If cache_file is given the index is read from it when it was built
+    from the same coords, otherwise saved to it.
+    """
+    key = cache_key(np.asarray(coords))
+    if cache_file is not None and Path(cache_file).exists():
+        cached = np.load(cache_file)
+        if "key" in cached and str(cached["key"]) == key:
+            return GridIndex(
+                cached["rows"],
+                cached["cols"],
+                tuple(cached["shape"]),
+                Affine(*cached["transform"]))
+
+    lon, lat = coords[:, 0], coords[:, 1]
+    unique_lons = np.unique(lon)
+    unique_lats = np.unique(lat)
+    res_x = np.median(np.diff(unique_lons)) if len(unique_lons) > 1 else 1.0
+    res_y = np.median(np.diff(unique_lats)) if len(unique_lats) > 1 else 1.0
+    cols = np.rint((lon - unique_lons[0])/res_x).astype(np.int64)
+    rows = np.rint((unique_lats[-1] - lat)/res_y).astype(np.int64)
+    shape = (int(rows.max()) + 1, int(cols.max()) + 1)
+    transform = from_origin(
+        unique_lons[0] - res_x/2, unique_lats[-1] + res_y/2, res_x, res_y)
+
+    if cache_file is not None:
+        with atomic_write(cache_file) as f:
+            np.savez(
+                f,
+                rows=rows,
+                cols=cols,
+                shape=np.array(shape),
+                transform=np.array(transform)[:6],
+                key=key)
+    return GridIndex(rows, cols, shape, transform)
+
+
+def scatter_to_grid(
+        values: np.ndarray,
+        index: GridIndex
+        ) -> np.ndarray:
+    """
+    Place (pixels, ...) values on the grid. Any trailing axes (bands,
+    time indices) come first in the output: (..., rows, cols).
+    Cells with no pixel are NaN.
+    """
+    values = np.asarray(values)
+    values = np.moveaxis(values, 0, -1)
+    grid = np.full(values.shape[:-1] + index.shape, np.nan, dtype=np.float32)
+    grid[..., index.rows, index.cols] = values
+    return grid
+
+
+def gridded_layers(
+        predictions: np.ndarray,
+        raw_data: np.ndarray,
+        index: GridIndex,
+        time_indices: Union[np.ndarray, list, slice]
+        ) -> dict:
+    """
+    Predictions, raw SSM, LST and precipitation for time_indices as
+    (time x rows x cols) arrays.
+    predictions is (pixels x time x 1), raw_data is (time x pixels x
+    features) with the prediction period at the end.
+    """
+    n_time = predictions.shape[1]
+    raw_data = raw_data[-n_time:]
+    layers = {"predictions": predictions[:, time_indices, 0]}
+    for band, name in enumerate(["raw_data", "lst_data", "prec_data"]):
+        layers[name] = np.moveaxis(raw_data[time_indices, :, band], 0, -1)
+    return {
+        name: scatter_to_grid(layer, index) for name, layer in layers.items()}
+
+
+def prepare_gridded_data(
+        predictions: np.ndarray,
+        raw_data: np.ndarray,
+        px_coords: np.ndarray,
+        time_index: int
+        ) -> tuple:
+    """
+    Drop-in for the function of the same name in prediction_to_tiff.ipynb.
+    Note the grids here are north-up (first row is the northernmost).
+    """
+    index = grid_index(parse_coords(px_coords))
+    layers = gridded_layers(predictions, raw_data, index, [time_index])
+    rows, cols = index.shape
+    lon = index.transform.c + index.transform.a*(np.arange(cols) + 0.5)
+    lat = index.transform.f + index.transform.e*(np.arange(rows) + 0.5)
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    return (
+        lon_grid,
+        lat_grid,
+        layers["predictions"][0],
+        layers["raw_data"][0],
+        layers["lst_data"][0],
+        layers["prec_data"][0])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Registry of the regions (AOI, park, SSM results, ERA5, ISCE stack) the
+analysis scripts run on, read from regions.toml (or a YAML file with the
+same layout). Adding a region is one entry in the config file.
+"""
+
+import os
+import tomllib
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Union
+
+from shapely.geometry import MultiPolygon, Polygon
+
+from eo_utils import geojson_to_shapely
+
+DEFAULT_CONFIG = Path(
+    os.environ.get("EO_REGIONS", Path(__file__).with_name("regions.toml")))
+
+
+@dataclass
+class Region:
+    """
+    Everything the analysis scripts need to know about one region
+    """
+    name: str
+    root_path: Path
+    aoi: Path
+    national_parks: Path
+    park_index: int
+    ssm_path: Path
+    shp_file: Path
+    polygon_geojson: Path
+    era5_file: Path
+    merged_dir: Path
+    ndvi_dir: Path
+    slc_dir: Path
+    soilgrids_dir: Path
+    legend_loc: tuple
+
+    def park(self) -> Union[Polygon, MultiPolygon]:
+        return geojson_to_shapely(self.national_parks, self.park_index)
+
+
+def read_config(config_file: Union[str, Path] = DEFAULT_CONFIG) -> dict:
+    config_file = Path(config_file)
+    if config_file.suffix in [".yaml", ".yml"]:
+        import yaml
+        with open(config_file) as f:
+            return yaml.safe_load(f)
+    with open(config_file, "rb") as f:
+        return tomllib.load(f)
+
+
+def load_regions(config_file: Union[str, Path] = DEFAULT_CONFIG) -> dict:
+    """
+    Every region in config_file by name
+    """
+    config = read_config(config_file)
+    defaults = config.get("defaults", {})
+    regions = {}
+    for name, entry in config["regions"].items():
+        entry = {**defaults, **entry}
+        root_path = Path(entry["root_path"])
+        ssm_path = root_path/entry["ssm_path"]
+        regions[name] = Region(
+            name=name,
+            root_path=root_path,
+            aoi=root_path/entry["aoi"],
+            national_parks=root_path/entry["national_parks"],
+            park_index=int(entry["park_index"]),
+            ssm_path=ssm_path,
+            shp_file=ssm_path/entry["shp_file"],
+            polygon_geojson=ssm_path/entry["polygon_geojson"],
+            era5_file=root_path/entry["era5_file"],
+            merged_dir=root_path/entry["merged_dir"],
+            ndvi_dir=root_path/entry["ndvi_dir"],
+            slc_dir=root_path/entry.get("slc_dir", f"sentinel1/{name}_slc"),
+            soilgrids_dir=root_path/entry.get(
+                "soilgrids_dir", f"soilgrids/{name}"),
+            legend_loc=tuple(entry["legend_loc"]))
+    return regions
+
+
+def get_region(
+        name: str,
+        config_file: Union[str, Path] = DEFAULT_CONFIG
+        ) -> Region:
+    regions = load_regions(config_file)
+    if name not in regions:
+        raise KeyError(
+            f"Region {name} not in {config_file}. "
+            f"Must be one of {', '.join(regions)}")
+    return regions[name]
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Closed-form least squares for many fits at once, shared by the drying
+rate and coherence regression scripts.
+"""
+
+import numpy as np
+
+
+def ols_from_sums(
+        n: np.ndarray,
+        sx: np.ndarray,
+        sy: np.ndarray,
+        sxx: np.ndarray,
+        sxy: np.ndarray,
+        syy: np.ndarray
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Closed form least squares slope, intercept and r^2
+    from sums of x, y, x^2, xy and y^2, for any number of fits at once.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sxx_c = sxx - sx*sx/n
+        sxy_c = sxy - sx*sy/n
+        syy_c = syy - sy*sy/n
+        slope = sxy_c/sxx_c
+        intercept = (sy - slope*sx)/n
+        r2 = sxy_c**2/(sxx_c*syy_c)
+    return slope, intercept, r2
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+SSM results as a (polygon x time) array rather than a wide GeoDataFrame.
+Selections by date, region and nearest acquisition work on the array and
+the DatetimeIndex directly instead of slicing columns by position.
+"""
+
+from functools import cached_property
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from shapely.geometry import MultiPolygon, Polygon
+
+from eo_utils import load_ssm
+from zonal_weights import ssm_date_columns
+
+
+def datetime_ns(dates: Union[pd.DatetimeIndex, np.ndarray, list]) -> np.ndarray:
+    """
+    Dates as int64 nanoseconds, whatever resolution pandas parsed them at
+    """
+    return np.asarray(
+        pd.DatetimeIndex(np.atleast_1d(dates)), dtype="datetime64[ns]"
+        ).astype(np.int64)
+
+
+def nearest_index(
+        sorted_dates: pd.DatetimeIndex,
+        dates: Union[pd.DatetimeIndex, np.ndarray, list],
+        tolerance: Union[pd.Timedelta, None] = None
+        ) -> np.ndarray:
+    """
+    Index of the nearest entry of sorted_dates for every one of dates.
+    Entries further away than tolerance, or all of them if sorted_dates
+    is empty, are set to -1.
+    """
+    sorted_ns = datetime_ns(sorted_dates)
+    dates_ns = datetime_ns(dates)
+    if len(sorted_ns) == 0:
+        return np.full(len(dates_ns), -1)
+    if len(sorted_ns) == 1:
+        ind = np.zeros(len(dates_ns), dtype=int)
+    else:
+        right = np.clip(
+            np.searchsorted(sorted_ns, dates_ns), 1, len(sorted_ns) - 1)
+        left = right - 1
+        take_left = (
+            (dates_ns - sorted_ns[left]) <= (sorted_ns[right] - dates_ns))
+        ind = np.where(take_left, left, right)
+    if tolerance is not None:
+        too_far = np.abs(sorted_ns[ind] - dates_ns) > pd.Timedelta(tolerance).value
+        ind = np.where(too_far, -1, ind)
+    return ind
+
+
+class SSMCube:
+    """
+    Soil moisture inversions held as
+        values: float32 (polygon x time) array
+        dates: sorted DatetimeIndex of the acquisitions
+        geometry: GeoSeries of the SSM polygons
+    The constructor sorts by date and makes values contiguous. Selections
+    return new cubes over views of the values where numpy allows, without
+    re-sorting; `nearest` keeps the order of the dates asked for.
+    Reductions are computed on first use.
+    """
+
+    def __init__(
+            self,
+            values: np.ndarray,
+            dates: Union[pd.DatetimeIndex, list],
+            geometry: gpd.GeoSeries
+            ) -> None:
+        dates = pd.DatetimeIndex(dates)
+        order = np.argsort(datetime_ns(dates), kind="stable")
+        if np.any(order != np.arange(len(order))):
+            values = np.asarray(values)[:, order]
+            dates = dates[order]
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        self.dates = dates
+        self.geometry = geometry.reset_index(drop=True)
+        self._check_shape()
+
+    def _check_shape(self) -> None:
+        if self.values.shape != (len(self.geometry), len(self.dates)):
+            raise ValueError(
+                f"values shape {self.values.shape} does not match "
+                f"{len(self.geometry)} polygons and {len(self.dates)} dates")
+
+    @classmethod
+    def from_gdf(cls, gdf: gpd.GeoDataFrame) -> "SSMCube":
+        """
+        Build from a `load_ssm` GeoDataFrame
+        """
+        date_cols = ssm_date_columns(gdf)
+        return cls(
+            gdf[date_cols].to_numpy(dtype=np.float32),
+            pd.to_datetime(date_cols, format="D%Y%m%d"),
+            gdf.geometry)
+
+    @classmethod
+    def from_files(
+            cls,
+            shp_file: Union[str, Path],
+            polygon_geojson: Union[str, Path]
+            ) -> "SSMCube":
+        """
+        Shortcut to load soil moisture results straight into a cube
+        """
+        return cls.from_gdf(load_ssm(shp_file, polygon_geojson))
+
+    def __len__(self) -> int:
+        return len(self.geometry)
+
+    def __repr__(self) -> str:
+        if len(self.dates) == 0:
+            return f"SSMCube({len(self)} polygons, 0 dates)"
+        return (
+            f"SSMCube({len(self)} polygons, {len(self.dates)} dates, "
+            f"{self.dates[0].date()} to {self.dates[-1].date()})")
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    @property
+    def crs(self):
+        return self.geometry.crs
+
+    @property
+    def sindex(self):
+        """
+        Spatial index of the polygons, built once by geopandas
+        """
+        return self.geometry.sindex
+
+    @cached_property
+    def days(self) -> np.ndarray:
+        """
+        Days since the first acquisition, empty for a cube with no dates
+        """
+        if len(self.dates) == 0:
+            return np.array([], dtype=np.int64)
+        return (self.dates - self.dates[0]).days.to_numpy()
+
+    @cached_property
+    def date_mean(self) -> pd.Series:
+        """
+        Mean over all polygons for each date, i.e. `gdf.mean(numeric_only=True)`
+        """
+        return pd.Series(np.nanmean(self.values, axis=0), index=self.dates)
+
+    @cached_property
+    def polygon_mean(self) -> np.ndarray:
+        """
+        Mean over all dates for each polygon
+        """
+        return np.nanmean(self.values, axis=1)
+
+    def _new(
+            self,
+            values: np.ndarray,
+            dates: pd.DatetimeIndex,
+            geometry: gpd.GeoSeries
+            ) -> "SSMCube":
+        # selections are already in order, so skip the sort and copy of
+        # the constructor and only check the shapes agree
+        cube = object.__new__(type(self))
+        cube.values = values
+        cube.dates = dates
+        cube.geometry = geometry
+        cube._check_shape()
+        return cube
+
+    def date_range(
+            self,
+            start: Union[str, pd.Timestamp, None] = None,
+            end: Union[str, pd.Timestamp, None] = None
+            ) -> "SSMCube":
+        """
+        Dates between start and end inclusive
+        """
+        dates_ns = datetime_ns(self.dates)
+        i0 = 0 if start is None else np.searchsorted(
+            dates_ns, datetime_ns(start)[0], side="left")
+        i1 = len(self.dates) if end is None else np.searchsorted(
+            dates_ns, datetime_ns(end)[0], side="right")
+        return self._new(
+            self.values[:, i0:i1], self.dates[i0:i1], self.geometry)
+
+    def nearest_index(
+            self,
+            dates: Union[pd.DatetimeIndex, np.ndarray, list],
+            tolerance: Union[pd.Timedelta, None] = None
+            ) -> np.ndarray:
+        return nearest_index(self.dates, dates, tolerance)
+
+    def nearest(
+            self,
+            dates: Union[pd.DatetimeIndex, np.ndarray, list]
+            ) -> "SSMCube":
+        """
+        The acquisitions closest to each of dates, in the order of dates
+        """
+        if len(self.dates) == 0:
+            raise ValueError("cube has no acquisitions to match dates to")
+        ind = self.nearest_index(dates)
+        return self._new(self.values[:, ind], self.dates[ind], self.geometry)
+
+    def region_mask(
+            self,
+            region: Union[Polygon, MultiPolygon],
+            predicate: str = "intersects"
+            ) -> np.ndarray:
+        """
+        Boolean mask of polygons that intersect (or `predicate`) region
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.sindex.query(region, predicate=predicate)] = True
+        return mask
+
+    def subset(self, mask: np.ndarray) -> "SSMCube":
+        """
+        Polygons selected by a boolean mask or index array
+        """
+        if np.asarray(mask).dtype == bool:
+            mask = np.flatnonzero(mask)
+        return self._new(
+            self.values[mask],
+            self.dates,
+            self.geometry.iloc[mask].reset_index(drop=True))
+
+    def split_region(
+            self,
+            region: Union[Polygon, MultiPolygon]
+            ) -> tuple["SSMCube", "SSMCube"]:
+        """
+        Cubes of polygons inside and outside region,
+        same as `split_inside_outside` in SSM_region_compare.py
+        """
+        mask = self.region_mask(region)
+        return self.subset(mask), self.subset(~mask)
+
+    def to_gdf(self) -> gpd.GeoDataFrame:
+        """
+        Back to the wide `load_ssm` layout
+        """
+        columns = self.dates.strftime("D%Y%m%d")
+        df = pd.DataFrame(self.values, columns=columns)
+        return gpd.GeoDataFrame(
+            pd.concat([self.geometry.to_frame("geometry"), df], axis=1),
+            geometry="geometry",
+            crs=self.crs)
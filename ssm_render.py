@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Fast rendering of SSM maps.
+The SSM polygons are rasterised once to a grid of polygon indices; every
+date, difference or year-on-year layer is then an index gather into the
+(polygon x layer) array drawn with imshow, instead of a new PatchCollection
+of every polygon for every panel.
+"""
+
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import geopandas as gpd
+import numpy as np
+import rasterio as rio
+
+from matplotlib.axes import Axes
+from matplotlib.colors import Colormap, Normalize
+from rasterio.transform import Affine, from_origin
+
+from eo_utils import cache_key, geometry_digest, polygon_index_raster
+from file_utils import atomic_write
+
+
+class RenderGrid(NamedTuple):
+    """
+    Polygon index raster (-1 outside) and where it sits
+    """
+    index: np.ndarray
+    transform: Affine
+    extent: tuple
+    crs: str
+
+
+def render_grid(
+        geometry: gpd.GeoSeries,
+        resolution: Union[float, None] = None,
+        cache_file: Union[str, Path, None] = None
+        ) -> RenderGrid:
+    """
+    Rasterise the SSM polygons to an index grid.
+    The default resolution is a quarter of the typical polygon width,
+    fine enough that the polygon edges look right at figure scale.
+    If cache_file is given the grid is read from it when it was built
+    from the same polygons and resolution, otherwise saved to it.
+    """
+    crs = geometry.crs.to_string()
+    key = cache_key(geometry_digest(geometry), resolution)
+    if cache_file is not None and Path(cache_file).exists():
+        cached = np.load(cache_file)
+        if "key" in cached and str(cached["key"]) == key:
+            return RenderGrid(
+                cached["index"],
+                Affine(*cached["transform"]),
+                tuple(cached["extent"]),
+                crs)
+
+    west, south, east, north = geometry.total_bounds
+    if resolution is None:
+        bounds = geometry.bounds
+        resolution = np.median(bounds["maxx"] - bounds["minx"])/4
+    width = int(np.ceil((east - west)/resolution))
+    height = int(np.ceil((north - south)/resolution))
+    transform = from_origin(west, north, resolution, resolution)
+    index = polygon_index_raster(geometry, transform, (height, width))
+    extent = (
+        west, west + width*resolution, north - height*resolution, north)
+
+    if cache_file is not None:
+        with atomic_write(cache_file) as f:
+            np.savez_compressed(
+                f,
+                index=index,
+                transform=np.array(transform)[:6],
+                extent=np.array(extent),
+                key=key)
+    return RenderGrid(index, transform, extent, crs)
+
+
+def gather_polygons(
+        index: np.ndarray,
+        values: np.ndarray
+        ) -> np.ndarray:
+    """
+    values of the polygon each pixel of a polygon index raster falls in,
+    NaN where the index is -1. values is (polygons,) or (polygons x
+    layers), giving (rows x cols) or (rows x cols x layers).
+    """
+    values = np.asarray(values, dtype=np.float32)
+    padded = np.concatenate(
+        [values, np.full((1,) + values.shape[1:], np.nan, np.float32)])
+    # index -1 picks up the NaN row appended above
+    return padded[index]
+
+
+def layer_images(
+        grid: RenderGrid,
+        values: np.ndarray
+        ) -> np.ndarray:
+    """
+    Image of one (polygons,) layer or a stack of (polygons x layers)
+    layers, NaN outside the polygons. Stacks come back as
+    (layers x rows x cols).
+    """
+    images = gather_polygons(grid.index, values)
+    if images.ndim == 3:
+        images = np.moveaxis(images, -1, 0)
+    return images
+
+
+def draw_layer(
+        ax: Axes,
+        image: np.ndarray,
+        grid: RenderGrid,
+        cmap: Union[Colormap, str],
+        norm: Normalize,
+        aspect: Union[str, None] = "equal"
+        ) -> Axes:
+    """
+    Draw a layer image on ax in the coordinates of the SSM polygons,
+    ready for a basemap or outlines on top
+    """
+    ax.imshow(
+        image,
+        extent=grid.extent,
+        cmap=cmap,
+        norm=norm,
+        interpolation="nearest",
+        aspect=aspect,
+        zorder=2)
+    return ax
+
+
+def write_layers(
+        out_file: Union[str, Path],
+        grid: RenderGrid,
+        values: np.ndarray,
+        names: list
+        ) -> None:
+    """
+    Write (polygons x layers) values as a tiled, compressed GeoTIFF with
+    one band per layer for use outside matplotlib
+    """
+    images = layer_images(grid, values)
+    if images.ndim == 2:
+        images = images[np.newaxis]
+    height, width = grid.index.shape
+    with rio.open(
+            out_file,
+            "w",
+            driver="GTiff",
+            height=height,
+            width=width,
+            count=len(images),
+            dtype="float32",
+            crs=grid.crs,
+            transform=grid.transform,
+            nodata=np.nan,
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate") as dst:
+        dst.write(images)
+        for band, name in enumerate(names, 1):
+            dst.set_band_description(band, str(name))
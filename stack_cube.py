@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+All interferograms or coherence rasters of an ISCE stack as one lazy
+(pair x y x x) xarray cube.
+Data are only read when computed, through windowed rasterio reads of the
+dask chunks that are needed, so a spatial subset or a single pixel time
+series never loads whole rasters. The cube can be written once to a
+consolidated Zarr store and reopened from there.
+"""
+
+import argparse
+
+from pathlib import Path
+from typing import Union
+
+import dask.array as da
+import numpy as np
+import pandas as pd
+import rasterio as rio
+import xarray as xr
+
+from rasterio.windows import Window
+
+from interferogram_pairs import pair_index
+
+
+class RasterStack:
+    """
+    Array-like view of one band of a list of rasters on the same grid,
+    indexed as (raster, row, col). Indexing reads only the window asked
+    for, opening each file per read so dask workers can share it.
+    """
+
+    def __init__(
+            self,
+            paths: list,
+            band: int = 1
+            ) -> None:
+        self.paths = [str(path) for path in paths]
+        self.band = band
+        with rio.open(self.paths[0]) as src:
+            self.dtype = np.dtype(src.dtypes[band - 1])
+            self.shape = (len(self.paths), src.height, src.width)
+            self.transform = src.transform
+            self.crs = src.crs
+            self.nodata = src.nodata
+        self.ndim = 3
+
+    def __getitem__(self, key: tuple) -> np.ndarray:
+        key = key + (slice(None),)*(3 - len(key))
+        # integers become length one slices, dropped again at the end
+        squeeze = tuple(
+            i for i, k in enumerate(key) if isinstance(k, (int, np.integer)))
+        paths, rows, cols = (
+            slice(k, k + 1) if i in squeeze else k for i, k in enumerate(key))
+        height, width = self.shape[1:]
+        r0, r1, _ = rows.indices(height)
+        c0, c1, _ = cols.indices(width)
+        window = Window(c0, r0, c1 - c0, r1 - r0)
+        selected = self.paths[paths]
+        block = np.empty(
+            (len(selected), r1 - r0, c1 - c0), dtype=self.dtype)
+        for i, path in enumerate(selected):
+            with rio.open(path) as src:
+                block[i] = src.read(self.band, window=window)
+        return block.squeeze(axis=squeeze)
+
+
+def stack_cube(
+        merged_dir: Union[str, Path],
+        filename: str = "geo_filt_fine.cor",
+        band: int = 1,
+        chunks: tuple = (1, 512, 512),
+        baselines_dir: Union[str, Path, None] = None
+        ) -> xr.DataArray:
+    """
+    Lazy (pair x y x x) cube of merged_dir/*/filename, e.g.
+    "geo_filt_fine.cor" for coherence or "filt_fine.int" for the complex
+    interferograms. The pair dimension carries the reference, secondary
+    and midpoint dates and baselines from `pair_index` as coordinates.
+    """
+    pairs = pair_index(merged_dir, filename, baselines_dir)
+    stack = RasterStack(list(pairs["path"]), band)
+    data = da.from_array(stack, chunks=chunks, lock=False, asarray=False)
+    height, width = stack.shape[1:]
+    transform = stack.transform
+    coords = {
+        "pair": pairs.index.to_numpy(),
+        "y": transform.f + transform.e*(np.arange(height) + 0.5),
+        "x": transform.c + transform.a*(np.arange(width) + 0.5)}
+    for column in pairs.columns.drop("path"):
+        coords[column] = ("pair", pairs[column].to_numpy())
+    return xr.DataArray(
+        data,
+        dims=("pair", "y", "x"),
+        coords=coords,
+        name=Path(filename).stem,
+        attrs={
+            "crs": stack.crs.to_wkt() if stack.crs else "",
+            "transform": list(transform)[:6],
+            "nodata": np.nan if stack.nodata is None else stack.nodata})
+
+
+def cached_stack_cube(
+        merged_dir: Union[str, Path],
+        zarr_store: Union[str, Path],
+        filename: str = "geo_filt_fine.cor",
+        band: int = 1,
+        chunks: tuple = (1, 512, 512),
+        baselines_dir: Union[str, Path, None] = None
+        ) -> xr.DataArray:
+    """
+    `stack_cube` read through a consolidated Zarr store, written on the
+    first call. Pairs added to the stack since are appended to the store.
+    """
+    zarr_store = Path(zarr_store)
+    cube = stack_cube(merged_dir, filename, band, chunks, baselines_dir)
+    if not zarr_store.exists():
+        cube.to_dataset().to_zarr(zarr_store, consolidated=True)
+    else:
+        stored = xr.open_zarr(zarr_store, consolidated=True)
+        new_pairs = ~cube["pair"].isin(stored["pair"].to_numpy())
+        if new_pairs.any():
+            cube.isel(pair=new_pairs.to_numpy()).to_dataset().to_zarr(
+                zarr_store, append_dim="pair", consolidated=True)
+    return xr.open_zarr(zarr_store, consolidated=True)[cube.name]
+
+
+def subset_bounds(
+        cube: xr.DataArray,
+        bounds: tuple
+        ) -> xr.DataArray:
+    """
+    Lazy spatial subset of a north-up cube to (west, south, east, north)
+    in the cube's CRS
+    """
+    west, south, east, north = bounds
+    return cube.sel(x=slice(west, east), y=slice(north, south))
+
+
+def pixel_series(
+        cube: xr.DataArray,
+        x: float,
+        y: float
+        ) -> pd.Series:
+    """
+    Time series of the pixel nearest (x, y), reading one chunk per pair,
+    indexed by reference date
+    """
+    series = cube.sel(x=x, y=y, method="nearest").compute()
+    return pd.Series(
+        series.to_numpy(), index=pd.DatetimeIndex(series["reference"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Write the interferograms of an ISCE stack to Zarr')
+    parser.add_argument(
+        'merged_dir',
+        help='ISCE merged/interferograms directory',
+        metavar='DIR')
+    parser.add_argument(
+        '-f',
+        '--filename',
+        default="geo_filt_fine.cor",
+        help='raster in each pair directory')
+    parser.add_argument(
+        '-b',
+        '--baselines_dir',
+        help='ISCE baselines directory',
+        metavar='DIR')
+    args = parser.parse_args()
+
+    merged_dir = Path(args.merged_dir)
+    zarr_store = merged_dir/f"{Path(args.filename).stem}.zarr"
+    cube = cached_stack_cube(
+        merged_dir, zarr_store, args.filename, baselines_dir=args.baselines_dir)
+    print(f"{cube.sizes['pair']} pairs of {cube.sizes['y']} x {cube.sizes['x']} in {zarr_store}")
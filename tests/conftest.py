@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# the modules live flat in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from alignment import align_interp, align_window
+
+HOURS = pd.date_range("2023-01-01", "2023-03-01", freq="h")
+TARGET = pd.date_range("2023-01-05", "2023-02-25", freq="12D")
+
+
+def window_reference(values, dates, target, how, window=None):
+    """
+    Slow loop over the (start, end] windows
+    """
+    out = np.full(len(target), np.nan)
+    for i, end in enumerate(target):
+        if window is not None:
+            start = end - window
+        elif i > 0:
+            start = target[i - 1]
+        else:
+            continue
+        inside = (dates > start) & (dates <= end) & np.isfinite(values)
+        if inside.any():
+            out[i] = getattr(np, how)(values[inside])
+    return out
+
+
+@pytest.mark.parametrize("how", ["sum", "mean"])
+def test_align_window_between_targets(how):
+    values = np.random.default_rng(0).uniform(0, 2, len(HOURS))
+    values[100:400] = np.nan
+    np.testing.assert_allclose(
+        align_window(values, HOURS, TARGET, how),
+        window_reference(values, HOURS, TARGET, how))
+
+
+def test_align_window_fixed_window():
+    values = np.ones(len(HOURS))
+    aligned = align_window(
+        values, HOURS, TARGET, "sum", window=pd.Timedelta(days=3))
+    # 72 hourly samples in every (target - 3 days, target]
+    np.testing.assert_allclose(aligned, 72)
+
+
+def test_align_window_batches_polygons():
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0, 2, (3, len(HOURS)))
+    aligned = align_window(values, HOURS, TARGET, "sum")
+    assert aligned.shape == (3, len(TARGET))
+    for row, expected in zip(aligned, values):
+        np.testing.assert_allclose(
+            row, window_reference(expected, HOURS, TARGET, "sum"))
+
+
+def test_align_window_empty_window_is_nan():
+    dates = pd.DatetimeIndex(["2023-01-02", "2023-01-25"])
+    aligned = align_window(np.array([1.0, 2.0]), dates, TARGET[:3], "sum")
+    # nothing falls in (Jan 5, Jan 17]
+    assert np.isnan(aligned[:2]).all() and aligned[2] == 2.0
+
+
+def test_align_window_rejects_unknown_how():
+    with pytest.raises(ValueError):
+        align_window(np.ones(len(HOURS)), HOURS, TARGET, "median")
+
+
+def test_align_interp_outside_range_is_nan():
+    dates = pd.DatetimeIndex(["2023-01-10", "2023-01-20"])
+    aligned = align_interp(np.array([0.0, 10.0]), dates, TARGET[:3])
+    assert np.isnan(aligned[0]) and np.isnan(aligned[2])
+    np.testing.assert_allclose(aligned[1], 7.0)
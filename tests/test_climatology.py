@@ -0,0 +1,93 @@
+from unittest import mock
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+
+from shapely.geometry import box
+
+from climatology import Climatology, bin_distance, doy_bins, season_bins
+from ssm_cube import SSMCube
+
+STATISTICS = ["count", "mean", "m2", "hist"]
+
+
+@pytest.fixture
+def cube() -> SSMCube:
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2023-01-01", periods=60, freq="12D")
+    values = rng.uniform(5, 45, (5, len(dates))).astype(np.float32)
+    values[1, 3:8] = np.nan
+    geometry = gpd.GeoSeries([box(i, 0, i + 1, 1) for i in range(5)])
+    return SSMCube(values, dates, geometry)
+
+
+def assert_same_statistics(a: Climatology, b: Climatology) -> None:
+    for name in STATISTICS:
+        np.testing.assert_allclose(
+            getattr(a, name), getattr(b, name), equal_nan=True, err_msg=name)
+
+
+def test_incremental_matches_full(tmp_path, cube):
+    full = Climatology.create(tmp_path/"full", len(cube))
+    full.update(cube)
+    incremental = Climatology.create(tmp_path/"incremental", len(cube))
+    for stop in [10, 11, 35, 60]:
+        incremental.update(cube.date_range(end=cube.dates[stop - 1]))
+    assert_same_statistics(full, incremental)
+    assert list(incremental.dates) == list(cube.dates)
+
+
+@pytest.mark.filterwarnings("ignore:Degrees of freedom")
+def test_statistics_match_numpy(tmp_path, cube):
+    clim = Climatology.create(tmp_path, len(cube), tolerance=0)
+    clim.update(cube)
+    member = bin_distance(cube.dates, clim.bins) == 0
+    for b in np.flatnonzero(member.any(axis=0)):
+        values = cube.values[:, member[:, b]].astype(float)
+        np.testing.assert_allclose(clim.mean[:, b], np.nanmean(values, axis=1))
+        np.testing.assert_allclose(
+            clim.std()[:, b], np.nanstd(values, axis=1, ddof=1))
+
+
+def test_update_twice_adds_nothing(tmp_path, cube):
+    clim = Climatology.create(tmp_path, len(cube))
+    clim.update(cube)
+    before = {name: np.array(getattr(clim, name)) for name in STATISTICS}
+    assert len(clim.update(cube)) == 0
+    for name in STATISTICS:
+        np.testing.assert_array_equal(getattr(clim, name), before[name])
+
+
+def test_interrupted_update_is_not_counted_twice(tmp_path, cube):
+    full = Climatology.create(tmp_path/"full", len(cube))
+    full.update(cube)
+    clim = Climatology.create(tmp_path/"clim", len(cube))
+    clim.update(cube.date_range(end=cube.dates[29]))
+    with mock.patch("climatology.write_json", side_effect=OSError):
+        with pytest.raises(OSError):
+            clim.update(cube)
+    reopened = Climatology(tmp_path/"clim")
+    assert len(reopened.dates) == 30
+    reopened.update(cube)
+    assert_same_statistics(full, reopened)
+    assert [p.name for p in (tmp_path/"clim").glob("arrays*")] == ["arrays2"]
+
+
+def test_anomalies_of_the_mean_are_zero(tmp_path, cube):
+    clim = Climatology.create(tmp_path, len(cube), season_bins())
+    clim.update(cube)
+    ind = clim.date_bins(cube.dates)
+    means = SSMCube(
+        np.asarray(clim.mean)[:, ind].astype(np.float32),
+        cube.dates,
+        cube.geometry)
+    np.testing.assert_allclose(clim.anomalies(means).values, 0, atol=1e-5)
+
+
+def test_doy_bins_cover_the_year():
+    bins = doy_bins(12)
+    assert bins["start"].iloc[0] == 1 and bins["end"].iloc[-1] == 366
+    np.testing.assert_array_equal(
+        bins["start"].to_numpy()[1:], bins["end"].to_numpy()[:-1] + 1)
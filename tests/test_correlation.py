@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from scipy import signal
+
+from correlation import batch_xcorr, peak_lag, sampling_interval
+
+
+def scipy_xcorr(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    scipy.signal.correlate of the demeaned series, each lag divided by its
+    number of overlapping samples and the standard deviations
+    """
+    n = len(a)
+    overlap = n - np.abs(signal.correlation_lags(n, n))
+    return signal.correlate(a - a.mean(), b - b.mean())/(
+        overlap*a.std()*b.std())
+
+
+def test_batch_xcorr_matches_scipy():
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=(4, 30))
+    b = rng.normal(size=30)
+    xcorr, lags = batch_xcorr(a, b, dt=12)
+    np.testing.assert_array_equal(lags, 12*signal.correlation_lags(30, 30))
+    for row, expected in zip(xcorr, a):
+        expected = scipy_xcorr(expected, b)
+        # the end lags have fewer than min_overlap samples
+        np.testing.assert_allclose(row[2:-2], expected[2:-2])
+        assert np.isnan(row[:2]).all() and np.isnan(row[-2:]).all()
+
+
+def test_zero_lag_is_pearson_with_gaps():
+    rng = np.random.default_rng(1)
+    a = rng.normal(size=40)
+    b = a + rng.normal(0, 0.5, 40)
+    a[10:15] = np.nan
+    xcorr, lags = batch_xcorr(a, b)
+    valid = np.isfinite(a)
+    # means and spreads are of each whole series, the sum only of overlaps
+    a0 = a[valid] - a[valid].mean()
+    b0 = b - b.mean()
+    expected = (a0*b0[valid]).mean()/(a[valid].std()*b.std())
+    assert np.isclose(xcorr[lags == 0][0], expected)
+
+
+def test_peak_lag_finds_shift():
+    rng = np.random.default_rng(2)
+    b = rng.normal(size=60)
+    # a lags b by three samples
+    a = np.roll(b, 3)
+    xcorr, lags = batch_xcorr(a, b, dt=12)
+    peak, lag = peak_lag(xcorr, lags, max_lag=120)
+    assert lag == 36 and peak > 0.9
+
+
+def test_sampling_interval_is_median_spacing():
+    dates = pd.DatetimeIndex(
+        ["2023-01-01", "2023-01-13", "2023-01-25", "2023-02-18"])
+    assert sampling_interval(dates) == 12
@@ -0,0 +1,85 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+import rasterio as rio
+
+from rasterio.transform import from_origin
+
+from overviews import (
+    amplitude_file, build_quicklook, multilook, percentile_stretch,
+    quicklook_file, read_level)
+
+
+def write_raster(path, data):
+    with rio.open(
+            path, "w", driver="GTiff", height=data.shape[0],
+            width=data.shape[1], count=1, dtype=data.dtype,
+            crs="EPSG:4326",
+            transform=from_origin(35, -15, 1e-3, 1e-3)) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def test_multilook_skips_nodata_and_partial_blocks():
+    data = np.arange(1, 16, dtype=float).reshape(3, 5)
+    data[0, 0] = 0
+    looked = multilook(data, (2, 2))
+    assert looked.shape == (2, 3)
+    np.testing.assert_allclose(looked[0, 0], (2 + 6 + 7)/3)
+    np.testing.assert_allclose(looked[1, 2], 15)
+
+
+def test_multilook_complex_mean():
+    data = np.array([[1 + 1j, 1 - 1j]])
+    np.testing.assert_allclose(multilook(data, (1, 2)), [[1]])
+
+
+def test_coherence_quicklook(tmp_path):
+    data = np.random.default_rng(0).uniform(0.1, 1, (40, 60)).astype(np.float32)
+    path = write_raster(tmp_path/"geo_filt_fine.cor", data)
+    out_file = build_quicklook(path, looks=(4, 4), overview_levels=[2])
+    assert out_file == quicklook_file(path)
+    with rio.open(out_file) as src:
+        assert src.shape == (10, 15)
+        assert src.overviews(1) == [2]
+        np.testing.assert_allclose(
+            src.read(1), multilook(data, (4, 4)), rtol=1e-6)
+        with rio.open(path) as original:
+            assert src.bounds == original.bounds
+    data_read, extent = read_level(path, max_size=5)
+    assert max(data_read.shape) <= 5
+    assert extent == [35, 35.06, -15.04, -15]
+
+
+def test_interferogram_amplitude_quicklook(tmp_path):
+    rng = np.random.default_rng(1)
+    data = (rng.uniform(1, 3, (32, 32))*np.exp(1j*rng.uniform(-1, 1, (32, 32))))
+    path = write_raster(tmp_path/"geo_filt_fine.int", data.astype(np.complex64))
+    build_quicklook(path, looks=(8, 8), overview_levels=[2])
+    with rio.open(amplitude_file(path)) as src:
+        assert src.count == 4
+        mean, p5, p50, p95 = src.read()
+    np.testing.assert_allclose(mean, multilook(np.abs(data), (8, 8)), rtol=1e-5)
+    assert (p5 <= p50).all() and (p50 <= p95).all()
+    vmin, vmax = percentile_stretch(mean)
+    assert mean.min() <= vmin < vmax <= mean.max()
+
+
+def test_quicklook_skipped_when_newer(tmp_path):
+    data = np.ones((16, 16), dtype=np.float32)
+    path = write_raster(tmp_path/"geo_filt_fine.cor", data)
+    out_file = build_quicklook(path, overview_levels=[2])
+    mtime = out_file.stat().st_mtime_ns
+    build_quicklook(path, overview_levels=[2])
+    assert out_file.stat().st_mtime_ns == mtime
+
+
+def test_failed_quicklook_leaves_no_files(tmp_path):
+    path = write_raster(
+        tmp_path/"geo_filt_fine.cor", np.ones((16, 16), dtype=np.float32))
+    # fails after the temporary GeoTIFF is opened
+    with mock.patch("overviews.multilook", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            build_quicklook(path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["geo_filt_fine.cor"]
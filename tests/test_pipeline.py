@@ -0,0 +1,105 @@
+from pathlib import Path
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def chain(cache_dir: Path, input_file: Path, out_file: Path, scale: int = 2):
+    """
+    download -> process -> figure, plus an unrelated stage, logging every
+    stage that runs in pipeline.calls
+    """
+    pipeline = Pipeline(cache_dir)
+    pipeline.calls = []
+
+    def download(source):
+        pipeline.calls.append("download")
+        out_file.write_text(Path(source).read_text())
+        return out_file
+
+    def process(download, scale):
+        pipeline.calls.append("process")
+        return scale*int(download.read_text())
+
+    def figure(process):
+        pipeline.calls.append("figure")
+        return f"figure of {process}"
+
+    def unrelated():
+        pipeline.calls.append("unrelated")
+        return 0
+
+    pipeline.add(Stage(
+        "download", download, params={"source": str(input_file)},
+        files=[input_file]))
+    pipeline.add(Stage("process", process, ["download"], {"scale": scale}))
+    pipeline.add(Stage("figure", figure, ["process"]))
+    pipeline.add(Stage("unrelated", unrelated))
+    return pipeline
+
+
+@pytest.fixture
+def files(tmp_path):
+    input_file = tmp_path/"input.txt"
+    input_file.write_text("21")
+    return tmp_path/"cache", input_file, tmp_path/"download.txt"
+
+
+def test_second_run_is_cached(files):
+    first = chain(*files)
+    assert first.run()["figure"] == "figure of 42"
+    assert sorted(first.calls) == ["download", "figure", "process", "unrelated"]
+    second = chain(*files)
+    assert second.run()["figure"] == "figure of 42"
+    assert second.calls == []
+
+
+def test_force_reruns_downstream_only(files):
+    chain(*files).run()
+    pipeline = chain(*files)
+    pipeline.run(force=["process"])
+    assert pipeline.calls == ["process", "figure"]
+
+
+def test_changed_input_file_propagates(files):
+    cache_dir, input_file, _ = files
+    chain(*files).run()
+    input_file.write_text("5")
+    pipeline = chain(*files)
+    assert pipeline.run()["figure"] == "figure of 10"
+    assert pipeline.calls == ["download", "process", "figure"]
+
+
+def test_changed_params_propagate(files):
+    chain(*files).run()
+    pipeline = chain(*files, scale=3)
+    assert pipeline.run(["figure"])["figure"] == "figure of 63"
+    assert pipeline.calls == ["process", "figure"]
+
+
+def test_changed_output_file_reruns_its_stage(files):
+    _, _, out_file = files
+    chain(*files).run()
+    out_file.write_text("1")
+    pipeline = chain(*files)
+    assert pipeline.run()["process"] == 42
+    assert pipeline.calls == ["download", "process", "figure"]
+
+
+def test_targets_only_load_what_they_need(files):
+    chain(*files).run()
+    pipeline = chain(*files)
+    assert set(pipeline.run(["unrelated"])) == {"unrelated"}
+    assert pipeline.calls == []
+
+
+def test_bad_graphs_are_rejected(tmp_path):
+    pipeline = Pipeline(tmp_path)
+    with pytest.raises(KeyError):
+        pipeline.add(Stage("a", lambda b: b, ["b"]))
+    pipeline.add(Stage("a", lambda: 1))
+    pipeline.add(Stage("b", lambda a: a, ["a"]))
+    pipeline.stages["a"].deps.append("b")
+    with pytest.raises(ValueError):
+        pipeline.order()
@@ -0,0 +1,65 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from scipy.stats import linregress
+from shapely.geometry import box
+
+from drying_rate import batch_drying_rate
+from regression import ols_from_sums
+from ssm_cube import SSMCube
+
+
+def sums(x: np.ndarray, y: np.ndarray) -> tuple:
+    return (
+        x.shape[-1], x.sum(-1), y.sum(-1), (x*x).sum(-1), (x*y).sum(-1),
+        (y*y).sum(-1))
+
+
+def test_ols_from_sums_matches_linregress():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 100, (5, 20))
+    y = 0.3*x + rng.normal(0, 2, x.shape)
+    slope, intercept, r2 = ols_from_sums(*sums(x, y))
+    for i in range(len(x)):
+        fit = linregress(x[i], y[i])
+        assert np.isclose(slope[i], fit.slope)
+        assert np.isclose(intercept[i], fit.intercept)
+        assert np.isclose(r2[i], fit.rvalue**2)
+
+
+def test_ols_from_sums_constant_x_is_nan():
+    x = np.full(4, 2.0)
+    slope, intercept, r2 = ols_from_sums(*sums(x, np.arange(4.0)))
+    assert np.isnan(slope) and np.isnan(intercept) and np.isnan(r2)
+
+
+def test_batch_drying_rate_windows():
+    dates = pd.date_range("2023-05-01", periods=8, freq="12D")
+    values = np.array([
+        # one dry-down of four points at -1 %/day, then wetting
+        [40, 28, 16, 4, 30, 35, 36, 37],
+        # two dry-downs, the second too short for min_points
+        [30, 24, 18, 20, 22, 21, 25, 26],
+    ], dtype=np.float32)
+    geometry = gpd.GeoSeries([box(i, 0, i + 1, 1) for i in range(2)])
+    windows = batch_drying_rate(SSMCube(values, dates, geometry))
+
+    assert list(windows["polygon"]) == [0, 1]
+    assert list(windows["n"]) == [4, 3]
+    assert list(windows["start"]) == [dates[0], dates[0]]
+    assert list(windows["end"]) == [dates[3], dates[2]]
+    np.testing.assert_allclose(windows["slope"], [-1.0, -0.5])
+    np.testing.assert_allclose(windows["intercept"], [40, 30])
+    np.testing.assert_allclose(windows["r2"], [1, 1])
+
+
+def test_batch_drying_rate_precipitation_splits_windows():
+    dates = pd.date_range("2023-05-01", periods=5, freq="12D")
+    values = np.array([[40, 34, 28, 22, 16]], dtype=np.float32)
+    geometry = gpd.GeoSeries([box(0, 0, 1, 1)])
+    precip = np.array([0, 0, 5, 0])
+    windows = batch_drying_rate(
+        SSMCube(values, dates, geometry), precip, min_points=2)
+    assert list(windows["n"]) == [3, 2]
+    assert list(windows["start"]) == [dates[0], dates[3]]
@@ -0,0 +1,65 @@
+import geopandas as gpd
+import numpy as np
+
+from shapely.geometry import box
+
+from zonal_weights import overlap_weights, zonal_means
+
+UTM = "EPSG:32736"
+# near Liwonde, so the geographic test lands back in UTM zone 36S
+X0, Y0 = 750000, 8380000
+
+
+def squares(n: int) -> gpd.GeoSeries:
+    """
+    n 100 m squares in a row
+    """
+    return gpd.GeoSeries(
+        [box(100*i, 0, 100*(i + 1), 100) for i in range(n)],
+        crs=UTM).translate(X0, Y0)
+
+
+def zones(*bounds: tuple) -> gpd.GeoSeries:
+    """
+    Boxes of (xmin, xmax) across the squares
+    """
+    return gpd.GeoSeries(
+        [box(x0, 0, x1, 100) for x0, x1 in bounds], crs=UTM).translate(X0, Y0)
+
+
+def test_overlap_areas():
+    weights = overlap_weights(
+        squares(3), zones((0, 150), (150, 400))).toarray()
+    np.testing.assert_allclose(
+        weights, [[1e4, 5e3, 0], [0, 5e3, 1e4]])
+
+
+def test_touching_polygons_get_no_weight():
+    weights = overlap_weights(squares(3), zones((100, 200)))
+    assert weights.nnz == 1
+    np.testing.assert_allclose(weights.toarray(), [[0, 1e4, 0]])
+
+
+def test_geographic_polygons_are_projected():
+    polygons = squares(2).to_crs("EPSG:4326")
+    weights = overlap_weights(
+        polygons, zones((0, 200)).to_crs("EPSG:4326")).toarray()
+    np.testing.assert_allclose(weights, [[1e4, 1e4]], rtol=1e-3)
+
+
+def test_cache_round_trip(tmp_path):
+    cache_file = tmp_path/"weights.npz"
+    built = overlap_weights(squares(2), zones((0, 150)), cache_file)
+    assert cache_file.exists()
+    cached = overlap_weights(squares(2), zones((0, 150)), cache_file)
+    np.testing.assert_array_equal(built.toarray(), cached.toarray())
+    # different zones must not reuse the cached matrix
+    np.testing.assert_allclose(
+        overlap_weights(squares(2), zones((0, 50)), cache_file).toarray(),
+        [[5e3, 0]])
+
+
+def test_zonal_means_skip_nan():
+    weights = overlap_weights(squares(2), zones((0, 150)))
+    values = np.array([[10.0, 10.0], [40.0, np.nan]])
+    np.testing.assert_allclose(zonal_means(weights, values), [[20.0, 10.0]])
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Build CNN-LSTM training arrays from the SSM cube, ERA5 and NDVI.
+The (time x pixel x feature) array is preallocated as a .npy memmap and
+filled a chunk of pixels at a time, so memory stays bounded whatever the
+size of the AOI. Pixel coordinates are stored as numbers, and a manifest
+records the inputs and which chunks are done so an interrupted build
+picks up where it stopped.
+"""
+
+import argparse
+import hashlib
+import json
+
+from datetime import datetime
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from alignment import align_all
+from era5_polygons import extract_polygons
+from file_utils import write_json
+from regions import get_region
+from ssm_cube import SSMCube
+
+ARRAY_FILE = "3D_nonstatic.npy"
+COORDS_FILE = "1D_coords.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def pixel_coords(geometry: gpd.GeoSeries) -> np.ndarray:
+    """
+    (pixels x 2) float64 lon, lat of the polygon centroids.
+    Centroids are taken in UTM so they are not skewed by the projection.
+    """
+    utm = geometry.estimate_utm_crs()
+    centroids = geometry.to_crs(utm).centroid.to_crs("EPSG:4326")
+    return np.column_stack([centroids.x, centroids.y])
+
+
+def source_provenance(path: Union[str, Path]) -> dict:
+    """
+    Enough about an input file to tell if it has changed
+    """
+    path = Path(path)
+    stat = path.stat()
+    return {
+        "path": str(path.resolve()),
+        "size": stat.st_size,
+        "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()}
+
+
+def build_training_array(
+        out_dir: Union[str, Path],
+        cube: SSMCube,
+        features: dict,
+        target: Union[pd.DatetimeIndex, None] = None,
+        chunk_size: int = 4096,
+        sources: Union[list, None] = None
+        ) -> np.ndarray:
+    """
+    Fill out_dir/3D_nonstatic.npy, a (time x pixel x feature) float32
+    array with a pixel for every polygon of cube.
+    features maps a feature name to (values, dates, method) or
+    (values, dates, method, kwargs) as in `align_all`, in feature order.
+    values are either (pixels x time), e.g. `cube.values`, or a single
+    (time,) series such as an ERA5 point extraction, which is repeated for
+    every pixel. Everything is aligned to target, by default cube.dates.
+    sources are the input files, recorded in the manifest.
+    If out_dir already holds a build with the same inputs and settings,
+    only the chunks not yet written are built.
+    Returns the array opened read-only.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    target = cube.dates if target is None else pd.DatetimeIndex(target)
+    n_pixels = len(cube)
+    shape = (len(target), n_pixels, len(features))
+
+    config = {
+        "shape": list(shape),
+        "features": {
+            name: spec[2] for name, spec in features.items()},
+        "dates": list(target.strftime("%Y-%m-%d")),
+        "chunk_size": chunk_size,
+        "sources": [source_provenance(s) for s in sources or []]}
+    config_hash = hashlib.sha1(
+        json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    manifest_file = out_dir/MANIFEST_FILE
+    manifest = None
+    if manifest_file.exists() and (out_dir/ARRAY_FILE).exists():
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest.get("config_hash") != config_hash:
+            manifest = None
+
+    if manifest is None:
+        np.save(out_dir/COORDS_FILE, pixel_coords(cube.geometry))
+        out = np.lib.format.open_memmap(
+            out_dir/ARRAY_FILE, mode="w+", dtype=np.float32, shape=shape)
+        manifest = {
+            "config_hash": config_hash,
+            "config": config,
+            "created": datetime.now().isoformat(),
+            "completed_chunks": []}
+        write_json(out_dir/MANIFEST_FILE, manifest)
+    else:
+        out = np.load(out_dir/ARRAY_FILE, mmap_mode="r+")
+
+    # (time,) series are the same for every chunk, so align them once
+    series = align_all(
+        {
+            name: spec for name, spec in features.items()
+            if np.ndim(spec[0]) == 1},
+        target)
+    done = set(manifest["completed_chunks"])
+    for p0 in range(0, n_pixels, chunk_size):
+        if p0 in done:
+            continue
+        p1 = min(p0 + chunk_size, n_pixels)
+        aligned = align_all(
+            {
+                name: (values[p0:p1], dates, *spec)
+                for name, (values, dates, *spec) in features.items()
+                if np.ndim(values) == 2},
+            target)
+        for f, name in enumerate(features):
+            if name in series:
+                # broadcast across the pixels of the chunk
+                out[:, p0:p1, f] = series[name][:, None]
+            else:
+                out[:, p0:p1, f] = aligned[name].T
+        out.flush()
+        manifest["completed_chunks"].append(p0)
+        write_json(out_dir/MANIFEST_FILE, manifest)
+
+    manifest["finished"] = datetime.now().isoformat()
+    write_json(out_dir/MANIFEST_FILE, manifest)
+    del out
+    return np.load(out_dir/ARRAY_FILE, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Build CNN-LSTM training arrays for an SSM AOI')
+    parser.add_argument('region', help='region in regions.toml')
+    parser.add_argument(
+        '-m',
+        '--era5_method',
+        choices=["centroid", "area"],
+        default="centroid",
+        help='ERA5 cell containing each polygon centroid, or area-weighted '
+             'overlapping cells')
+    parser.add_argument(
+        '-n',
+        '--ndvi',
+        help='per-polygon NDVI CSV from local_ndvi.py. Default is '
+             'ssm_path/polygon_ndvi.csv if it exists')
+    parser.add_argument(
+        '-o',
+        '--out_dir',
+        help='output directory. Default is ssm_path/training_arrays',
+        metavar='DIR')
+    parser.add_argument(
+        '-c',
+        '--chunk_size',
+        type=int,
+        default=4096,
+        help='pixels written per chunk')
+    args = parser.parse_args()
+
+    region = get_region(args.region)
+    ssm_path = region.ssm_path
+    out_dir = ssm_path/"training_arrays" if args.out_dir is None else Path(args.out_dir)
+
+    cube = SSMCube.from_files(region.shp_file, region.polygon_geojson)
+    # every pixel gets the ERA5 series of its own polygon
+    era5 = extract_polygons(
+        region.era5_file,
+        cube.geometry,
+        method=args.era5_method,
+        cache_file=ssm_path/f"era5_{args.era5_method}_weights.npz",
+        out_file=ssm_path/f"era5_{args.era5_method}_polygons.npy")
+    features = {"ssm": (cube.values, cube.dates, "nearest")}
+    for k, variable in enumerate(era5["variable"].to_numpy()):
+        # precipitation is accumulated over each revisit, the rest averaged
+        method = "sum" if variable.startswith("tp") else "mean"
+        features[variable] = (
+            era5.values[:, :, k], pd.DatetimeIndex(era5["time"]), method)
+    sources = [
+        region.shp_file, region.polygon_geojson, region.era5_file]
+
+    ndvi_file = Path(args.ndvi or ssm_path/"polygon_ndvi.csv")
+    if ndvi_file.exists():
+        ndvi = pd.read_csv(ndvi_file, index_col=0)
+        if len(ndvi) != len(cube):
+            parser.error(
+                f"{ndvi_file} has {len(ndvi)} polygons, the SSM results "
+                f"have {len(cube)}")
+        features["ndvi"] = (
+            ndvi.to_numpy(dtype=float),
+            pd.to_datetime(ndvi.columns, format="D%Y%m%d"),
+            "interp")
+        sources.append(ndvi_file)
+    elif args.ndvi is not None:
+        parser.error(f"{ndvi_file} does not exist")
+
+    training = build_training_array(
+        out_dir, cube, features, chunk_size=args.chunk_size, sources=sources)
+    print(f"Wrote {training.shape} (time x pixel x feature) to {out_dir}")
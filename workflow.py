@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+The download-to-figure workflow for one AOI as a cached pipeline.
+Stages only rerun when their code, parameters, input files or upstream
+stages change, so remaking a figure doesn't re-merge ERA5 or re-read the
+shapefiles. Every path comes from the region's entry in regions.toml.
+Run e.g. `python workflow.py kasungu figure` or
+`python workflow.py kasungu zonal --force ssm`.
+"""
+
+import argparse
+import datetime
+import subprocess
+import sys
+
+from pathlib import Path
+
+import matplotlib
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from insar4sm.prep_meteo import convert_to_df
+
+from alignment import align_window
+from download_ERA5 import download_ERA5
+from download_soilgrid import get_soil_layers
+from eo_utils import geojson_to_shapely
+from lag_difference import RUNNING, YEAR_ON_YEAR, lag_difference_frame
+from park_summary import load_parks, park_ssm_summary, park_zones
+from pipeline import Pipeline
+from regions import Region, get_region
+from ssm_cube import SSMCube
+
+matplotlib.use("Agg")
+
+
+def shapefile_parts(shp_file: Path) -> list:
+    """
+    The .shp and every sidecar (.dbf, .shx, .prj, .cpg) of a shapefile.
+    The SSM values are in the .dbf, which changes when the inversion is
+    rerun even if the .shp geometry doesn't.
+    """
+    shp_file = Path(shp_file)
+    return sorted(shp_file.parent.glob(f"{shp_file.stem}.*"))
+
+
+def build_pipeline(
+        region: Region,
+        start_date: str,
+        end_date: str
+        ) -> Pipeline:
+    """
+    The workflow stages for region, with every path from the registry
+    """
+    aoi = region.aoi
+    shp_file = region.shp_file
+    polygon_geojson = region.polygon_geojson
+    pipeline = Pipeline(region.ssm_path/"pipeline_cache")
+
+    @pipeline.stage(
+        files=[aoi],
+        start_date=start_date,
+        end_date=end_date,
+        out_dir=str(region.slc_dir))
+    def slc(start_date, end_date, out_dir):
+        west, south, east, north = geojson_to_shapely(aoi).bounds
+        date_range = [
+            pd.Timestamp(start_date).strftime("%Y-%m-%d"),
+            pd.Timestamp(end_date).strftime("%Y-%m-%d")]
+        subprocess.run(
+            [
+                sys.executable,
+                Path(__file__).with_name("sentinelsat_download.py"),
+                "-d", *date_range,
+                "-b", str(south), str(north), str(west), str(east),
+                "-o", out_dir],
+            check=True)
+        return Path(out_dir)
+
+    @pipeline.stage(
+        files=[aoi],
+        variables=[
+            'total_precipitation',
+            'skin_temperature',
+            'volumetric_soil_water_layer_1'],
+        start_date=start_date,
+        end_date=end_date,
+        ERA5_file=str(region.era5_file))
+    def era5(variables, start_date, end_date, ERA5_file):
+        ERA5_file = Path(ERA5_file)
+        ERA5_file.parent.mkdir(parents=True, exist_ok=True)
+        download_ERA5(
+            variables,
+            datetime.datetime.strptime(f"{start_date}T000000", "%Y%m%dT%H%M%S"),
+            datetime.datetime.strptime(f"{end_date}T230000", "%Y%m%dT%H%M%S"),
+            str(aoi),
+            str(ERA5_file.parent),
+            str(ERA5_file))
+        return ERA5_file
+
+    @pipeline.stage(
+        files=[aoi],
+        out_dir=str(region.soilgrids_dir),
+        res=250)
+    def soilgrids(out_dir, res):
+        get_soil_layers(geojson_to_shapely(aoi), f"{out_dir}/", res)
+        return [
+            Path(out_dir)/f"{soil_type}_0-5cm_mean_{res}.tif"
+            for soil_type in ["sand", "clay"]]
+
+    @pipeline.stage(files=shapefile_parts(shp_file) + [polygon_geojson])
+    def ssm():
+        return SSMCube.from_files(shp_file, polygon_geojson)
+
+    @pipeline.stage(
+        deps=["ssm"], files=[region.national_parks], buffer_distance=10e3)
+    def zonal(ssm, buffer_distance):
+        gdf = ssm.to_gdf()
+        parks = load_parks(region.national_parks)
+        parks = parks[parks.intersects(gdf.to_crs(parks.crs).union_all())]
+        zones = park_zones(parks.reset_index(drop=True), buffer_distance)
+        return park_ssm_summary(gdf, zones)
+
+    @pipeline.stage(deps=["ssm"])
+    def differences(ssm):
+        return {
+            "running": lag_difference_frame(
+                ssm, *RUNNING, "%y%m%d", fallback_previous=True),
+            "year_on_year": lag_difference_frame(ssm, *YEAR_ON_YEAR)}
+
+    @pipeline.stage(deps=["ssm", "era5"], files=[aoi])
+    def precipitation(ssm, era5):
+        meteo_df = convert_to_df(str(era5), str(aoi), True)
+        # precipitation accumulated over each revisit, ending at each acquisition
+        return pd.Series(
+            align_window(
+                meteo_df['tp__m'].to_numpy()*1e3, meteo_df.index, ssm.dates),
+            index=ssm.dates)
+
+    @pipeline.stage(deps=["ssm", "precipitation"])
+    def figure(ssm, precipitation):
+        fig, ax1 = plt.subplots(figsize=(12.5, 7))
+        ax1.bar(
+            precipitation.index,
+            precipitation.to_numpy(),
+            width=4,
+            label="precipitation since previous acquisition")
+        ax1.set_ylabel("Precipitation (mm)")
+        ax2 = ax1.twinx()
+        ax2.plot(ssm.dates, ssm.date_mean, 'o-', color="grey", label="SSM")
+        ax2.set_ylabel("Soil Moisture Level (percent)")
+        fig.legend()
+        out_file = region.ssm_path/"SSM_precipitation.png"
+        fig.savefig(out_file)
+        plt.close(fig)
+        return out_file
+
+    return pipeline
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Bring workflow stages up to date for a region')
+    parser.add_argument('region', help='region in regions.toml')
+    parser.add_argument(
+        'targets',
+        nargs='*',
+        help='stages to make (slc, era5, soilgrids, ssm, zonal, '
+             'differences, precipitation, figure). Default is figure')
+    parser.add_argument(
+        '-s',
+        '--start_date',
+        default="20230101",
+        help='first date to download, %%Y%%m%%d')
+    parser.add_argument(
+        '-e',
+        '--end_date',
+        default="20240531",
+        help='last date to download, %%Y%%m%%d')
+    parser.add_argument(
+        '-f',
+        '--force',
+        nargs='+',
+        default=[],
+        help='stages to rerun even if up to date, with everything downstream')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='stages to run at once')
+    args = parser.parse_args()
+
+    try:
+        region = get_region(args.region)
+    except KeyError as e:
+        parser.error(str(e))
+    pipeline = build_pipeline(region, args.start_date, args.end_date)
+    unknown = set(args.targets + args.force).difference(pipeline.stages)
+    if unknown:
+        parser.error(
+            f"unknown stages {', '.join(sorted(unknown))}, "
+            f"must be any of {', '.join(pipeline.stages)}")
+    pipeline.run(args.targets or ["figure"], args.force, args.jobs)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Area-weighted zonal means of SSM polygons.
+The (zones x polygons) overlap-area matrix is built once per SSM grid and
+zone set, after which the mean of every zone on every date is one sparse
+matrix product with the (polygons x dates) SSM array.
+"""
+
+import argparse
+
+from pathlib import Path
+from typing import Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from scipy import sparse
+from shapely.geometry import MultiPolygon, Polygon
+
+from eo_utils import cache_key, geojson_to_shapely, geometry_digest, load_ssm
+from file_utils import atomic_write
+from regions import get_region
+
+
+def ssm_date_columns(gdf: gpd.GeoDataFrame) -> list:
+    """
+    Names of the D%Y%m%d soil moisture columns in a `load_ssm` GeoDataFrame
+    """
+    return [
+        col for col in gdf.columns
+        if isinstance(col, str) and col[0] == "D" and col[1:].isdigit()]
+
+
+def inside_outside_zones(
+        bbox: Union[Polygon, MultiPolygon],
+        npark: Union[Polygon, MultiPolygon],
+        crs: str = "EPSG:4326"
+        ) -> gpd.GeoSeries:
+    """
+    Inside and outside park zones, split the same way as `get_zonal_means`
+    """
+    inside_park = bbox & npark
+    outside_park = bbox ^ inside_park
+    return gpd.GeoSeries(
+        [inside_park, outside_park], index=["inside", "outside"], crs=crs)
+
+
+def load_weights(
+        cache_file: Union[str, Path, None],
+        key: str
+        ) -> Union[sparse.csr_matrix, None]:
+    """
+    Sparse matrix saved by `save_weights`, None if there is no cache file
+    or it was built from different inputs than key
+    """
+    if cache_file is None or not Path(cache_file).exists():
+        return None
+    cached = np.load(cache_file)
+    if "key" not in cached or str(cached["key"]) != key:
+        return None
+    return sparse.csr_matrix(
+        (cached["data"], cached["indices"], cached["indptr"]),
+        shape=tuple(cached["shape"]))
+
+
+def save_weights(
+        cache_file: Union[str, Path],
+        weights: sparse.csr_matrix,
+        key: str
+        ) -> None:
+    """
+    Save a sparse matrix with the key of the inputs it was built from
+    """
+    with atomic_write(cache_file) as f:
+        np.savez(
+            f,
+            data=weights.data,
+            indices=weights.indices,
+            indptr=weights.indptr,
+            shape=np.array(weights.shape),
+            key=key)
+
+
+def overlap_weights(
+        polygons: Union[gpd.GeoSeries, gpd.GeoDataFrame],
+        zones: Union[gpd.GeoSeries, gpd.GeoDataFrame],
+        cache_file: Union[str, Path, None] = None
+        ) -> sparse.csr_matrix:
+    """
+    Sparse (zones x polygons) matrix of the area each SSM polygon shares
+    with each zone. Areas are computed in a UTM projection if the polygons
+    are in a geographic CRS.
+    If cache_file is given the matrix is loaded from there when it was
+    built from the same polygons and zones, otherwise computed and saved.
+    """
+    key = cache_key(geometry_digest(polygons), geometry_digest(zones))
+    weights = load_weights(cache_file, key)
+    if weights is not None:
+        return weights
+
+    polygons = polygons.geometry
+    zones = zones.geometry.to_crs(polygons.crs)
+    if polygons.crs is not None and polygons.crs.is_geographic:
+        utm_crs = polygons.estimate_utm_crs()
+        polygons = polygons.to_crs(utm_crs)
+        zones = zones.to_crs(utm_crs)
+
+    # candidate pairs from the polygon spatial index, all zones at once
+    zone_ind, poly_ind = polygons.sindex.query(
+        zones.to_numpy(), predicate="intersects")
+    overlap = shapely.area(
+        shapely.intersection(
+            zones.to_numpy()[zone_ind],
+            polygons.to_numpy()[poly_ind]))
+    keep = overlap > 0
+    weights = sparse.csr_matrix(
+        (overlap[keep], (zone_ind[keep], poly_ind[keep])),
+        shape=(len(zones), len(polygons)))
+
+    if cache_file is not None:
+        save_weights(cache_file, weights, key)
+    return weights
+
+
+def zonal_means(
+        weights: sparse.csr_matrix,
+        values: np.ndarray
+        ) -> np.ndarray:
+    """
+    Area-weighted mean of every zone for every date.
+    values is a (polygons x dates) array; NaN polygons are left out of
+    the mean for that date rather than propagating.
+    Returns a (zones x dates) array.
+    """
+    finite = np.isfinite(values)
+    totals = weights @ np.where(finite, values, 0)
+    norm = weights @ finite.astype(values.dtype)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.asarray(totals / norm)
+
+
+def zonal_means_gdf(
+        gdf: gpd.GeoDataFrame,
+        zones: Union[gpd.GeoSeries, gpd.GeoDataFrame],
+        cache_file: Union[str, Path, None] = None
+        ) -> pd.DataFrame:
+    """
+    Shortcut for a `load_ssm` GeoDataFrame.
+    Returns a DataFrame of zone means with one row per date.
+    """
+    date_cols = ssm_date_columns(gdf)
+    weights = overlap_weights(gdf, zones, cache_file)
+    means = zonal_means(weights, gdf[date_cols].to_numpy(dtype=float))
+    return pd.DataFrame(
+        means.T,
+        index=pd.to_datetime(date_cols, format="D%Y%m%d"),
+        columns=zones.index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Mean SSM inside and outside the national park')
+    parser.add_argument(
+        'region',
+        nargs='?',
+        default="liwonde",
+        help='region in regions.toml. Default is liwonde')
+    args = parser.parse_args()
+
+    region = get_region(args.region)
+    gdf = load_ssm(region.shp_file, region.polygon_geojson)
+    zones = inside_outside_zones(
+        geojson_to_shapely(region.aoi), region.park())
+    zone_df = zonal_means_gdf(
+        gdf, zones, region.ssm_path/f"{region.name}_zone_weights.npz")
+    print(zone_df)